@@ -0,0 +1,133 @@
+"""
+SmartBot.uz - AI javoblari keshi
+
+Bounded LRU cache with per-entry TTL for model responses, with an
+optional SQLite tier so gunicorn workers share what they generated.
+"""
+
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+class AIResponseCache:
+    """LRU + TTL cache keyed by (model, prompt hash, max_tokens, temperature)"""
+
+    def __init__(self, max_entries: int = 512, db_path: Optional[str] = None, max_disk_entries: int = 5000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats_data = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'saved_latency': 0.0,
+            'saved_tokens': 0
+        }
+        self.db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS ai_cache ('
+                'key TEXT PRIMARY KEY, value TEXT, expires REAL, latency REAL, tokens INTEGER, created REAL)'
+            )
+            self.db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"AI cache database unavailable: {e}")
+            self.db = None
+
+    @staticmethod
+    def make_key(model: str, prompt: str, max_tokens: int, temperature: float) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return f"{model}:{prompt_hash}:{max_tokens}:{temperature}"
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached response text, or None on miss/expiry"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['expires'] > now:
+                self.entries.move_to_end(key)
+                self._record_hit(entry)
+                return entry['value']
+            if entry:
+                del self.entries[key]
+
+            if self.db is not None:
+                try:
+                    row = self.db.execute(
+                        'SELECT value, expires, latency, tokens FROM ai_cache WHERE key = ? AND expires > ?',
+                        (key, now)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logging.error(f"AI cache read error: {e}")
+                    row = None
+                if row:
+                    entry = {'value': row[0], 'expires': row[1], 'latency': row[2], 'tokens': row[3]}
+                    self._store(key, entry)
+                    self.stats_data['disk_hits'] += 1
+                    self._record_hit(entry)
+                    return entry['value']
+
+            self.stats_data['misses'] += 1
+            return None
+
+    def set(self, key: str, value: str, ttl: int, latency: float = 0.0, tokens: int = 0) -> None:
+        """Store a response for ttl seconds; ttl <= 0 disables caching"""
+        if ttl <= 0 or value is None:
+            return
+        now = time.time()
+        entry = {'value': value, 'expires': now + ttl, 'latency': latency, 'tokens': tokens}
+        with self.lock:
+            self._store(key, entry)
+            if self.db is not None:
+                try:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO ai_cache (key, value, expires, latency, tokens, created) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (key, value, entry['expires'], latency, tokens, now)
+                    )
+                    self.db.execute('DELETE FROM ai_cache WHERE expires <= ?', (now,))
+                    self.db.execute(
+                        'DELETE FROM ai_cache WHERE key NOT IN '
+                        '(SELECT key FROM ai_cache ORDER BY created DESC LIMIT ?)',
+                        (self.max_disk_entries,)
+                    )
+                    self.db.commit()
+                except sqlite3.Error as e:
+                    logging.error(f"AI cache write error: {e}")
+
+    def _store(self, key: str, entry: Dict[str, Any]) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _record_hit(self, entry: Dict[str, Any]) -> None:
+        self.stats_data['hits'] += 1
+        self.stats_data['saved_latency'] += entry.get('latency') or 0.0
+        self.stats_data['saved_tokens'] += entry.get('tokens') or 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate and what the hits saved (this worker only)"""
+        with self.lock:
+            lookups = self.stats_data['hits'] + self.stats_data['misses']
+            return {
+                'entries': len(self.entries),
+                'hits': self.stats_data['hits'],
+                'disk_hits': self.stats_data['disk_hits'],
+                'misses': self.stats_data['misses'],
+                'hit_rate': round(self.stats_data['hits'] / lookups, 4) if lookups else 0.0,
+                'saved_latency_seconds': round(self.stats_data['saved_latency'], 3),
+                'saved_tokens': self.stats_data['saved_tokens'],
+                'disk_tier': self.db is not None
+            }
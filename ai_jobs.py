@@ -0,0 +1,124 @@
+"""
+SmartBot.uz - AI fon vazifalari
+
+Long AI generations run in a bounded thread pool instead of holding the
+request. Job state lives in SQLite so any gunicorn worker can answer
+/ai/jobs/<id>, whichever worker accepted the job.
+"""
+
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable
+
+class AIJobQueue:
+    """Bounded-concurrency job runner with shared, persisted status"""
+
+    def __init__(self, db_path: str, max_workers: int = 2, max_pending: int = 20,
+                 stale_after: int = 600, keep_for: int = 24 * 3600,
+                 stale_after_kinds: Optional[Dict[str, int]] = None):
+        self.db_path = db_path
+        self.max_pending = max_pending
+        self.stale_after = stale_after
+        # Kinds that legitimately run longer get their own cutoff
+        self.stale_after_kinds = stale_after_kinds or {}
+        self.keep_for = keep_for
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-job')
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS ai_jobs ('
+            'id TEXT PRIMARY KEY, kind TEXT, status TEXT, result TEXT, error TEXT, '
+            'created REAL, updated REAL, progress TEXT)'
+        )
+        self.db.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> None:
+        with self.lock:
+            self.db.execute(sql, params)
+            self.db.commit()
+
+    def submit(self, kind: str, func: Callable[..., Dict[str, Any]], *args) -> Optional[str]:
+        """Queue func(*args); returns the job id, or None if this worker's queue is full"""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        try:
+            self._execute(
+                'INSERT INTO ai_jobs (id, kind, status, created, updated) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, 'queued', now, now)
+            )
+            self._execute('DELETE FROM ai_jobs WHERE created < ?', (now - self.keep_for,))
+            self.executor.submit(self._run, job_id, func, args)
+        except Exception:
+            # _run never started, so its finally will not release the slot
+            with self.lock:
+                self.pending -= 1
+            raise
+        return job_id
+
+    def _run(self, job_id: str, func: Callable[..., Dict[str, Any]], args: tuple) -> None:
+        try:
+            self._execute('UPDATE ai_jobs SET status = ?, updated = ? WHERE id = ?',
+                          ('running', time.time(), job_id))
+            self.local.job_id = job_id
+            result = func(*args)
+            self._execute('UPDATE ai_jobs SET status = ?, result = ?, updated = ? WHERE id = ?',
+                          ('done', json.dumps(result, ensure_ascii=False), time.time(), job_id))
+        except Exception as e:
+            logging.error(f"AI job {job_id} failed: {e}")
+            self._execute('UPDATE ai_jobs SET status = ?, error = ?, updated = ? WHERE id = ?',
+                          ('failed', str(e), time.time(), job_id))
+        finally:
+            self.local.job_id = None
+            with self.lock:
+                self.pending -= 1
+
+    def set_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        """Record intermediate progress for a running job"""
+        self._execute('UPDATE ai_jobs SET progress = ?, updated = ? WHERE id = ?',
+                      (json.dumps(progress, ensure_ascii=False), time.time(), job_id))
+
+    def report_progress(self, progress: Dict[str, Any]) -> None:
+        """Record progress for the job running in the calling thread (no-op elsewhere)"""
+        job_id = getattr(self.local, 'job_id', None)
+        if job_id:
+            self.set_progress(job_id, progress)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job status dict, or None if unknown"""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT id, kind, status, result, error, created, updated, progress FROM ai_jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+
+        job = {
+            'job_id': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'result': json.loads(row[3]) if row[3] else None,
+            'error': row[4],
+            'created': row[5],
+            'progress': json.loads(row[7]) if row[7] else None
+        }
+        # A job whose worker died never finishes; report it instead of polling forever.
+        # Progress updates refresh 'updated', so a job reporting progress is never stale
+        stale_after = self.stale_after_kinds.get(job['kind'], self.stale_after)
+        if job['status'] in ('queued', 'running') and time.time() - row[6] > stale_after:
+            job['status'] = 'failed'
+            job['error'] = 'Vazifa vaqti tugadi'
+        return job
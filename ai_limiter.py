@@ -0,0 +1,147 @@
+"""
+SmartBot.uz - AI so'rovlari cheklovchisi
+
+Cross-worker limiter for Gemini calls: a cap on in-flight requests plus
+request-per-minute and token-per-minute buckets, all kept in SQLite so
+every gunicorn worker (and daily_job.py) shares the same budget.
+Lower priority classes may only use part of the budget, so interactive
+chat still gets through while bulk blog generation is running.
+"""
+
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Dict, Tuple
+
+# priority -> (share of in-flight slots, fraction of each bucket kept in reserve, max wait seconds)
+PRIORITY_RULES: Dict[str, Tuple[float, float, float]] = {
+    'interactive': (1.0, 0.0, 3),
+    'standard': (0.75, 0.1, 10),
+    'bulk': (0.5, 0.25, 60)
+}
+
+class AIRateLimitExceeded(Exception):
+    """Raised when a call cannot get a slot within its priority's wait budget"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"AI rate limit exceeded, retry after {retry_after:.0f}s")
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+class AIRateLimiter:
+    """SQLite-backed in-flight cap and token buckets shared between processes"""
+
+    def __init__(self, db_path: str, max_in_flight: int = 4, requests_per_minute: int = 60,
+                 tokens_per_minute: int = 200000, lease_seconds: int = 180):
+        self.max_in_flight = max_in_flight
+        self.capacity = {'requests': float(requests_per_minute), 'tokens': float(tokens_per_minute)}
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, priority TEXT, expires REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL, updated REAL)')
+
+    def _refill(self, now: float) -> Dict[str, float]:
+        levels = {}
+        for name, capacity in self.capacity.items():
+            row = self.db.execute('SELECT level, updated FROM buckets WHERE name = ?', (name,)).fetchone()
+            level = capacity if row is None else min(capacity, row[0] + (now - row[1]) * capacity / 60.0)
+            levels[name] = level
+        return levels
+
+    def _save_levels(self, levels: Dict[str, float], now: float) -> None:
+        for name, level in levels.items():
+            self.db.execute('INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)',
+                            (name, level, now))
+
+    def _try_acquire(self, priority: str, estimated_tokens: int):
+        """One atomic attempt; returns (lease_id, 0) or (None, seconds_to_wait)"""
+        slot_share, reserve, _ = PRIORITY_RULES.get(priority, PRIORITY_RULES['standard'])
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.execute('DELETE FROM leases WHERE expires < ?', (now,))
+                in_flight = self.db.execute('SELECT COUNT(*) FROM leases').fetchone()[0]
+                levels = self._refill(now)
+
+                wait = 0.0
+                if in_flight >= max(1, int(self.max_in_flight * slot_share)):
+                    wait = 1.0
+                needed = {'requests': 1.0, 'tokens': float(estimated_tokens)}
+                for name, amount in needed.items():
+                    floor = self.capacity[name] * reserve
+                    if levels[name] - amount < floor:
+                        missing = amount + floor - levels[name]
+                        wait = max(wait, missing * 60.0 / self.capacity[name])
+
+                if wait:
+                    self.db.execute('COMMIT')
+                    return None, wait
+
+                for name, amount in needed.items():
+                    levels[name] -= amount
+                self._save_levels(levels, now)
+                lease_id = uuid.uuid4().hex
+                self.db.execute('INSERT INTO leases (id, priority, expires) VALUES (?, ?, ?)',
+                                (lease_id, priority, now + self.lease_seconds))
+                self.db.execute('COMMIT')
+                return lease_id, 0
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def acquire(self, priority: str = 'standard', estimated_tokens: int = 1000) -> str:
+        """Wait for a slot up to the priority's budget; raises AIRateLimitExceeded"""
+        max_wait = PRIORITY_RULES.get(priority, PRIORITY_RULES['standard'])[2]
+        deadline = time.monotonic() + max_wait
+        while True:
+            try:
+                lease_id, wait = self._try_acquire(priority, estimated_tokens)
+            except sqlite3.Error as e:
+                # Never let the limiter itself take the site down
+                logging.error(f"AI limiter unavailable: {e}")
+                return ''
+            if lease_id:
+                return lease_id
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise AIRateLimitExceeded(wait)
+            time.sleep(min(wait, 0.25, max(remaining, 0.01)))
+
+    def release(self, lease_id: str, estimated_tokens: int = 0, actual_tokens: int = 0) -> None:
+        """Free the in-flight slot and correct the token bucket with the real usage"""
+        if not lease_id:
+            return
+        now = time.time()
+        with self.lock:
+            try:
+                self.db.execute('BEGIN IMMEDIATE')
+                self.db.execute('DELETE FROM leases WHERE id = ?', (lease_id,))
+                if actual_tokens and estimated_tokens:
+                    levels = self._refill(now)
+                    levels['tokens'] = min(self.capacity['tokens'],
+                                           levels['tokens'] + estimated_tokens - actual_tokens)
+                    self._save_levels(levels, now)
+                self.db.execute('COMMIT')
+            except sqlite3.Error as e:
+                logging.error(f"AI limiter release error: {e}")
+                try:
+                    self.db.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+
+    def status(self) -> Dict[str, float]:
+        """Current in-flight count and bucket levels"""
+        with self.lock:
+            now = time.time()
+            in_flight = self.db.execute('SELECT COUNT(*) FROM leases WHERE expires >= ?', (now,)).fetchone()[0]
+            levels = self._refill(now)
+        return {
+            'in_flight': in_flight,
+            'max_in_flight': self.max_in_flight,
+            'requests_available': round(levels['requests'], 1),
+            'tokens_available': int(levels['tokens'])
+        }
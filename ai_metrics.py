@@ -0,0 +1,212 @@
+"""
+SmartBot.uz - AI chaqiruvlari statistikasi
+
+Per-call accounting of model usage by feature: prompt/output tokens,
+latency, cache hits and outcome. Calls are aggregated into per-minute
+rows with a fixed latency histogram, so rolling windows (last hour, day,
+week) are cheap to summarise. With a db_path the rows live in SQLite and
+are shared by all gunicorn workers and daily_job.py.
+"""
+
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets; one more bucket catches the rest
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+OUTCOMES = ('ok', 'cache_hit', 'error', 'timeout', 'circuit_open', 'rate_limited', 'cancelled')
+
+# USD per million (prompt, output) tokens
+MODEL_PRICES = {
+    'gemini-1.5-flash': (0.075, 0.30),
+    'fake': (0.0, 0.0)
+}
+
+# Exception class names (anywhere in the MRO) with their own outcome; anything else is 'error'
+ERROR_OUTCOMES = {
+    'AIRateLimitExceeded': 'rate_limited',
+    'CircuitOpenError': 'circuit_open',
+    'DeadlineExceeded': 'timeout',
+    'TimeoutError': 'timeout',
+    'Timeout': 'timeout'
+}
+
+HISTOGRAM_COLUMNS = [f'h{i}' for i in range(len(LATENCY_BUCKETS) + 1)]
+COUNTER_COLUMNS = ['calls', 'prompt_tokens', 'output_tokens', 'latency_sum', 'cost'] + HISTOGRAM_COLUMNS
+
+def bucket_index(seconds: float) -> int:
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+def error_outcome(error: Exception) -> str:
+    """Outcome label of a failed call"""
+    for cls in type(error).__mro__:
+        if cls.__name__ in ERROR_OUTCOMES:
+            return ERROR_OUTCOMES[cls.__name__]
+    return 'error'
+
+def call_cost(model: str, prompt_tokens: int, output_tokens: int) -> float:
+    prompt_price, output_price = MODEL_PRICES.get(model, MODEL_PRICES['gemini-1.5-flash'])
+    return (prompt_tokens * prompt_price + output_tokens * output_price) / 1e6
+
+def histogram_quantile(histogram: List[int], quantile: float) -> Optional[float]:
+    """Upper bound of the bucket holding the quantile (None above the last bound)"""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None
+    return None
+
+class AIMetrics:
+    """Rolling per-feature usage, latency histograms and outcomes of model calls"""
+
+    def __init__(self, db_path: Optional[str] = None, retention_days: int = 7):
+        self.retention = retention_days * 86400
+        self.lock = threading.Lock()
+        self.rows: Dict[Tuple[int, str, str], Dict[str, float]] = {}
+        self.last_prune = 0.0
+        self.db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            columns = ', '.join(f'{name} REAL DEFAULT 0' for name in COUNTER_COLUMNS)
+            self.db.execute(
+                f'CREATE TABLE IF NOT EXISTS ai_usage (minute INTEGER, feature TEXT, outcome TEXT, '
+                f'{columns}, latency_max REAL DEFAULT 0, PRIMARY KEY (minute, feature, outcome))'
+            )
+            self.db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"AI metrics database unavailable: {e}")
+            self.db = None
+
+    def record(self, feature: str, latency: float, prompt_tokens: int = 0, output_tokens: int = 0,
+               outcome: str = 'ok', model: str = '') -> None:
+        """Account one model call (or cache hit) under its feature tag"""
+        now = time.time()
+        values = dict.fromkeys(COUNTER_COLUMNS, 0.0)
+        values.update(calls=1, prompt_tokens=prompt_tokens, output_tokens=output_tokens, latency_sum=latency,
+                      cost=call_cost(model, prompt_tokens, output_tokens) if outcome != 'cache_hit' else 0.0)
+        values[HISTOGRAM_COLUMNS[bucket_index(latency)]] = 1
+        key = (int(now // 60), feature, outcome)
+
+        with self.lock:
+            if self.db is None:
+                row = self.rows.setdefault(key, dict.fromkeys(COUNTER_COLUMNS + ['latency_max'], 0.0))
+                for name, value in values.items():
+                    row[name] += value
+                row['latency_max'] = max(row['latency_max'], latency)
+                if now - self.last_prune > 3600:
+                    oldest = int((now - self.retention) // 60)
+                    self.rows = {k: v for k, v in self.rows.items() if k[0] >= oldest}
+                    self.last_prune = now
+                return
+            try:
+                names = ', '.join(COUNTER_COLUMNS)
+                updates = ', '.join(f'{name} = {name} + excluded.{name}' for name in COUNTER_COLUMNS)
+                self.db.execute(
+                    f'INSERT INTO ai_usage (minute, feature, outcome, {names}, latency_max) '
+                    f'VALUES (?, ?, ?, {", ".join("?" * len(COUNTER_COLUMNS))}, ?) '
+                    f'ON CONFLICT (minute, feature, outcome) DO UPDATE SET {updates}, '
+                    f'latency_max = MAX(latency_max, excluded.latency_max)',
+                    (*key, *(values[name] for name in COUNTER_COLUMNS), latency)
+                )
+                if now - self.last_prune > 3600:
+                    self.db.execute('DELETE FROM ai_usage WHERE minute < ?', (int((now - self.retention) // 60),))
+                    self.last_prune = now
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"AI metrics write error: {e}")
+
+    def _rows_since(self, since_minute: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            if self.db is None:
+                return [{'feature': k[1], 'outcome': k[2], **row}
+                        for k, row in self.rows.items() if k[0] >= since_minute]
+            try:
+                cursor = self.db.execute(
+                    f'SELECT feature, outcome, {", ".join(COUNTER_COLUMNS)}, latency_max '
+                    'FROM ai_usage WHERE minute >= ?', (since_minute,)
+                )
+                names = [column[0] for column in cursor.description]
+                return [dict(zip(names, row)) for row in cursor.fetchall()]
+            except sqlite3.Error as e:
+                logging.error(f"AI metrics read error: {e}")
+                return []
+
+    def summary(self, window: int = 3600) -> Dict[str, Any]:
+        """Per-feature totals, outcomes and latency percentiles over the last window seconds
+
+        Latency percentiles cover calls that reached the model; cache hits
+        are counted separately.
+        """
+        features: Dict[str, Dict[str, Any]] = {}
+        for row in self._rows_since(int((time.time() - window) // 60)):
+            item = features.setdefault(row['feature'], {
+                'feature': row['feature'], 'calls': 0, 'cache_hits': 0, 'outcomes': {},
+                'prompt_tokens': 0, 'output_tokens': 0, 'cost_usd': 0.0,
+                'latency_sum': 0.0, 'latency_max': 0.0, 'histogram': [0] * len(HISTOGRAM_COLUMNS)
+            })
+            calls = int(row['calls'])
+            item['calls'] += calls
+            item['outcomes'][row['outcome']] = item['outcomes'].get(row['outcome'], 0) + calls
+            item['prompt_tokens'] += int(row['prompt_tokens'])
+            item['output_tokens'] += int(row['output_tokens'])
+            item['cost_usd'] += row['cost']
+            if row['outcome'] == 'cache_hit':
+                item['cache_hits'] += calls
+                continue
+            item['latency_sum'] += row['latency_sum']
+            item['latency_max'] = max(item['latency_max'], row['latency_max'])
+            for i, column in enumerate(HISTOGRAM_COLUMNS):
+                item['histogram'][i] += int(row[column])
+
+        result = []
+        for item in sorted(features.values(), key=lambda f: f['cost_usd'], reverse=True):
+            model_calls = sum(item['histogram'])
+            failed = item['calls'] - item['cache_hits'] - item['outcomes'].get('ok', 0)
+            result.append({
+                'feature': item['feature'],
+                'calls': item['calls'],
+                'cache_hits': item['cache_hits'],
+                'cache_hit_rate': round(item['cache_hits'] / item['calls'], 4) if item['calls'] else 0.0,
+                'failures': failed,
+                'outcomes': item['outcomes'],
+                'prompt_tokens': item['prompt_tokens'],
+                'output_tokens': item['output_tokens'],
+                'cost_usd': round(item['cost_usd'], 6),
+                'latency': {
+                    'avg': round(item['latency_sum'] / model_calls, 3) if model_calls else None,
+                    'p50': histogram_quantile(item['histogram'], 0.5),
+                    'p95': histogram_quantile(item['histogram'], 0.95),
+                    'p99': histogram_quantile(item['histogram'], 0.99),
+                    'max': round(item['latency_max'], 3) if model_calls else None
+                },
+                'histogram': item['histogram']
+            })
+        return {
+            'window': window,
+            'buckets': list(LATENCY_BUCKETS),
+            'features': result,
+            'totals': {
+                'calls': sum(f['calls'] for f in result),
+                'cache_hits': sum(f['cache_hits'] for f in result),
+                'failures': sum(f['failures'] for f in result),
+                'prompt_tokens': sum(f['prompt_tokens'] for f in result),
+                'output_tokens': sum(f['output_tokens'] for f in result),
+                'cost_usd': round(sum(f['cost_usd'] for f in result), 6)
+            }
+        }
@@ -0,0 +1,341 @@
+"""
+SmartBot.uz - AI provayderlari
+
+Small interface between the app and the language model: generate(),
+stream() and count_tokens(). GeminiProvider wraps google-generativeai;
+FakeProvider answers locally and deterministically with configurable
+latency, token rate and failure injection, so AI routes and the
+marketing pipeline can be tested and benchmarked without network.
+Select with AI_PROVIDER=gemini|fake (see provider_from_env).
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import random
+import logging
+import threading
+from typing import Optional, Dict, Any, Iterator, List
+
+from prompt_budget import count_tokens
+from resilience import TransientError
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+DEFAULT_GEMINI_MODEL = 'gemini-1.5-flash'
+
+class AIResult:
+    """Generated text with token usage"""
+
+    def __init__(self, text: str, prompt_tokens: int = 0, output_tokens: int = 0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.output_tokens
+
+class AIStream:
+    """Iterator of text chunks; token usage is filled in once it is exhausted"""
+
+    def __init__(self, chunks: Iterator[str], prompt_tokens: int = 0):
+        self._chunks = chunks
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = 0
+        self.parts: List[str] = []
+
+    def __iter__(self) -> Iterator[str]:
+        for text in self._chunks:
+            if text:
+                self.parts.append(text)
+                yield text
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.output_tokens
+
+class AIProvider:
+    """Interface every model backend implements"""
+
+    name = 'base'
+    model_name = ''
+
+    def generate(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                 json_schema: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> AIResult:
+        """Complete answer; errors worth retrying are recognised by resilience.is_transient"""
+        raise NotImplementedError
+
+    def stream(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+               timeout: Optional[float] = None) -> AIStream:
+        """Open a streamed answer; the request is sent before this returns"""
+        raise NotImplementedError
+
+    def count_tokens(self, text: str) -> int:
+        """Local token estimate (no network round-trip)"""
+        return count_tokens(text)
+
+class GeminiProvider(AIProvider):
+    """Google Gemini through google-generativeai"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key: str, model_name: str = DEFAULT_GEMINI_MODEL):
+        if genai is None:
+            raise RuntimeError('google-generativeai is not installed')
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    @staticmethod
+    def _config(max_tokens: Optional[int], temperature: Optional[float],
+                json_schema: Optional[Dict[str, Any]] = None):
+        options: Dict[str, Any] = {}
+        if max_tokens:
+            options['max_output_tokens'] = max_tokens
+        if temperature is not None:
+            options['temperature'] = temperature
+        if json_schema:
+            options.update(response_mime_type='application/json', response_schema=json_schema)
+        return genai.types.GenerationConfig(**options)
+
+    @staticmethod
+    def _usage(response) -> Dict[str, int]:
+        usage = getattr(response, 'usage_metadata', None)
+        return {'prompt': getattr(usage, 'prompt_token_count', 0) or 0,
+                'output': getattr(usage, 'candidates_token_count', 0) or 0}
+
+    def generate(self, prompt, max_tokens=None, temperature=None, json_schema=None, timeout=None):
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self._config(max_tokens, temperature, json_schema),
+            request_options={'timeout': timeout} if timeout else None
+        )
+        text = response.text
+        usage = self._usage(response)
+        return AIResult(text, usage['prompt'] or self.count_tokens(prompt),
+                        usage['output'] or self.count_tokens(text))
+
+    def stream(self, prompt, max_tokens=None, temperature=None, timeout=None):
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self._config(max_tokens, temperature),
+            stream=True,
+            request_options={'timeout': timeout} if timeout else None
+        )
+        result = AIStream(iter(()), self.count_tokens(prompt))
+
+        def chunks():
+            for chunk in response:
+                yield getattr(chunk, 'text', '')
+            usage = self._usage(response)
+            result.prompt_tokens = usage['prompt'] or result.prompt_tokens
+            result.output_tokens = usage['output'] or self.count_tokens(result.text)
+
+        result._chunks = chunks()
+        return result
+
+class FakeProviderError(TransientError):
+    """Injected failure of the fake backend (retryable, like a 503)"""
+
+# Vocabulary for generated filler text
+FAKE_WORDS = (
+    "biznes", "mijozlar", "bot", "telegram", "avtomatlashtirish", "sun'iy", "intellekt", "xizmat",
+    "savdo", "tizim", "yechim", "tezkor", "samarali", "zamonaviy", "kompaniya", "jarayon",
+    "ma'lumot", "tahlil", "integratsiya", "vaqt", "natija", "imkoniyat", "hisobot", "buyurtma",
+    "SmartBot.uz", "yordamchi", "chatbot", "raqamli", "platforma", "sifat", "foyda", "strategiya"
+)
+
+NUMBERED_LINE_RE = re.compile(r'(?m)^\s*[^\n:]{1,40}?\s\d+:\s*\S')
+
+class FakeProvider(AIProvider):
+    """Deterministic offline model for tests and benchmarks
+
+    The same prompt always gives the same answer. A call takes
+    latency + output tokens / tokens_per_second seconds (0 = no delay);
+    a call that would outlast its timeout sleeps for the timeout and
+    raises TimeoutError. failure_rate fails that share of calls with
+    FakeProviderError, drawn from a seeded generator; fail_next() queues
+    explicit failures.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency: float = 0.0, tokens_per_second: float = 0.0, failure_rate: float = 0.0,
+                 seed: int = 0, max_output_tokens: int = 1024):
+        self.model_name = 'fake'
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.max_output_tokens = max_output_tokens
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.queued_failures: List[Exception] = []
+        self.stats_data = {'calls': 0, 'streams': 0, 'failures': 0, 'timeouts': 0,
+                           'prompt_tokens': 0, 'output_tokens': 0}
+
+    def fail_next(self, count: int = 1, error: Optional[Exception] = None) -> None:
+        """Make the next count calls fail with error (FakeProviderError by default)"""
+        with self.lock:
+            self.queued_failures.extend(error or FakeProviderError('Injected failure') for _ in range(count))
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats_data)
+
+    def _start_call(self, kind: str) -> None:
+        with self.lock:
+            self.stats_data[kind] += 1
+            error = self.queued_failures.pop(0) if self.queued_failures else None
+            if error is None and self.failure_rate and self.rng.random() < self.failure_rate:
+                error = FakeProviderError('Simulated provider outage')
+            if error is not None:
+                self.stats_data['failures'] += 1
+        if error is not None:
+            if self.latency:
+                time.sleep(self.latency)
+            raise error
+
+    def _duration(self, output_tokens: int) -> float:
+        rate = output_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+        return self.latency + rate
+
+    def _check_timeout(self, seconds: float, timeout: Optional[float]) -> None:
+        if timeout is not None and seconds > timeout:
+            time.sleep(timeout)
+            with self.lock:
+                self.stats_data['timeouts'] += 1
+            raise TimeoutError(f'Fake provider call exceeded {timeout:.1f}s')
+
+    def _record(self, prompt_tokens: int, output_tokens: int) -> None:
+        with self.lock:
+            self.stats_data['prompt_tokens'] += prompt_tokens
+            self.stats_data['output_tokens'] += output_tokens
+
+    def _rng_for(self, prompt: str) -> random.Random:
+        return random.Random(zlib.crc32(prompt.encode('utf-8')) ^ self.seed)
+
+    @staticmethod
+    def _sentences(rng: random.Random, words: int) -> str:
+        result = []
+        while words > 0:
+            length = min(words, rng.randint(6, 14))
+            sentence = ' '.join(rng.choice(FAKE_WORDS) for _ in range(length))
+            result.append(sentence[0].upper() + sentence[1:] + '.')
+            words -= length
+        return ' '.join(result)
+
+    def _html(self, rng: random.Random, words: int) -> str:
+        paragraphs = max(1, words // 80)
+        body = ''.join(f"<p>{self._sentences(rng, words // paragraphs)}</p>" for _ in range(paragraphs))
+        return f"<h2>{self._sentences(rng, 6).rstrip('.')}</h2>{body}"
+
+    def _text(self, prompt: str, max_tokens: Optional[int]) -> str:
+        rng = self._rng_for(prompt)
+        words = int(min(max_tokens or self.max_output_tokens, self.max_output_tokens) * 0.75)
+        if 'HTML' in prompt:
+            return self._html(rng, words)
+        return self._sentences(rng, words)
+
+    def _json_value(self, schema: Dict[str, Any], rng: random.Random, key: str, words: int, items: int) -> Any:
+        kind = schema.get('type')
+        if kind == 'array':
+            return [self._json_value(schema.get('items', {}), rng, key, words // max(1, items), 1)
+                    for _ in range(items)]
+        if kind == 'object':
+            return {name: self._json_value(sub, rng, name, words, items)
+                    for name, sub in schema.get('properties', {}).items()}
+        if kind in ('integer', 'number'):
+            return rng.randint(0, 100)
+        if kind == 'boolean':
+            return rng.random() < 0.5
+        if key in ('title', 'topic', 'name', 'label'):
+            return self._sentences(rng, 6).rstrip('.')
+        return self._html(rng, max(20, int(words * 0.9)))
+
+    def _json(self, prompt: str, max_tokens: Optional[int], schema: Dict[str, Any]) -> str:
+        rng = self._rng_for(prompt)
+        # Arrays get one element per numbered line ("Mavzu 1: ...") of the prompt
+        items = max(1, len(NUMBERED_LINE_RE.findall(prompt)))
+        words = int((max_tokens or self.max_output_tokens) * 0.75)
+        return json.dumps(self._json_value(schema, rng, '', words, items), ensure_ascii=False)
+
+    def generate(self, prompt, max_tokens=None, temperature=None, json_schema=None, timeout=None):
+        self._start_call('calls')
+        text = self._json(prompt, max_tokens, json_schema) if json_schema else self._text(prompt, max_tokens)
+        prompt_tokens, output_tokens = self.count_tokens(prompt), self.count_tokens(text)
+        seconds = self._duration(output_tokens)
+        self._check_timeout(seconds, timeout)
+        if seconds:
+            time.sleep(seconds)
+        self._record(prompt_tokens, output_tokens)
+        return AIResult(text, prompt_tokens, output_tokens)
+
+    def stream(self, prompt, max_tokens=None, temperature=None, timeout=None):
+        self._start_call('streams')
+        text = self._text(prompt, max_tokens)
+        prompt_tokens = self.count_tokens(prompt)
+        self._check_timeout(self.latency, timeout)
+        if self.latency:
+            time.sleep(self.latency)
+        result = AIStream(iter(()), prompt_tokens)
+
+        def chunks():
+            words = text.split(' ')
+            for start in range(0, len(words), 8):
+                chunk = ' '.join(words[start:start + 8]) + (' ' if start + 8 < len(words) else '')
+                if self.tokens_per_second:
+                    time.sleep(self.count_tokens(chunk) / self.tokens_per_second)
+                yield chunk
+            result.output_tokens = self.count_tokens(text)
+            self._record(prompt_tokens, result.output_tokens)
+
+        result._chunks = chunks()
+        return result
+
+def create_provider(name: str, **options) -> AIProvider:
+    """Provider by name: 'gemini' (needs api_key) or 'fake'"""
+    if name == 'fake':
+        return FakeProvider(**options)
+    if name == 'gemini':
+        return GeminiProvider(**options)
+    raise ValueError(f"Unknown AI provider: {name}")
+
+def provider_from_env(environ=None) -> Optional[AIProvider]:
+    """Provider configured by AI_PROVIDER and its settings, or None when unavailable
+
+    AI_PROVIDER=gemini (default) uses GEMINI_API_KEY. AI_PROVIDER=fake reads
+    AI_FAKE_LATENCY, AI_FAKE_TOKENS_PER_SECOND, AI_FAKE_FAILURE_RATE and AI_FAKE_SEED.
+    """
+    env = os.environ if environ is None else environ
+    name = env.get('AI_PROVIDER', 'gemini').lower()
+    try:
+        if name == 'fake':
+            return create_provider(
+                'fake',
+                latency=float(env.get('AI_FAKE_LATENCY', 0)),
+                tokens_per_second=float(env.get('AI_FAKE_TOKENS_PER_SECOND', 0)),
+                failure_rate=float(env.get('AI_FAKE_FAILURE_RATE', 0)),
+                seed=int(env.get('AI_FAKE_SEED', 0))
+            )
+        if name == 'gemini':
+            api_key = env.get('GEMINI_API_KEY')
+            if not api_key or genai is None:
+                logging.warning("GEMINI_API_KEY not found or google-generativeai not available")
+                return None
+            return create_provider('gemini', api_key=api_key,
+                                   model_name=env.get('GEMINI_MODEL', DEFAULT_GEMINI_MODEL))
+        logging.error(f"Unknown AI_PROVIDER '{name}'")
+    except Exception as e:
+        logging.error(f"AI provider initialization failed: {e}")
+    return None
@@ -9,18 +9,33 @@ import re
 import requests
 import json
 import uuid
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
 import mimetypes
-import PyPDF2
 from datetime import datetime, timedelta
 import base64
 from io import BytesIO
 import threading
 import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import schedule
+from blog_search import BlogSearchIndex, RelatedPostsIndex
+from ai_cache import AIResponseCache
+from ai_jobs import AIJobQueue
+from ai_limiter import AIRateLimiter, AIRateLimitExceeded
+from ai_provider import provider_from_env
+from prompt_budget import PromptTemplate, fit_text
+from doc_analysis import split_pages, map_reduce, pages_label
+from pdf_extract import PDFExtractor, PDFExtractionError, PDFExtractionTimeout
+from document_cache import DocumentCache
+from telegram_outbox import TelegramOutbox
+from json_store import locked, write_json
+from ai_metrics import AIMetrics, error_outcome
+from chat_memory import ChatMemoryStore
+from faq_cache import FAQCache, build_price_faq
+from article_batch import ARTICLE_SCHEMA, generate_articles
+from contact_classifier import ContactClassifier, SEED_EXAMPLES, cross_validate
+from resilience import (Deadline, TransientError, CircuitOpenError, DeadlineExceeded,
+                        get_breaker, breaker_status, call_with_retry, is_transient)
 try:
     from telegram import Bot
     from telegram.error import TelegramError
@@ -81,17 +96,9 @@ if TELEGRAM_BOT_TOKEN and Bot:
 # Admin Configuration
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "smartbot123")
 
-# AI Configuration
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-if GEMINI_API_KEY and genai:
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        AI_MODEL = genai.GenerativeModel('gemini-1.5-flash')
-    except Exception as e:
-        logging.error(f"Gemini AI initialization failed: {e}")
-        AI_MODEL = None
-else:
-    AI_MODEL = None
+# AI Configuration: AI_PROVIDER=gemini (GEMINI_API_KEY) or AI_PROVIDER=fake for offline runs
+AI_PROVIDER = provider_from_env()
+AI_MODEL_NAME = AI_PROVIDER.model_name if AI_PROVIDER else 'gemini-1.5-flash'
 
 # Data storage files
 DATA_DIR = "data"
@@ -99,6 +106,170 @@ SERVICES_FILE = os.path.join(DATA_DIR, "services.json")
 PORTFOLIO_FILE = os.path.join(DATA_DIR, "portfolio.json")
 BLOG_FILE = os.path.join(DATA_DIR, "blog.json")
 MESSAGES_FILE = os.path.join(DATA_DIR, "messages.json")
+ADMIN_EVENTS_FILE = os.path.join(DATA_DIR, "admin_events.json")
+BLOG_RELATED_FILE = os.path.join(DATA_DIR, "blog_related.json")
+FAQ_FILE = os.path.join(DATA_DIR, "faq.json")
+
+# Admin SSE stream settings (seconds). Each open stream holds a gthread
+# thread, so a worker serves at most SSE_MAX_STREAMS at a time; extra tabs
+# are told to reconnect after SSE_BUSY_RETRY seconds
+SSE_POLL_INTERVAL = 1
+SSE_HEARTBEAT_INTERVAL = 15
+SSE_STREAM_LIFETIME = 60
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", 2))
+SSE_BUSY_RETRY = 30
+
+# Public listing pages
+BLOG_PAGE_SIZE = 9
+PORTFOLIO_PAGE_SIZE = 9
+PORTFOLIO_CATEGORY_LABELS = {
+    'bot': 'Telegram Botlar',
+    'web': 'Web Saytlar',
+    'automation': 'Avtomatlashtirish',
+    'ai': 'AI/Chatbot'
+}
+
+# Blog feed (RSS/Atom)
+SITE_URL = os.environ.get("SITE_URL", "https://smartbot.uz")
+FEED_SIZE = 50
+
+# Admin stats snapshot cache
+ADMIN_STATS_TTL = 5  # seconds
+_admin_stats_cache = {'expires': 0, 'stats': None, 'etag': None}
+_admin_stats_lock = threading.Lock()
+
+# AI response cache: TTL per use case in seconds (0 = never cached)
+AI_CACHE_TTLS = {
+    'chat': 6 * 3600,
+    'contact': 7 * 24 * 3600,
+    'document': 24 * 3600,
+    'case_study': 24 * 3600,
+    'general': 3600,
+    'blog': 0,
+    'marketing': 0
+}
+AI_CACHE_MAX_ENTRIES = 512
+AI_CACHE_DB = os.environ.get("AI_CACHE_DB", os.path.join(DATA_DIR, "ai_cache.sqlite3"))
+
+# Shared Gemini limiter (all workers): in-flight cap and per-minute budgets
+AI_LIMITER_DB = os.path.join(DATA_DIR, "ai_limiter.sqlite3")
+AI_MAX_IN_FLIGHT = int(os.environ.get("AI_MAX_IN_FLIGHT", 4))
+AI_REQUESTS_PER_MINUTE = int(os.environ.get("AI_REQUESTS_PER_MINUTE", 60))
+AI_TOKENS_PER_MINUTE = int(os.environ.get("AI_TOKENS_PER_MINUTE", 200000))
+# Priority class per use case: interactive calls may use the whole budget, bulk only part of it
+AI_PRIORITIES = {
+    'chat': 'interactive',
+    'contact': 'interactive',
+    'general': 'interactive',
+    'document': 'standard',
+    'case_study': 'standard',
+    'blog': 'bulk',
+    'marketing': 'bulk'
+}
+
+# Per-call AI usage accounting: feature tag per use case and rolling windows for the admin page
+AI_METRICS_DB = os.path.join(DATA_DIR, "ai_metrics.sqlite3")
+AI_FEATURE_TAGS = {
+    'contact': 'analyze',
+    'general': 'analyze',
+    'case_study': 'case-study'
+}
+AI_METRICS_WINDOWS = {'1h': 3600, '24h': 24 * 3600, '7d': 7 * 24 * 3600}
+
+# Input token budget per use case (whole prompt); larger inputs are trimmed locally
+AI_INPUT_BUDGETS = {
+    'chat': 1500,
+    'contact': 600,
+    'document': 6000,
+    'general': 2000,
+    'case_study': 2000,
+    'blog': 400,
+    'marketing': 600
+}
+# Single user-supplied fields: chat message and contact/analyze text
+CHAT_MESSAGE_TOKENS = 400
+CONTACT_TEXT_TOKENS = 400
+
+# Large documents: pages are packed into chunks, summarised on a bounded
+# pool and reduced into the final analysis within DOCUMENT_DEADLINE seconds
+DOCUMENT_CHUNK_TOKENS = 3000
+DOCUMENT_MAX_CHUNKS = 24
+DOCUMENT_MAP_WORKERS = int(os.environ.get("DOCUMENT_MAP_WORKERS", 3))
+DOCUMENT_DEADLINE = 100
+DOCUMENT_SUMMARY_TOKENS = 400
+
+# PDF parsing runs in child processes (see pdf_extract.py); reading stops
+# once the map-reduce analysis has as much text as it can use
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", 2))
+PDF_TIMEOUT = 20
+PDF_MAX_PAGES = 300
+PDF_MAX_TOKENS = DOCUMENT_CHUNK_TOKENS * DOCUMENT_MAX_CHUNKS
+PDF_MEMORY_MB = 512
+UPLOAD_READ_SIZE = 64 * 1024
+
+# Repeat uploads of the same PDF reuse its extracted text and analysis
+DOCUMENT_CACHE_DB = os.path.join(DATA_DIR, "document_cache.sqlite3")
+DOCUMENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Background AI jobs (blog / case study generation)
+AI_JOBS_DB = os.path.join(DATA_DIR, "ai_jobs.sqlite3")
+AI_JOB_WORKERS = int(os.environ.get("AI_JOB_WORKERS", 2))
+# Results of these kinds are only shown to the admin; a job without
+# progress for its stale time (default 600 s) is reported as failed
+ADMIN_AI_JOB_KINDS = {'marketing'}
+AI_JOB_STALE_AFTER = {'marketing': 3600}
+
+# Chatbot conversation memory per browser session: recent turns within
+# CHAT_TURN_TOKENS, older ones folded into a summary of CHAT_SUMMARY_TOKENS
+CHAT_MEMORY_DB = os.path.join(DATA_DIR, "chat_memory.sqlite3")
+CHAT_MEMORY_SESSIONS = 2000
+CHAT_TURN_TOKENS = 600
+CHAT_SUMMARY_TOKENS = 200
+
+# Chat FAQ cache: minimum n-gram similarity for curated and for learned answers
+FAQ_CANNED_THRESHOLD = 0.5
+FAQ_LEARNED_THRESHOLD = 0.7
+FAQ_LEARNED_MAX = 500
+
+# Admin marketing run: posts per run and parallel generations (matches the
+# two in-flight slots the shared limiter gives bulk calls by default)
+MARKETING_POSTS_PER_RUN = 5
+MARKETING_WORKERS = int(os.environ.get("MARKETING_WORKERS", 2))
+# Ask for several articles per call as one JSON array ("0" = one call per post)
+MARKETING_BATCH = os.environ.get("MARKETING_BATCH", "1") == "1"
+MARKETING_TOKENS_PER_POST = 2500
+
+# Contact routing: local classifier answers when at least this confident;
+# a small sample of confident answers is still checked against Gemini
+CONTACT_CLASSIFIER_THRESHOLD = 0.7
+CONTACT_CLASSIFIER_AUDIT_RATE = 0.05
+CONTACT_SERVICE_NAMES = {
+    'telegram_bot': 'Telegram Bot Yaratish',
+    'chatbot': 'AI Chatbot Integratsiya',
+    'automation': 'Biznes Avtomatlashtirish',
+    'web_development': 'Web Sayt Yaratish',
+    'ai_integration': 'AI Texnologiyalar'
+}
+# Contact messages are enriched and announced in the background; pending
+# ones older than CONTACT_ENRICH_STALE seconds are queued again. A message
+# whose classification keeps failing on a transient error (rate limit, open
+# breaker, timeout) is given up after CONTACT_ENRICH_ATTEMPTS attempts
+CONTACT_ENRICH_WORKERS = 2
+CONTACT_ENRICH_STALE = 300
+CONTACT_ENRICH_ATTEMPTS = 5
+
+# Outbound call resilience: retries, per-dependency circuit breakers (shared
+# by all workers and daily_job.py) and time budgets in seconds
+RESILIENCE_DB = os.path.join(DATA_DIR, "resilience.sqlite3")
+REQUEST_DEADLINE = 30
+BACKGROUND_DEADLINE = 180
+AI_CALL_TIMEOUT = 60
+TELEGRAM_TIMEOUT = 10
+
+# Every Telegram message goes through a durable outbox (telegram_outbox.py);
+# a dispatcher thread per worker drains it at least every TELEGRAM_OUTBOX_POLL seconds
+TELEGRAM_OUTBOX_DB = os.path.join(DATA_DIR, "telegram_outbox.sqlite3")
+TELEGRAM_OUTBOX_POLL = 15
 
 # Create directories if they don't exist
 if not os.path.exists(DATA_DIR):
@@ -161,6 +332,10 @@ def initialize_data_files():
     # Initialize messages file
     if not os.path.exists(MESSAGES_FILE):
         save_data(MESSAGES_FILE, [])
+    
+    # Chatbot canned answers start with the prices from services.json
+    if not os.path.exists(FAQ_FILE):
+        save_data(FAQ_FILE, build_price_faq(load_data(SERVICES_FILE)))
 
 def load_data(filename):
     try:
@@ -169,24 +344,66 @@ def load_data(filename):
     except:
         return []
 
+def iter_data(filename, chunk_size=65536):
+    """Stream records from a JSON array file one by one without loading it all"""
+    decoder = json.JSONDecoder()
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            buffer = ''
+            pos = 0
+            eof = False
+            started = False
+            while True:
+                # Skip whitespace and separators between records
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos >= len(buffer):
+                    buffer = f.read(chunk_size) if not eof else ''
+                    pos = 0
+                    if not buffer:
+                        return
+                    continue
+                if not started:
+                    if buffer[pos] != '[':
+                        return
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == ']':
+                    return
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    if eof:
+                        return
+                    chunk = f.read(chunk_size)
+                    eof = not chunk
+                    buffer = buffer[pos:] + chunk
+                    pos = 0
+                    continue
+                pos = end
+                yield record
+    except (OSError, ValueError) as e:
+        app.logger.error(f"Failed to stream data from {filename}: {e}")
+        return
+
 def save_data(filename, data):
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # Atomic replace: readers in other workers never see a half-written file
+        write_json(filename, data)
+        # Local writes invalidate the admin stats snapshot immediately
+        _admin_stats_cache['expires'] = 0
         return True
     except Exception as e:
         app.logger.error(f"Failed to save data to {filename}: {e}")
         return False
 
 def save_message(name, email, phone, service, budget, message):
-    """Save contact message to JSON file"""
+    """Save contact message to JSON file; returns the stored record or None"""
     from datetime import datetime
     
-    messages = load_data(MESSAGES_FILE)
-    new_id = max([m.get('id', 0) for m in messages], default=0) + 1
-    
     new_message = {
-        'id': new_id,
+        'id': None,
         'name': name,
         'email': email,
         'phone': phone if phone else '',
@@ -195,41 +412,337 @@ def save_message(name, email, phone, service, budget, message):
         'message': message,
         'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'status': 'yangi',  # yangi, ko'rilgan, javob_berilgan
-        'telegram_sent': False
+        'telegram_sent': False,
+        'enrichment': 'pending'  # pending, done, failed
     }
     
-    messages.append(new_message)
-    return save_data(MESSAGES_FILE, messages)
+    # Every worker and daily_job.py write messages.json; ids are assigned under the file lock
+    with locked(MESSAGES_FILE):
+        messages = load_data(MESSAGES_FILE)
+        new_message['id'] = max([m.get('id', 0) for m in messages], default=0) + 1
+        messages.append(new_message)
+        saved = save_data(MESSAGES_FILE, messages)
+    if saved:
+        publish_message_counts(messages)
+        return new_message
+    return None
+
+def update_message(message_id, defaults=None, **fields):
+    """Set fields on a stored contact message; returns the updated record or None
+
+    defaults are only set where the record has no value yet.
+    """
+    with locked(MESSAGES_FILE):
+        messages = load_data(MESSAGES_FILE)
+        record = next((m for m in messages if m.get('id') == message_id), None)
+        if record is None:
+            return None
+        record.update(fields)
+        for name, value in (defaults or {}).items():
+            if not record.get(name):
+                record[name] = value
+        saved = save_data(MESSAGES_FILE, messages)
+    if saved:
+        # Bumps the events version so open admin pages refresh the record
+        publish_message_counts(messages)
+        return record
+    return None
+
+def publish_message_counts(messages):
+    """Publish message counts for admin SSE streams in every worker"""
+    try:
+        # Read and replace under the file lock so concurrent bumps never reuse a version
+        with locked(ADMIN_EVENTS_FILE):
+            state = read_admin_events_state()
+            write_json(ADMIN_EVENTS_FILE, {
+                'version': state.get('version', 0) + 1,
+                'unread': len([m for m in messages if m.get('status') == 'yangi']),
+                'total': len(messages)
+            })
+    except Exception as e:
+        app.logger.error(f"Failed to publish admin events: {e}")
+
+def read_admin_events_state():
+    """Read the latest published message counts"""
+    try:
+        with open(ADMIN_EVENTS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except:
+        return {}
+
+# ========================
+# BLOG SEARCH INDEX
+# ========================
+
+blog_index = BlogSearchIndex()
+_blog_index_state = {'mtime': None}
+_blog_index_sync_lock = threading.Lock()
+
+def sync_blog_index():
+    """Re-index only changed posts when blog.json was written by another worker or daily_job.py"""
+    try:
+        mtime = os.stat(BLOG_FILE).st_mtime_ns
+    except OSError:
+        return
+    if mtime == _blog_index_state['mtime']:
+        return
+    with _blog_index_sync_lock:
+        if mtime == _blog_index_state['mtime']:
+            return
+        changes = blog_index.sync(load_data(BLOG_FILE))
+        _blog_index_state['mtime'] = mtime
+        if changes:
+            app.logger.info(f"Blog search index updated: {changes} changes")
+
+related_index = RelatedPostsIndex(BLOG_RELATED_FILE, load_posts=lambda: load_data(BLOG_FILE))
+
+def index_blog_post(post=None, removed_id=None):
+    """Update the search and related-posts indexes right after this worker saved blog.json"""
+    try:
+        if post is not None:
+            related_index.add(post)
+        if removed_id is not None:
+            related_index.remove(removed_id)
+    except Exception as e:
+        app.logger.error(f"Related posts update error: {e}")
+
+    if _blog_index_state['mtime'] is None:
+        # Index not built yet in this worker - the first load picks the change up
+        sync_blog_index()
+        return
+    with _blog_index_sync_lock:
+        if post is not None:
+            blog_index.upsert(post)
+        if removed_id is not None:
+            blog_index.remove(removed_id)
+        try:
+            _blog_index_state['mtime'] = os.stat(BLOG_FILE).st_mtime_ns
+        except OSError:
+            pass
+
+# ========================
+# CATEGORY FACETS
+# ========================
+
+_category_index_cache = {}
+_category_index_lock = threading.Lock()
+
+def get_category_index(filename, labels=None):
+    """Items, category -> positions index and facet counts, rebuilt once per data version"""
+    try:
+        version = os.stat(filename).st_mtime_ns
+    except OSError:
+        version = None
+
+    cached = _category_index_cache.get(filename)
+    if cached and cached['version'] == version:
+        return cached
+
+    with _category_index_lock:
+        cached = _category_index_cache.get(filename)
+        if cached and cached['version'] == version:
+            return cached
+
+        items = load_data(filename)
+        positions = {}
+        facet_labels = {}
+        for position, item in enumerate(items):
+            category = item.get('category') or ''
+            key = create_slug(category)
+            if not key:
+                continue
+            positions.setdefault(key, []).append(position)
+            facet_labels.setdefault(key, (labels or {}).get(key, category))
+
+        facets = [
+            {'key': key, 'label': facet_labels[key], 'count': len(pos)}
+            for key, pos in sorted(positions.items(), key=lambda kv: (-len(kv[1]), kv[0]))
+        ]
+        index = {'version': version, 'items': items, 'positions': positions, 'facets': facets}
+        _category_index_cache[filename] = index
+        return index
+
+def paginate_category(index, category, page, page_size, start=0):
+    """One page of items for a category (or all items from start); returns (items, next_page, total)"""
+    if category:
+        positions = index['positions'].get(category, [])
+    else:
+        positions = range(start, len(index['items']))
+
+    total = len(positions)
+    offset = (page - 1) * page_size
+    items = [index['items'][p] for p in positions[offset:offset + page_size]]
+    next_page = page + 1 if offset + page_size < total else None
+    return items, next_page, total
+
+def get_page_arg():
+    """Current ?page= value (1-based)"""
+    try:
+        return max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        return 1
 
 # ========================
 # AI HELPER FUNCTIONS
 # ========================
 
-def get_ai_response(prompt, max_tokens=1000):
-    """Get response from Gemini AI"""
-    if not AI_MODEL:
+ai_cache = AIResponseCache(AI_CACHE_MAX_ENTRIES, AI_CACHE_DB or None)
+ai_limiter = AIRateLimiter(AI_LIMITER_DB, AI_MAX_IN_FLIGHT, AI_REQUESTS_PER_MINUTE, AI_TOKENS_PER_MINUTE)
+gemini_breaker = get_breaker('gemini', failure_threshold=5, reset_timeout=30, db_path=RESILIENCE_DB)
+telegram_breaker = get_breaker('telegram', failure_threshold=5, reset_timeout=60, db_path=RESILIENCE_DB)
+
+def current_deadline():
+    """Time budget shared by every outbound call made while handling this request"""
+    from flask import g, has_request_context
+    if not has_request_context():
+        return Deadline(BACKGROUND_DEADLINE)
+    if 'deadline' not in g:
+        g.deadline = Deadline(REQUEST_DEADLINE)
+    return g.deadline
+
+def rate_limited_response(error):
+    """429 answer for AI routes when the shared Gemini budget is exhausted"""
+    response = jsonify({
+        'success': False,
+        'error': 'AI xizmati hozir band. Iltimos, birozdan keyin urinib ko\'ring.',
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+ai_metrics = AIMetrics(AI_METRICS_DB)
+
+def record_ai_call(use_case, started, outcome, result=None):
+    """Account one get_ai_response/stream_ai_response call under its feature tag"""
+    ai_metrics.record(
+        AI_FEATURE_TAGS.get(use_case, use_case), time.monotonic() - started,
+        getattr(result, 'prompt_tokens', 0), getattr(result, 'output_tokens', 0),
+        outcome, AI_MODEL_NAME
+    )
+
+def get_ai_response(prompt, max_tokens=1000, use_case='general', temperature=0.7, deadline=None,
+                    json_schema=None):
+    """Get response from Gemini AI (cached per use case, see AI_CACHE_TTLS)
+
+    Transient failures are retried within the deadline; while the Gemini
+    breaker is open the call fails fast and returns None. With json_schema
+    the model is asked for JSON matching that schema. Every call is
+    recorded in ai_metrics.
+    """
+    if not AI_PROVIDER:
+        return None
+    
+    started = time.monotonic()
+    ttl = AI_CACHE_TTLS.get(use_case, 0)
+    key_prompt = prompt if json_schema is None else prompt + json.dumps(json_schema, sort_keys=True)
+    cache_key = ai_cache.make_key(AI_MODEL_NAME, key_prompt, max_tokens, temperature) if ttl > 0 else None
+    if cache_key:
+        cached = ai_cache.get(cache_key)
+        if cached is not None:
+            record_ai_call(use_case, started, 'cache_hit')
+            return cached
+    
+    if gemini_breaker.is_open():
+        app.logger.warning("AI response skipped: Gemini circuit open")
+        record_ai_call(use_case, started, 'circuit_open')
         return None
     
+    # Raises AIRateLimitExceeded when the shared budget is exhausted
+    estimated_tokens = AI_PROVIDER.count_tokens(prompt) + max_tokens
     try:
-        if genai:
-            response = AI_MODEL.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=max_tokens,
-                    temperature=0.7,
-                )
-            )
-        else:
-            response = AI_MODEL.generate_content(prompt)
-        return response.text
+        lease = ai_limiter.acquire(AI_PRIORITIES.get(use_case, 'standard'), estimated_tokens)
+    except AIRateLimitExceeded:
+        record_ai_call(use_case, started, 'rate_limited')
+        raise
+    tokens = 0
+    
+    def generate(timeout):
+        return AI_PROVIDER.generate(prompt, max_tokens, temperature, json_schema, timeout)
+    
+    try:
+        result = call_with_retry(generate, gemini_breaker, deadline or current_deadline(),
+                                 timeout=AI_CALL_TIMEOUT)
+        text = result.text
+        tokens = result.total_tokens
+        record_ai_call(use_case, started, 'ok', result)
+        if cache_key:
+            ai_cache.set(cache_key, text, ttl, time.monotonic() - started, tokens)
+        return text
     except Exception as e:
         app.logger.error(f"AI response error: {e}")
+        record_ai_call(use_case, started, error_outcome(e))
         return None
+    finally:
+        ai_limiter.release(lease, estimated_tokens, tokens)
 
-def analyze_text_with_ai(text, analysis_type="general"):
-    """Analyze text with AI for different purposes"""
-    if analysis_type == "contact":
-        prompt = f"""
+ai_jobs = AIJobQueue(AI_JOBS_DB, max_workers=AI_JOB_WORKERS, stale_after_kinds=AI_JOB_STALE_AFTER)
+
+def stream_ai_response(prompt, max_tokens=1000, use_case='general', temperature=0.7, deadline=None):
+    """Yield the Gemini response in chunks as they are generated (cached like get_ai_response)
+
+    Only opening the stream is retried; a failure after text was sent is
+    recorded on the breaker and raised.
+    """
+    if not AI_PROVIDER:
+        return
+    
+    started = time.monotonic()
+    ttl = AI_CACHE_TTLS.get(use_case, 0)
+    cache_key = ai_cache.make_key(AI_MODEL_NAME, prompt, max_tokens, temperature) if ttl > 0 else None
+    if cache_key:
+        cached = ai_cache.get(cache_key)
+        if cached is not None:
+            record_ai_call(use_case, started, 'cache_hit')
+            yield cached
+            return
+    
+    if gemini_breaker.is_open():
+        app.logger.warning("AI stream skipped: Gemini circuit open")
+        record_ai_call(use_case, started, 'circuit_open')
+        return
+    
+    estimated_tokens = AI_PROVIDER.count_tokens(prompt) + max_tokens
+    try:
+        lease = ai_limiter.acquire(AI_PRIORITIES.get(use_case, 'standard'), estimated_tokens)
+    except AIRateLimitExceeded:
+        record_ai_call(use_case, started, 'rate_limited')
+        raise
+    tokens = 0
+    response = None
+    outcome = 'cancelled'
+    
+    def open_stream(timeout):
+        return AI_PROVIDER.stream(prompt, max_tokens, temperature, timeout)
+    
+    try:
+        response = call_with_retry(open_stream, gemini_breaker, deadline or current_deadline(),
+                                   timeout=AI_CALL_TIMEOUT)
+        try:
+            for text in response:
+                yield text
+        except Exception as e:
+            if is_transient(e):
+                gemini_breaker.record_failure(e)
+            raise
+        
+        tokens = response.total_tokens
+        outcome = 'ok'
+        if cache_key and response.parts:
+            ai_cache.set(cache_key, response.text, ttl, time.monotonic() - started, tokens)
+    except Exception as e:
+        outcome = error_outcome(e)
+        raise
+    finally:
+        # A client that disconnects mid-stream closes the generator: recorded as
+        # 'cancelled' with the tokens of the text generated so far
+        if response is not None and not response.output_tokens and response.parts:
+            response.output_tokens = AI_PROVIDER.count_tokens(response.text)
+        record_ai_call(use_case, started, outcome, response)
+        ai_limiter.release(lease, estimated_tokens, tokens)
+
+# Prompt templates (compiled once; the text field is trimmed to the use case's budget)
+ANALYSIS_PROMPTS = {
+    'contact': PromptTemplate("""
         Quyidagi mijoz murojatini tahlil qiling va eng mos xizmatni aniqlang:
 
         Murojaat matni: "{text}"
@@ -242,9 +755,8 @@ def analyze_text_with_ai(text, analysis_type="general"):
         - ai_integration: AI texnologiyalar integratsiya
 
         Javobni faqat xizmat nomi bilan bering, boshqa hech narsa yozmang.
-        """
-    elif analysis_type == "document":
-        prompt = f"""
+        """, AI_INPUT_BUDGETS['contact'], elastic='text'),
+    'document': PromptTemplate("""
         Quyidagi hujjat matnini tahlil qiling va mijoz ehtiyojlarini aniqlang:
 
         Hujjat matni: "{text}"
@@ -253,15 +765,217 @@ def analyze_text_with_ai(text, analysis_type="general"):
         - Asosiy maqsad: [maqsad]
         - Kerakli xizmatlar: [xizmatlar ro'yxati]
         - Tavsiya: [qisqa tavsiya]
-        """
-    else:
-        prompt = f"Quyidagi matnni tahlil qiling: {text}"
+        """, AI_INPUT_BUDGETS['document'], elastic='text'),
+    'general': PromptTemplate("Quyidagi matnni tahlil qiling: {text}", AI_INPUT_BUDGETS['general'], elastic='text')
+}
+
+DOCUMENT_CHUNK_PROMPT = PromptTemplate("""
+    Quyida katta hujjatning bir qismi ({pages}) berilgan. Mijoz ehtiyojlarini aniqlash uchun
+    ushbu qismning qisqa xulosasini yozing (5-8 ta punkt): maqsadlar, talab qilingan funksiyalar,
+    texnologiyalar, muddatlar, byudjet va boshqa muhim raqamlar. Qismda bo'lmagan narsani yozmang.
+
+    Hujjat qismi:
+    "{text}"
+    """, DOCUMENT_CHUNK_TOKENS + 200, limits={'pages': 20}, elastic='text')
+
+DOCUMENT_MERGE_PROMPT = PromptTemplate("""
+    Quyida katta hujjat qismlarining xulosalari berilgan. Ularni takrorlarsiz bitta qisqa
+    xulosaga birlashtiring (8-12 ta punkt), muhim raqamlar va muddatlarni saqlang.
+
+    {summaries}
+    """, AI_INPUT_BUDGETS['document'], elastic='summaries')
+
+DOCUMENT_REDUCE_PROMPT = PromptTemplate("""
+    Quyida mijoz yuborgan katta hujjat qismlarining xulosalari berilgan. Ular asosida hujjatni
+    yaxlit tahlil qiling va mijoz ehtiyojlarini aniqlang:
+
+    {summaries}
+
+    Tahlil natijasini quyidagi formatda bering:
+    - Asosiy maqsad: [maqsad]
+    - Kerakli xizmatlar: [xizmatlar ro'yxati]
+    - Tavsiya: [qisqa tavsiya]
+    """, AI_INPUT_BUDGETS['document'], elastic='summaries')
+
+document_pool = ThreadPoolExecutor(max_workers=DOCUMENT_MAP_WORKERS, thread_name_prefix='document')
+
+def iter_document_analysis(pages):
+    """Analysis events for a document given as page texts (see doc_analysis.map_reduce)
+
+    A document that fits one chunk is analysed with a single call as
+    before; longer ones are summarised chunk by chunk on document_pool.
+    """
+    chunks = split_pages(pages, DOCUMENT_CHUNK_TOKENS, DOCUMENT_MAX_CHUNKS)
+    if len(chunks) <= 1:
+        analysis = analyze_text_with_ai('\n'.join(pages), "document")
+        yield {'type': 'result', 'analysis': analysis, 'analyzed': len(chunks), 'total': len(chunks),
+               'timed_out': False}
+        return
+    
+    deadline = Deadline(DOCUMENT_DEADLINE)
+    
+    def summarize(chunk):
+        prompt = DOCUMENT_CHUNK_PROMPT.render(pages=pages_label(chunk), text=chunk['text'])
+        return get_ai_response(prompt, DOCUMENT_SUMMARY_TOKENS, use_case='document', deadline=deadline)
+    
+    def reduce(summaries, final):
+        template = DOCUMENT_REDUCE_PROMPT if final else DOCUMENT_MERGE_PROMPT
+        prompt = template.render(summaries='\n\n'.join(summaries))
+        return get_ai_response(prompt, 500 if final else DOCUMENT_SUMMARY_TOKENS * 2,
+                               use_case='document', deadline=deadline)
+    
+    # Leave time for the reduce step after the last chunk
+    map_timeout = max(1.0, deadline.remaining() - AI_CALL_TIMEOUT / 3)
+    reduce_tokens = AI_INPUT_BUDGETS['document'] - DOCUMENT_REDUCE_PROMPT.fixed_tokens
+    yield from map_reduce(chunks, summarize, reduce, document_pool, reduce_tokens, timeout=map_timeout)
+
+def analyze_text_with_ai(text, analysis_type="general"):
+    """Analyze text with AI for different purposes"""
+    template = ANALYSIS_PROMPTS.get(analysis_type, ANALYSIS_PROMPTS['general'])
+    prompt, truncated = template.fit(text=text)
+    if truncated:
+        app.logger.info(f"{analysis_type} analysis input trimmed to {template.budget} tokens")
     
-    return get_ai_response(prompt, 500)
+    return get_ai_response(prompt, 500, use_case=analysis_type)
 
-def create_blog_with_ai(topic):
-    """Create SEO-optimized blog article with AI"""
-    prompt = f"""
+contact_classifier = ContactClassifier(threshold=CONTACT_CLASSIFIER_THRESHOLD)
+_contact_classifier_state = {'trained': False}
+_contact_classifier_lock = threading.Lock()
+
+def contact_training_examples():
+    """Seed examples plus stored messages labelled by earlier Gemini answers
+
+    Labels the local classifier gave itself are left out, so it never
+    trains on its own predictions.
+    """
+    labels = {name: label for label, name in CONTACT_SERVICE_NAMES.items()}
+    examples = list(SEED_EXAMPLES)
+    for message in iter_data(MESSAGES_FILE):
+        if message.get('ai_label_source') != 'gemini':
+            continue
+        label = labels.get(message.get('ai_recommendation'))
+        if label and message.get('message'):
+            examples.append((message['message'], label))
+    return examples
+
+def classify_contact_message(text):
+    """(label, source) for a contact message
+
+    label is a CONTACT_SERVICE_NAMES key or None; source tells who decided
+    it ('local', 'gemini', or None without a label). The local classifier
+    answers when confident; otherwise, and for a small audit sample,
+    Gemini decides and its answer is learned. Raises AIRateLimitExceeded or
+    TransientError when only Gemini could decide and it is unavailable.
+    """
+    with _contact_classifier_lock:
+        if not _contact_classifier_state['trained']:
+            contact_classifier.train(contact_training_examples())
+            _contact_classifier_state['trained'] = True
+    
+    started = time.perf_counter()
+    label, confidence, source = contact_classifier.predict(text)
+    local_seconds = time.perf_counter() - started
+    confident = confidence >= contact_classifier.threshold
+    audit = confident and random.random() < CONTACT_CLASSIFIER_AUDIT_RATE
+    
+    if not AI_PROVIDER or (confident and not audit):
+        if confident:
+            contact_classifier.record_local(source, local_seconds)
+            return label, 'local'
+        return None, None
+    
+    started = time.perf_counter()
+    try:
+        analysis = analyze_text_with_ai(text, "contact")
+    except AIRateLimitExceeded:
+        if confident:
+            return label, 'local'
+        raise
+    if analysis is None and not confident:
+        # Gemini gave no answer (open breaker, timeout): worth asking again later
+        raise TransientError('Gemini did not answer the contact classification')
+    llm_label = analysis.strip().lower() if analysis else ''
+    if llm_label not in CONTACT_SERVICE_NAMES:
+        return (label, 'local') if confident else (None, None)
+    
+    contact_classifier.record_llm(label, llm_label, time.perf_counter() - started, audit)
+    contact_classifier.learn(text, llm_label)
+    return llm_label, 'gemini'
+
+contact_pool = ThreadPoolExecutor(max_workers=CONTACT_ENRICH_WORKERS, thread_name_prefix='contact')
+_contact_enrich_state = {'queued': set()}
+_contact_enrich_lock = threading.Lock()
+
+def contact_telegram_message(record):
+    """Lead notification text for a stored contact message"""
+    text = f"""📝 <b>Yangi murojaat - SmartBot.uz</b>
+
+👤 <b>Ism:</b> {record['name']}
+📧 <b>Email:</b> {record['email']}"""
+    
+    if record.get('phone'):
+        text += f"\n📞 <b>Telefon:</b> {record['phone']}"
+    if record.get('service'):
+        text += f"\n🔧 <b>Xizmat:</b> {record['service']}"
+    if record.get('budget'):
+        text += f"\n💰 <b>Byudjet:</b> {record['budget']}"
+    
+    text += f"\n💬 <b>Xabar:</b> {record['message']}"
+    if record.get('ai_recommendation'):
+        text += f"\n🤖 <b>AI tavsiyasi:</b> {record['ai_recommendation']}"
+    return text
+
+def enrich_contact_message(message_id):
+    """Background step for a new contact message: service recommendation, then the Telegram outbox"""
+    try:
+        record = next((m for m in iter_data(MESSAGES_FILE) if m.get('id') == message_id), None)
+        if record is None:
+            return
+        
+        attempts = record.get('enrich_attempts', 0) + 1
+        fields = {'enrichment': 'done', 'enrich_attempts': attempts}
+        try:
+            label, label_source = classify_contact_message(record['message'])
+            fields['ai_recommendation'] = CONTACT_SERVICE_NAMES.get(label, 'Umumiy Konsultatsiya')
+            # Only Gemini labels are used as training data (contact_training_examples)
+            fields['ai_label_source'] = label_source
+        except Exception as e:
+            app.logger.error(f"AI analysis error in contact form: {e}")
+            retry = isinstance(e, (AIRateLimitExceeded, CircuitOpenError, DeadlineExceeded)) or is_transient(e)
+            # Left pending, the stale sweep (requeue_stale_enrichment) tries again later
+            fields['enrichment'] = 'pending' if retry and attempts < CONTACT_ENRICH_ATTEMPTS else 'failed'
+        record.update(fields)
+        
+        defaults = None
+        if not record.get('telegram_sent') and TELEGRAM_CHAT_ID:
+            # Ids can be reused after a deletion, so the key includes the submission time
+            if queue_telegram_message(f"lead:{message_id}:{record['date']}", TELEGRAM_CHAT_ID,
+                                      contact_telegram_message(record), 'lead', message_id):
+                # A default, so a 'sent' the dispatcher may already have written is kept
+                defaults = {'telegram_status': 'queued'}
+        fields['enriched_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        update_message(message_id, defaults, **fields)
+    finally:
+        with _contact_enrich_lock:
+            _contact_enrich_state['queued'].discard(message_id)
+
+def queue_contact_enrichment(message_id):
+    """Hand a message to contact_pool unless this worker already has it queued"""
+    with _contact_enrich_lock:
+        if message_id in _contact_enrich_state['queued']:
+            return
+        _contact_enrich_state['queued'].add(message_id)
+    contact_pool.submit(enrich_contact_message, message_id)
+
+def requeue_stale_enrichment(messages):
+    """Queue pending messages not finished or last tried CONTACT_ENRICH_STALE seconds ago"""
+    cutoff = (datetime.now() - timedelta(seconds=CONTACT_ENRICH_STALE)).strftime('%Y-%m-%d %H:%M:%S')
+    for message in messages:
+        # enriched_at is set after a transient failure too, spacing out the retries
+        if message.get('enrichment') == 'pending' and (message.get('enriched_at') or message.get('date') or '') < cutoff:
+            queue_contact_enrichment(message['id'])
+
+BLOG_PROMPT = PromptTemplate("""
     "{topic}" mavzusida o'zbek tilida SEO optimallashtirilgan blog maqolasi yozing.
 
     Quyidagi strukturani kuzating:
@@ -277,13 +991,13 @@ def create_blog_with_ai(topic):
     - O'zbek tilida professional uslubda yozing
 
     Maqolani HTML formatida qaytaring, faqat <h2>, <p>, <ul>, <li> teglaridan foydalaning.
-    """
-    
-    return get_ai_response(prompt, 2000)
+    """, AI_INPUT_BUDGETS['blog'], elastic='topic')
 
-def create_case_study_with_ai(project_info):
-    """Create detailed case study with AI"""
-    prompt = f"""
+def create_blog_with_ai(topic):
+    """Create SEO-optimized blog article with AI"""
+    return get_ai_response(BLOG_PROMPT.render(topic=topic), 2000, use_case='blog')
+
+CASE_STUDY_PROMPT = PromptTemplate("""
     Quyidagi loyiha ma'lumotlari asosida batafsil case study yarating:
 
     {project_info}
@@ -297,22 +1011,51 @@ def create_case_study_with_ai(project_info):
     6. Mijoz fikri (qisqa)
 
     O'zbek tilida professional uslubda yozing, aniq raqamlar va faktlarni ko'rsating.
-    """
+    """, AI_INPUT_BUDGETS['case_study'], elastic='project_info')
+
+def create_case_study_with_ai(project_info):
+    """Create detailed case study with AI"""
+    return get_ai_response(CASE_STUDY_PROMPT.render(project_info=project_info), 1500, use_case='case_study')
+
+pdf_extractor = PDFExtractor(PDF_WORKERS, timeout=PDF_TIMEOUT, max_pages=PDF_MAX_PAGES,
+                             max_tokens=PDF_MAX_TOKENS, memory_mb=PDF_MEMORY_MB)
+
+document_cache = DocumentCache(DOCUMENT_CACHE_DB, DOCUMENT_CACHE_MAX_BYTES)
+
+def read_upload(file):
+    """(bytes, SHA-256 hex digest) of an uploaded file, read from its stream in blocks"""
+    import hashlib
     
-    return get_ai_response(prompt, 1500)
+    digest = hashlib.sha256()
+    blocks = []
+    while True:
+        block = file.stream.read(UPLOAD_READ_SIZE)
+        if not block:
+            break
+        digest.update(block)
+        blocks.append(block)
+    return b''.join(blocks), digest.hexdigest()
 
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF file"""
+def extract_pages_from_pdf(data):
+    """Page texts of PDF bytes (extracted in the sandboxed pool), or None when unreadable
+
+    Raises PDFExtractionTimeout when parsing exceeds PDF_TIMEOUT.
+    """
     try:
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text.strip()
-    except Exception as e:
+        result = pdf_extractor.extract(data)
+    except PDFExtractionTimeout:
+        raise
+    except PDFExtractionError as e:
         app.logger.error(f"PDF extraction error: {e}")
         return None
+    if result['truncated']:
+        app.logger.info(f"PDF extraction stopped after {len(result['pages'])}/{result['page_count']} pages")
+    return result['pages']
+
+def extract_text_from_pdf(data):
+    """Extract text from PDF file"""
+    pages = extract_pages_from_pdf(data)
+    return '\n'.join(pages).strip() if pages is not None else None
 
 # Initialize data files on startup
 initialize_data_files()
@@ -326,24 +1069,85 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def send_telegram_message(message):
-    """Send message to Telegram bot"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        app.logger.warning("Telegram credentials not configured")
-        return False
+def telegram_api_call(method, payload, deadline=None):
+    """POST to the Telegram Bot API with retries and the shared breaker; True on success"""
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/{method}"
     
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        data = {
-            'chat_id': TELEGRAM_CHAT_ID,
-            'text': message,
-            'parse_mode': 'HTML'
-        }
-        response = requests.post(url, data=data, timeout=10)
-        return response.status_code == 200
-    except Exception as e:
-        app.logger.error(f"Failed to send Telegram message: {e}")
+    def post(timeout):
+        response = requests.post(url, data=payload, timeout=timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientError(f"Telegram {method} HTTP {response.status_code}")
+        return response
+    
+    response = call_with_retry(post, telegram_breaker, deadline or current_deadline(), timeout=TELEGRAM_TIMEOUT)
+    if response.status_code != 200:
+        app.logger.error(f"Telegram {method} failed: {response.text}")
+        return False
+    return True
+
+telegram_outbox = TelegramOutbox(TELEGRAM_OUTBOX_DB)
+_outbox_wakeup = threading.Event()
+_outbox_dispatcher = {'pid': None}
+_outbox_dispatcher_lock = threading.Lock()
+
+def update_blog_post(post_id, fields):
+    """Set fields on a stored blog post"""
+    with locked(BLOG_FILE):
+        blogs = load_data(BLOG_FILE)
+        post = next((b for b in blogs if b.get('id') == post_id), None)
+        if post is None:
+            return False
+        post.update(fields)
+        return save_data(BLOG_FILE, blogs)
+
+def update_telegram_source(kind, source_id, fields):
+    """Write an outbox delivery result back to the lead or blog post it announced"""
+    if kind == 'lead':
+        update_message(int(source_id), **fields)
+    elif kind == 'blog':
+        update_blog_post(int(source_id), fields)
+
+def dispatch_telegram_outbox():
+    """Deliver due outbox entries (nothing is sent until the bot token is configured)"""
+    if not TELEGRAM_BOT_TOKEN:
+        return None
+    return telegram_outbox.dispatch(telegram_api_call, update_telegram_source)
+
+def _outbox_dispatcher_loop():
+    while True:
+        _outbox_wakeup.wait(TELEGRAM_OUTBOX_POLL)
+        _outbox_wakeup.clear()
+        try:
+            while any((dispatch_telegram_outbox() or {}).values()):
+                pass
+        except Exception as e:
+            app.logger.error(f"Telegram outbox dispatch error: {e}")
+
+def ensure_outbox_dispatcher():
+    """Start this worker's outbox dispatcher thread if it is not running yet"""
+    with _outbox_dispatcher_lock:
+        if _outbox_dispatcher['pid'] == os.getpid():
+            return
+        _outbox_dispatcher['pid'] = os.getpid()
+        threading.Thread(target=_outbox_dispatcher_loop, name='telegram-outbox', daemon=True).start()
+
+def queue_telegram_message(key, chat_id, text, kind, source_id=None, **options):
+    """Queue a sendMessage call under an idempotency key; False if not queued
+
+    A key that was queued before (e.g. the same lead or article again) is
+    not sent twice.
+    """
+    if not chat_id:
+        app.logger.warning("Telegram chat is not configured")
         return False
+    payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML', **options}
+    queued = telegram_outbox.enqueue(key, 'sendMessage', payload, kind, source_id)
+    ensure_outbox_dispatcher()
+    _outbox_wakeup.set()
+    return queued
+
+# Gunicorn workers import the app themselves, so every worker starts its dispatcher here
+ensure_outbox_dispatcher()
 
 # ========================
 # MAIN ROUTES
@@ -359,8 +1163,20 @@ def services():
 
 @app.route('/portfolio')
 def portfolio():
-    portfolio_data = load_data(PORTFOLIO_FILE)
-    return render_template('portfolio.html', portfolio=portfolio_data)
+    index = get_category_index(PORTFOLIO_FILE, PORTFOLIO_CATEGORY_LABELS)
+    category = request.args.get('category', '').strip()
+    projects, next_page, total = paginate_category(index, category, get_page_arg(), PORTFOLIO_PAGE_SIZE)
+
+    if request.args.get('partial'):
+        return jsonify({
+            'html': render_template('portfolio/items.html', portfolio=projects),
+            'next_page': next_page,
+            'total': total
+        })
+
+    return render_template('portfolio.html', portfolio=projects, facets=index['facets'],
+                           category=category, next_page=next_page,
+                           total_count=len(index['items']))
 
 @app.route('/portfolio/<project_slug>')
 def portfolio_detail(project_slug):
@@ -436,56 +1252,13 @@ def contact():
             for error in errors:
                 flash(error, 'error')
         else:
-            # Create Telegram message
-            telegram_message = f"""📝 <b>Yangi murojaat - SmartBot.uz</b>
-
-👤 <b>Ism:</b> {name}
-📧 <b>Email:</b> {email}"""
-            
-            if phone:
-                telegram_message += f"\n📞 <b>Telefon:</b> {phone}"
-            if service:
-                telegram_message += f"\n🔧 <b>Xizmat:</b> {service}"
-            if budget:
-                telegram_message += f"\n💰 <b>Byudjet:</b> {budget}"
-            
-            telegram_message += f"\n💬 <b>Xabar:</b> {message}"
-            
-            # Save message to database
-            message_saved = save_message(name, email, phone, service, budget, message)
-            
-            # AI Analysis of the message
-            ai_recommendation = None
-            if AI_MODEL:
-                try:
-                    analysis = analyze_text_with_ai(message, "contact")
-                    service_map = {
-                        'telegram_bot': 'Telegram Bot Yaratish',
-                        'chatbot': 'AI Chatbot Integratsiya', 
-                        'automation': 'Biznes Avtomatlashtirish',
-                        'web_development': 'Web Sayt Yaratish',
-                        'ai_integration': 'AI Texnologiyalar'
-                    }
-                    ai_recommendation = service_map.get(analysis.strip().lower() if analysis else '', 'Umumiy Konsultatsiya')
-                except Exception as e:
-                    app.logger.error(f"AI analysis error in contact form: {e}")
-            
-            # Update message with AI recommendation (get the new message ID)
-            if message_saved and ai_recommendation:
-                messages = load_data(MESSAGES_FILE)
-                latest_message = messages[-1] if messages else None
-                if latest_message:
-                    latest_message['ai_recommendation'] = ai_recommendation
-                    save_data(MESSAGES_FILE, messages)
-            
-            # Send to Telegram
-            telegram_sent = send_telegram_message(telegram_message)
+            # Save message to database; AI analysis and the Telegram
+            # notification run in the background (enrich_contact_message)
+            saved_message = save_message(name, email, phone, service, budget, message)
             
-            if message_saved:
-                if telegram_sent:
-                    flash("Xabaringiz muvaffaqiyatli yuborildi! Tez orada siz bilan bog'lanamiz.", "success")
-                else:
-                    flash("Xabaringiz saqlandi, lekin Telegram xabarnomasi yuborilmadi.", "warning")
+            if saved_message:
+                queue_contact_enrichment(saved_message['id'])
+                flash("Xabaringiz muvaffaqiyatli yuborildi! Tez orada siz bilan bog'lanamiz.", "success")
             else:
                 flash("Xatolik yuz berdi. Iltimos qaytadan urinib ko'ring.", "error")
                 
@@ -497,8 +1270,38 @@ def contact():
 @app.route('/blog')
 def blog():
     """Blog sahifasi - real ma'lumotlar bilan"""
-    blogs = load_data(BLOG_FILE)
-    return render_template('blog.html', blogs=blogs)
+    index = get_category_index(BLOG_FILE)
+    category = request.args.get('category', '').strip()
+    # Without a filter the first post is shown as the featured article
+    blogs, next_page, total = paginate_category(index, category, get_page_arg(), BLOG_PAGE_SIZE, start=1)
+
+    if request.args.get('partial'):
+        return jsonify({
+            'html': render_template('blog/items.html', blogs=blogs),
+            'next_page': next_page,
+            'total': total
+        })
+
+    featured = index['items'][0] if index['items'] and not category else None
+    return render_template('blog.html', blogs=blogs, featured=featured, facets=index['facets'],
+                           category=category, next_page=next_page,
+                           total_count=len(index['items']))
+
+@app.route('/blog/search')
+def blog_search():
+    """Blog qidiruv - BM25 bo'yicha saralangan natijalar"""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+
+    if not query:
+        return jsonify({'query': query, 'results': [], 'total': 0})
+
+    sync_blog_index()
+    results = blog_index.search(query, limit)
+    return jsonify({'query': query, 'results': results, 'total': len(results)})
 
 @app.route('/blog/<slug>')
 def blog_detail(slug):
@@ -516,7 +1319,20 @@ def blog_detail(slug):
         flash("Blog post topilmadi!", "error")
         return redirect(url_for('blog'))
     
-    return render_template('blog/detail.html', blog=blog_post, all_blogs=blogs[:3])
+    return render_template('blog/detail.html', blog=blog_post, all_blogs=blogs[:3],
+                           related_blogs=get_related_posts(blog_post, blogs))
+
+def get_related_posts(blog_post, blogs, limit=2):
+    """Precomputed related posts, falling back to the latest ones"""
+    if not os.path.exists(BLOG_RELATED_FILE):
+        related_index.rebuild(blogs)
+
+    by_id = {b.get('id'): b for b in blogs}
+    related = [by_id[i] for i in related_index.neighbours(blog_post.get('id')) if i in by_id]
+    if len(related) < limit:
+        latest = [b for b in reversed(blogs) if b.get('id') != blog_post.get('id') and b not in related]
+        related += latest[:limit - len(related)]
+    return related[:limit]
 
 # ========================
 # SEO ROUTES
@@ -538,14 +1354,136 @@ def robots_txt():
     response = app.response_class(robots_content, mimetype='text/plain')
     return response
 
+# Rendered feed entries are kept per post, so a new data version only renders new or changed posts
+_feed_cache = {'entries': {}, 'feeds': {}}
+_feed_lock = threading.Lock()
+
+def _post_datetime(post):
+    """Post publication time; blog dates are stored in Tashkent local time"""
+    from datetime import timezone
+    tashkent = timezone(timedelta(hours=5))
+    try:
+        published = datetime.strptime(f"{post.get('date', '')} {post.get('time', '00:00:00')}", '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        published = datetime(1970, 1, 1)
+    return published.replace(tzinfo=tashkent)
+
+def render_feed_entry(post, feed_format):
+    """Render one <item> (RSS) or <entry> (Atom) element"""
+    from xml.sax.saxutils import escape, quoteattr
+    from email.utils import format_datetime
+    from blog_search import strip_html
+
+    link = f"{SITE_URL}/blog/{post.get('slug') or post.get('id')}"
+    title = escape(post.get('title', ''))
+    summary = escape(post.get('excerpt') or strip_html(post.get('content', ''))[:300])
+    category = escape(post.get('category', ''))
+    published = _post_datetime(post)
+
+    if feed_format == 'atom':
+        return f"""  <entry>
+    <title>{title}</title>
+    <link href={quoteattr(link)}/>
+    <id>{escape(link)}</id>
+    <updated>{published.isoformat()}</updated>
+    <category term={quoteattr(post.get('category', ''))}/>
+    <summary>{summary}</summary>
+  </entry>
+"""
+    return f"""    <item>
+      <title>{title}</title>
+      <link>{escape(link)}</link>
+      <guid isPermaLink="true">{escape(link)}</guid>
+      <pubDate>{format_datetime(published)}</pubDate>
+      <category>{category}</category>
+      <description>{summary}</description>
+    </item>
+"""
+
+def build_blog_feed(feed_format):
+    """Feed XML for the latest FEED_SIZE posts, rebuilt once per blog data version
+
+    Returns (xml, etag).
+    """
+    import hashlib
+    import heapq
+    from blog_search import post_fingerprint
+
+    index = get_category_index(BLOG_FILE)
+    cached = _feed_cache['feeds'].get(feed_format)
+    if cached and cached[0] == index['version']:
+        return cached[1], cached[2]
+
+    with _feed_lock:
+        latest = heapq.nlargest(FEED_SIZE, index['items'], key=lambda p: (_post_datetime(p), p.get('id', 0)))
+
+        entries = []
+        keep = set()
+        for post in latest:
+            key = (feed_format, post.get('id'))
+            fingerprint = post_fingerprint(post) + (post.get('date') or '') + str(post.get('slug'))
+            cached_entry = _feed_cache['entries'].get(key)
+            if not cached_entry or cached_entry[0] != fingerprint:
+                cached_entry = (fingerprint, render_feed_entry(post, feed_format))
+                _feed_cache['entries'][key] = cached_entry
+            entries.append(cached_entry[1])
+            keep.add(key)
+
+        for key in [k for k in _feed_cache['entries'] if k[0] == feed_format and k not in keep]:
+            del _feed_cache['entries'][key]
+
+        updated = _post_datetime(latest[0]) if latest else _post_datetime({})
+        if feed_format == 'atom':
+            xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>SmartBot.uz Blog</title>
+  <link href="{SITE_URL}/blog"/>
+  <link rel="self" href="{SITE_URL}/blog/feed.xml?format=atom"/>
+  <id>{SITE_URL}/blog</id>
+  <updated>{updated.isoformat()}</updated>
+  <author><name>SmartBot.uz</name></author>
+{''.join(entries)}</feed>
+"""
+        else:
+            from email.utils import format_datetime
+            xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>SmartBot.uz Blog</title>
+    <link>{SITE_URL}/blog</link>
+    <description>Bot va avtomatlashtirish dunyosidan yangiliklar, maslahatlar va maqolalar</description>
+    <language>uz</language>
+    <lastBuildDate>{format_datetime(updated)}</lastBuildDate>
+{''.join(entries)}  </channel>
+</rss>
+"""
+        etag = hashlib.md5(xml.encode('utf-8')).hexdigest()
+        _feed_cache['feeds'][feed_format] = (index['version'], xml, etag)
+        return xml, etag
+
+@app.route('/blog/feed.xml')
+def blog_feed():
+    """Blog RSS (default) yoki Atom (?format=atom) lentasi"""
+    feed_format = 'atom' if request.args.get('format') == 'atom' else 'rss'
+    xml, etag = build_blog_feed(feed_format)
+    mimetype = 'application/atom+xml' if feed_format == 'atom' else 'application/rss+xml'
+    response = app.response_class(xml, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response.make_conditional(request)
+
 # ========================
 # AI ROUTES
 # ========================
 
 @app.route('/ai/chat', methods=['POST'])
 def ai_chat():
-    """AI Chatbot for website visitors"""
-    if not AI_MODEL:
+    """AI Chatbot for website visitors
+
+    With "stream": true in the request body the answer is sent as
+    Server-Sent Events ("delta" chunks, then "done") while it is generated.
+    """
+    if not AI_PROVIDER:
         return jsonify({'error': 'AI xizmati mavjud emas'}), 503
     
     try:
@@ -555,10 +1493,90 @@ def ai_chat():
         if not message:
             return jsonify({'error': 'Xabar bo\'sh bo\'lishi mumkin emas'}), 400
         
-        # Create context-aware prompt for SmartBot.uz
-        prompt = f"""
-        Siz SmartBot.uz kompaniyasining AI yordamchisisiz. Mijoz bilan do'stona va professional tarzda gaplashing.
+        # Oversized messages are trimmed before the FAQ lookup, memory and prompt
+        message = fit_text(message, CHAT_MESSAGE_TOKENS)
+        chat_id = get_chat_session_id()
+        summary, turns = chat_memory.context(chat_id)
+        
+        faq_match = find_faq_answer(message)
+        if faq_match:
+            chat_memory.append(chat_id, message, faq_match['answer'])
+            return faq_chat_response(faq_match['answer'], data.get('stream'))
+        
+        prompt = build_chat_prompt(message, summary, turns)
+        # Only answers to context-free questions are reusable for other visitors
+        first_turn = not summary and not turns
+        
+        def remember(answer):
+            chat_memory.append(chat_id, message, answer)
+            if first_turn:
+                faq_cache.add_learned(message, answer)
+        
+        if data.get('stream'):
+            return stream_chat_response(prompt, remember)
+        
+        ai_response = get_ai_response(prompt, 300, use_case='chat')
+        
+        if ai_response:
+            remember(ai_response)
+            return jsonify({
+                'success': True,
+                'response': ai_response
+            })
+        else:
+            return jsonify({
+                'success': False,
+                'response': 'Kechirasiz, hozir javob bera olmayapman. Iltimos, keyinroq urinib ko\'ring.'
+            })
+            
+    except AIRateLimitExceeded as e:
+        return rate_limited_response(e)
+    except Exception as e:
+        app.logger.error(f"AI chat error: {e}")
+        return jsonify({'error': 'Ichki xatolik yuz berdi'}), 500
 
+chat_memory = ChatMemoryStore(CHAT_MEMORY_SESSIONS, CHAT_TURN_TOKENS, CHAT_SUMMARY_TOKENS,
+                              db_path=CHAT_MEMORY_DB)
+
+def get_chat_session_id():
+    """Chat conversation id kept in the signed session cookie"""
+    if 'chat_id' not in session:
+        session['chat_id'] = uuid.uuid4().hex
+    return session['chat_id']
+
+faq_cache = FAQCache(FAQ_CANNED_THRESHOLD, FAQ_LEARNED_THRESHOLD, FAQ_LEARNED_MAX)
+_faq_state = {'mtime': None}
+_faq_lock = threading.Lock()
+
+def find_faq_answer(message):
+    """Canned or previously generated answer for a near-identical question, or None"""
+    try:
+        mtime = os.stat(FAQ_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _faq_lock:
+        # faq.json is edited from the admin in any worker; reload when it changes
+        if mtime != _faq_state['mtime']:
+            faq_cache.set_canned(load_data(FAQ_FILE))
+            _faq_state['mtime'] = mtime
+    return faq_cache.lookup(message)
+
+def faq_chat_response(answer, stream=False):
+    """Chat answer from the FAQ cache, in the same shape as a model answer"""
+    from flask import Response
+    
+    if not stream:
+        return jsonify({'success': True, 'response': answer, 'source': 'faq'})
+    
+    body = (f"event: delta\ndata: {json.dumps({'text': answer}, ensure_ascii=False)}\n\n"
+            "event: done\ndata: {}\n\n")
+    response = Response(body, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+CHAT_PROMPT = PromptTemplate("""
+        Siz SmartBot.uz kompaniyasining AI yordamchisisiz. Mijoz bilan do'stona va professional tarzda gaplashing.
+        {history}
         Mijoz xabari: "{message}"
 
         Quyidagi qoidalarga rioya qiling:
@@ -575,29 +1593,68 @@ def ai_chat():
         - Web sayt yaratish (/services)
         - Portfolio: /portfolio
         - Bog'lanish: /contact
-        """
-        
-        ai_response = get_ai_response(prompt, 300)
-        
-        if ai_response:
-            return jsonify({
-                'success': True,
-                'response': ai_response
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'response': 'Kechirasiz, hozir javob bera olmayapman. Iltimos, keyinroq urinib ko\'ring.'
-            })
-            
+        """, AI_INPUT_BUDGETS['chat'], limits={'message': CHAT_MESSAGE_TOKENS}, elastic='history')
+
+def build_chat_prompt(message, summary='', turns=()):
+    """Create context-aware prompt for SmartBot.uz (with the conversation so far)
+
+    The history gives way first when the prompt would exceed its budget.
+    """
+    history = ''
+    if summary:
+        history += f"\nOldingi suhbat xulosasi:\n{summary}\n"
+    if turns:
+        history += "\nSo'nggi xabarlar:\n" + ''.join(
+            f"Mijoz: {turn['user']}\nYordamchi: {turn['assistant']}\n" for turn in turns)
+    return CHAT_PROMPT.render(message=message, history=history)
+
+def stream_chat_response(prompt, on_complete=None):
+    """Forward model chunks to the browser as Server-Sent Events
+
+    on_complete(answer) is called with the full answer once streaming ends.
+    """
+    from flask import Response
+    
+    # Start generation here so a rate limit still becomes a proper 429 response
+    chunks = stream_ai_response(prompt, 300, use_case='chat')
+    try:
+        first_chunk = next(chunks, None)
+    except AIRateLimitExceeded:
+        raise
     except Exception as e:
-        app.logger.error(f"AI chat error: {e}")
-        return jsonify({'error': 'Ichki xatolik yuz berdi'}), 500
+        app.logger.error(f"AI chat stream error: {e}")
+        first_chunk = None
+    
+    def generate():
+        sent = False
+        parts = []
+        try:
+            if first_chunk is not None:
+                sent = True
+                parts.append(first_chunk)
+                yield f"event: delta\ndata: {json.dumps({'text': first_chunk}, ensure_ascii=False)}\n\n"
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield f"event: delta\ndata: {json.dumps({'text': chunk}, ensure_ascii=False)}\n\n"
+            if parts and on_complete:
+                on_complete(''.join(parts))
+        except Exception as e:
+            app.logger.error(f"AI chat stream error: {e}")
+        
+        if not sent:
+            fallback = 'Kechirasiz, hozir javob bera olmayapman. Iltimos, keyinroq urinib ko\'ring.'
+            yield f"event: error\ndata: {json.dumps({'text': fallback}, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/ai/blog', methods=['POST'])
 def ai_generate_blog():
-    """Generate blog article with AI"""
-    if not AI_MODEL:
+    """Queue blog article generation with AI; poll /ai/jobs/<id> for the result"""
+    if not AI_PROVIDER:
         return jsonify({'error': 'AI xizmati mavjud emas'}), 503
     
     try:
@@ -607,52 +1664,81 @@ def ai_generate_blog():
         if not topic:
             return jsonify({'error': 'Mavzu kiritilmagan'}), 400
         
-        # Generate blog content
-        blog_content = create_blog_with_ai(topic)
-        
-        if blog_content:
-            # Save to blog data
-            blogs = load_data(BLOG_FILE)
-            new_id = max([b.get('id', 0) for b in blogs], default=0) + 1
-            
-            # Extract title from content (first h2 or first line)
-            import re
-            title_match = re.search(r'<h2>(.*?)</h2>', blog_content)
-            title = title_match.group(1) if title_match else topic
-            
-            new_blog = {
-                'id': new_id,
-                'title': title,
-                'content': blog_content,
-                'excerpt': f"{topic} haqida batafsil ma'lumot",
-                'category': 'AI Generated',
-                'date': datetime.now().strftime('%Y-%m-%d'),
-                'slug': create_slug(title),
-                'ai_generated': True
-            }
-            
-            blogs.append(new_blog)
-            save_data(BLOG_FILE, blogs)
-            
-            return jsonify({
-                'success': True,
-                'blog': new_blog,
-                'message': 'Blog maqolasi muvaffaqiyatli yaratildi!'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Blog yaratishda xatolik yuz berdi'
-            })
+        return queue_ai_job('blog', run_blog_generation_job, topic)
             
     except Exception as e:
         app.logger.error(f"AI blog generation error: {e}")
         return jsonify({'error': 'Ichki xatolik yuz berdi'}), 500
 
+def run_blog_generation_job(topic):
+    """Background job: generate a blog article and save it"""
+    blog_content = create_blog_with_ai(topic)
+    
+    if not blog_content:
+        return {
+            'success': False,
+            'message': 'Blog yaratishda xatolik yuz berdi'
+        }
+    
+    # Extract title from content (first h2 or first line)
+    title_match = re.search(r'<h2>(.*?)</h2>', blog_content)
+    title = title_match.group(1) if title_match else topic
+    
+    # Jobs run in parallel threads; serialize the read-modify-write of blog.json
+    with locked(BLOG_FILE):
+        blogs = load_data(BLOG_FILE)
+        new_id = max([b.get('id', 0) for b in blogs], default=0) + 1
+        
+        new_blog = {
+            'id': new_id,
+            'title': title,
+            'content': blog_content,
+            'excerpt': f"{topic} haqida batafsil ma'lumot",
+            'category': 'AI Generated',
+            'date': datetime.now().strftime('%Y-%m-%d'),
+            'slug': create_slug(title),
+            'ai_generated': True
+        }
+        
+        blogs.append(new_blog)
+        save_data(BLOG_FILE, blogs)
+    index_blog_post(new_blog)
+    
+    return {
+        'success': True,
+        'blog': new_blog,
+        'message': 'Blog maqolasi muvaffaqiyatli yaratildi!'
+    }
+
+def queue_ai_job(kind, func, *args):
+    """Submit a background AI job and answer 202 with its status URL"""
+    job_id = ai_jobs.submit(kind, func, *args)
+    if not job_id:
+        response = jsonify({'error': 'Navbat to\'la, birozdan keyin urinib ko\'ring'})
+        response.headers['Retry-After'] = '30'
+        return response, 429
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('ai_job_status', job_id=job_id)
+    }), 202
+
+@app.route('/ai/jobs/<job_id>')
+def ai_job_status(job_id):
+    """Background AI job status and result"""
+    job = ai_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Vazifa topilmadi'}), 404
+    if job['kind'] in ADMIN_AI_JOB_KINDS and not session.get('admin'):
+        return jsonify({'error': 'Ruxsat berilmagan'}), 403
+    return jsonify(job)
+
 @app.route('/ai/analyze', methods=['POST'])
 def ai_analyze_contact():
     """Analyze contact form submission"""
-    if not AI_MODEL:
+    if not AI_PROVIDER:
         return jsonify({'error': 'AI xizmati mavjud emas'}), 503
     
     try:
@@ -662,8 +1748,14 @@ def ai_analyze_contact():
         if not message:
             return jsonify({'error': 'Tahlil qilish uchun matn kerak'}), 400
         
-        # Analyze message
-        analysis = analyze_text_with_ai(message, "contact")
+        message = fit_text(message, CONTACT_TEXT_TOKENS)
+        
+        # Analyze message (local classifier first, Gemini when unsure)
+        try:
+            label, _ = classify_contact_message(message)
+        except TransientError:
+            # Gemini is unavailable and the local classifier unsure: general recommendation
+            label = None
         
         # Map analysis to service recommendations
         service_map = {
@@ -694,7 +1786,7 @@ def ai_analyze_contact():
             }
         }
         
-        recommended_service = service_map.get(analysis.strip().lower() if analysis else '', {
+        recommended_service = service_map.get(label or '', {
             'service': 'Umumiy Konsultatsiya',
             'description': 'Ehtiyojlaringizni batafsil muhokama qilish',
             'url': '/contact'
@@ -702,18 +1794,20 @@ def ai_analyze_contact():
         
         return jsonify({
             'success': True,
-            'analysis': analysis,
+            'analysis': label,
             'recommendation': recommended_service
         })
         
+    except AIRateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
         app.logger.error(f"AI analysis error: {e}")
         return jsonify({'error': 'Tahlil qilishda xatolik yuz berdi'}), 500
 
 @app.route('/ai/case-study', methods=['POST'])
 def ai_generate_case_study():
-    """Generate portfolio case study with AI"""
-    if not AI_MODEL:
+    """Queue portfolio case study generation; poll /ai/jobs/<id> for the result"""
+    if not AI_PROVIDER:
         return jsonify({'error': 'AI xizmati mavjud emas'}), 503
     
     try:
@@ -723,29 +1817,89 @@ def ai_generate_case_study():
         if not project_info:
             return jsonify({'error': 'Loyiha ma\'lumotlari kiritilmagan'}), 400
         
-        # Generate case study
-        case_study = create_case_study_with_ai(project_info)
-        
-        if case_study:
-            return jsonify({
-                'success': True,
-                'case_study': case_study,
-                'message': 'Case study muvaffaqiyatli yaratildi!'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Case study yaratishda xatolik yuz berdi'
-            })
+        return queue_ai_job('case_study', run_case_study_job, project_info)
             
     except Exception as e:
         app.logger.error(f"AI case study error: {e}")
         return jsonify({'error': 'Ichki xatolik yuz berdi'}), 500
 
+def run_case_study_job(project_info):
+    """Background job: generate a case study"""
+    case_study = create_case_study_with_ai(project_info)
+    
+    if case_study:
+        return {
+            'success': True,
+            'case_study': case_study,
+            'message': 'Case study muvaffaqiyatli yaratildi!'
+        }
+    return {
+        'success': False,
+        'message': 'Case study yaratishda xatolik yuz berdi'
+    }
+
+def document_analysis_response(pages, stream=False, digest=None, cached=None):
+    """Run iter_document_analysis as one JSON answer or as Server-Sent Events
+
+    Streamed events: "partial" per finished chunk (with done/total), then
+    "result" with the final analysis and "done". A cached result is
+    answered at once; a complete new one is stored under digest.
+    """
+    from flask import Response
+    
+    extracted_text = '\n'.join(pages).strip()
+    preview = extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text
+    
+    def analysis_events():
+        if cached:
+            yield dict(cached, cached=True)
+            return
+        for event in iter_document_analysis(pages):
+            if (event['type'] == 'result' and digest and event['analysis']
+                    and not event['timed_out'] and event['analyzed'] == event['total']):
+                document_cache.set(digest, pages, event, AI_MODEL_NAME)
+            yield event
+    
+    if not stream:
+        result = {}
+        for event in analysis_events():
+            result = event
+        return jsonify({
+            'success': True,
+            'file_type': 'PDF',
+            'pages': len(pages),
+            'extracted_text': preview,
+            'analysis': result.get('analysis'),
+            'chunks': result.get('total'),
+            'analyzed_chunks': result.get('analyzed'),
+            'partial': result.get('timed_out') or result.get('analyzed') != result.get('total'),
+            'cached': result.get('cached', False)
+        })
+    
+    def generate():
+        yield f"event: start\ndata: {json.dumps({'pages': len(pages), 'extracted_text': preview}, ensure_ascii=False)}\n\n"
+        try:
+            for event in analysis_events():
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            app.logger.error(f"AI document stream error: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': 'Hujjat tahlilida xatolik yuz berdi'}, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/ai/document', methods=['POST'])
 def ai_analyze_document():
-    """Analyze uploaded document (PDF/image)"""
-    if not AI_MODEL:
+    """Analyze uploaded document (PDF/image)
+
+    With stream=1 in the form, PDF analysis progress is sent as
+    Server-Sent Events (see document_analysis_response). Uploads are
+    looked up in document_cache by content hash first.
+    """
+    if not AI_PROVIDER:
         return jsonify({'error': 'AI xizmati mavjud emas'}), 503
     
     try:
@@ -760,33 +1914,32 @@ def ai_analyze_document():
         file_type = mimetypes.guess_type(file.filename)[0] if file.filename else None
         
         if file_type and file_type.startswith('application/pdf'):
-            # Save temporarily and extract text
-            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{uuid.uuid4().hex}.pdf")
-            file.save(temp_path)
-            
-            try:
-                extracted_text = extract_text_from_pdf(temp_path)
-                os.remove(temp_path)  # Clean up
-                
-                if extracted_text:
-                    analysis = analyze_text_with_ai(extracted_text, "document")
-                    
-                    return jsonify({
-                        'success': True,
-                        'file_type': 'PDF',
-                        'extracted_text': extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text,
-                        'analysis': analysis
-                    })
-                else:
+            started = time.monotonic()
+            data, digest = read_upload(file)
+            entry = document_cache.get(digest, AI_MODEL_NAME)
+            if entry:
+                pages = entry['pages']
+                if entry['analysis']:
+                    record_ai_call('document', started, 'cache_hit')
+            else:
+                try:
+                    pages = extract_pages_from_pdf(data)
+                except PDFExtractionTimeout:
                     return jsonify({
                         'success': False,
-                        'message': 'PDF dan matn ajratib olinmadi'
-                    })
-                    
-            except Exception as e:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                raise e
+                        'message': 'PDF faylini o\'qish juda uzoq davom etdi. Kichikroq fayl yuklang.'
+                    }), 422
+                if pages and any(page.strip() for page in pages):
+                    document_cache.set(digest, pages)
+            
+            if pages and any(page.strip() for page in pages):
+                return document_analysis_response(pages, request.form.get('stream') == '1', digest,
+                                                  entry['analysis'] if entry else None)
+            else:
+                return jsonify({
+                    'success': False,
+                    'message': 'PDF dan matn ajratib olinmadi'
+                })
                 
         elif file_type and file_type.startswith('image/'):
             # For images, we can only provide basic info
@@ -799,6 +1952,8 @@ def ai_analyze_document():
         else:
             return jsonify({'error': 'Faqat PDF va rasm fayllari qo\'llab-quvvatlanadi'}), 400
             
+    except AIRateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
         app.logger.error(f"AI document analysis error: {e}")
         return jsonify({'error': 'Hujjat tahlilida xatolik yuz berdi'}), 500
@@ -837,29 +1992,38 @@ def admin_logout():
     flash("Tizimdan chiqish amalga oshirildi.", "info")
     return redirect(url_for('index'))
 
+def get_admin_stats():
+    """Collect all dashboard numbers from one snapshot, cached for ADMIN_STATS_TTL seconds
+
+    Returns (stats, etag).
+    """
+    import hashlib
+
+    with _admin_stats_lock:
+        if _admin_stats_cache['stats'] is not None and time.monotonic() < _admin_stats_cache['expires']:
+            return _admin_stats_cache['stats'], _admin_stats_cache['etag']
+
+        messages = load_data(MESSAGES_FILE)
+        blogs = load_data(BLOG_FILE)
+        today = datetime.now().strftime('%Y-%m-%d')
+        stats = {
+            'services': len(load_data(SERVICES_FILE)),
+            'portfolio': len(load_data(PORTFOLIO_FILE)),
+            'blog': len(blogs),
+            'messages': len(messages),
+            'new_messages': len([m for m in messages if m.get('status') == 'yangi']),
+            'ai_posts': len([b for b in blogs if b.get('date') == today and b.get('ai_generated')]),
+            'last_marketing_run': get_last_marketing_run()
+        }
+        etag = hashlib.md5(json.dumps(stats, sort_keys=True).encode('utf-8')).hexdigest()
+
+        _admin_stats_cache.update(stats=stats, etag=etag, expires=time.monotonic() + ADMIN_STATS_TTL)
+        return stats, etag
+
 @app.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    services_count = len(load_data(SERVICES_FILE))
-    portfolio_count = len(load_data(PORTFOLIO_FILE))
-    blog_count = len(load_data(BLOG_FILE))
-    messages_count = len(load_data(MESSAGES_FILE))
-    
-    # Count new messages
-    messages = load_data(MESSAGES_FILE)
-    new_messages_count = len([m for m in messages if m.get('status') == 'yangi'])
-    
-    # Count AI generated posts today
-    ai_posts_count = get_today_posts_count()
-    
-    stats = {
-        'services': services_count,
-        'portfolio': portfolio_count,
-        'blog': blog_count,
-        'messages': messages_count,
-        'new_messages': new_messages_count,
-        'ai_posts': ai_posts_count
-    }
+    stats, _ = get_admin_stats()
     return render_template('admin/dashboard.html', stats=stats)
 
 # ========================
@@ -941,6 +2105,99 @@ def admin_services_delete(service_id):
     
     return redirect(url_for('admin_services'))
 
+# ========================
+# CHATBOT FAQ MANAGEMENT
+# ========================
+
+def faq_form_data():
+    """(questions, answer) from the FAQ form, one question per line"""
+    questions = [q.strip() for q in request.form.get('questions', '').splitlines() if q.strip()]
+    return questions, request.form.get('answer', '').strip()
+
+@app.route('/admin/faq')
+@admin_required
+def admin_faq():
+    faq = load_data(FAQ_FILE)
+    return render_template('admin/faq.html', faq=faq, stats=faq_cache.stats())
+
+@app.route('/admin/faq/add', methods=['GET', 'POST'])
+@admin_required
+def admin_faq_add():
+    if request.method == 'POST':
+        questions, answer = faq_form_data()
+        
+        if not questions or not answer:
+            flash("Savol va javobni kiriting!", "error")
+        else:
+            faq = load_data(FAQ_FILE)
+            new_id = max([f.get('id', 0) for f in faq], default=0) + 1
+            faq.append({
+                'id': new_id,
+                'intent': request.form.get('intent', '').strip(),
+                'questions': questions,
+                'answer': answer
+            })
+            if save_data(FAQ_FILE, faq):
+                flash("Yangi javob qo'shildi!", "success")
+                return redirect(url_for('admin_faq'))
+            else:
+                flash("Xatolik yuz berdi!", "error")
+    
+    return render_template('admin/faq_form.html')
+
+@app.route('/admin/faq/edit/<int:faq_id>', methods=['GET', 'POST'])
+@admin_required
+def admin_faq_edit(faq_id):
+    faq = load_data(FAQ_FILE)
+    item = next((f for f in faq if f.get('id') == faq_id), None)
+    
+    if not item:
+        flash("Javob topilmadi!", "error")
+        return redirect(url_for('admin_faq'))
+    
+    if request.method == 'POST':
+        questions, answer = faq_form_data()
+        if not questions or not answer:
+            flash("Savol va javobni kiriting!", "error")
+        else:
+            item['intent'] = request.form.get('intent', '').strip()
+            item['questions'] = questions
+            item['answer'] = answer
+            if save_data(FAQ_FILE, faq):
+                flash("Javob yangilandi!", "success")
+                return redirect(url_for('admin_faq'))
+            else:
+                flash("Xatolik yuz berdi!", "error")
+    
+    return render_template('admin/faq_form.html', item=item)
+
+@app.route('/admin/faq/delete/<int:faq_id>')
+@admin_required
+def admin_faq_delete(faq_id):
+    faq = [f for f in load_data(FAQ_FILE) if f.get('id') != faq_id]
+    
+    if save_data(FAQ_FILE, faq):
+        flash("Javob o'chirildi!", "success")
+    else:
+        flash("Xatolik yuz berdi!", "error")
+    
+    return redirect(url_for('admin_faq'))
+
+@app.route('/admin/faq/seed-prices', methods=['POST'])
+@admin_required
+def admin_faq_seed_prices():
+    """Regenerate the price answers from services.json, keeping hand-written ones"""
+    faq = [f for f in load_data(FAQ_FILE) if not str(f.get('intent', '')).startswith('narx')]
+    start_id = max([f.get('id', 0) for f in faq], default=0) + 1
+    faq.extend(build_price_faq(load_data(SERVICES_FILE), start_id))
+    
+    if save_data(FAQ_FILE, faq):
+        flash("Narxlar bo'yicha javoblar yangilandi!", "success")
+    else:
+        flash("Xatolik yuz berdi!", "error")
+    
+    return redirect(url_for('admin_faq'))
+
 # ========================
 # BLOG MANAGEMENT
 # ========================
@@ -963,21 +2220,24 @@ def admin_blog_add():
         if not all([title, content, excerpt, category]):
             flash("Barcha maydonlarni to'ldiring!", "error")
         else:
-            blogs = load_data(BLOG_FILE)
-            new_id = max([b.get('id', 0) for b in blogs], default=0) + 1
-            
-            new_blog = {
-                'id': new_id,
-                'title': title,
-                'content': content,
-                'excerpt': excerpt,
-                'category': category,
-                'date': datetime.now().strftime('%Y-%m-%d'),
-                'slug': create_slug(title)
-            }
-            
-            blogs.append(new_blog)
-            if save_data(BLOG_FILE, blogs):
+            with locked(BLOG_FILE):
+                blogs = load_data(BLOG_FILE)
+                new_id = max([b.get('id', 0) for b in blogs], default=0) + 1
+                
+                new_blog = {
+                    'id': new_id,
+                    'title': title,
+                    'content': content,
+                    'excerpt': excerpt,
+                    'category': category,
+                    'date': datetime.now().strftime('%Y-%m-%d'),
+                    'slug': create_slug(title)
+                }
+                
+                blogs.append(new_blog)
+                saved = save_data(BLOG_FILE, blogs)
+            if saved:
+                index_blog_post(new_blog)
                 flash("Yangi maqola qo'shildi!", "success")
                 return redirect(url_for('admin_blog'))
             else:
@@ -996,13 +2256,17 @@ def admin_blog_edit(blog_id):
         return redirect(url_for('admin_blog'))
     
     if request.method == 'POST':
-        blog['title'] = request.form.get('title', '').strip()
-        blog['content'] = request.form.get('content', '').strip()
-        blog['excerpt'] = request.form.get('excerpt', '').strip()
-        blog['category'] = request.form.get('category', '').strip()
-        blog['slug'] = create_slug(blog['title'])
+        fields = {
+            'title': request.form.get('title', '').strip(),
+            'content': request.form.get('content', '').strip(),
+            'excerpt': request.form.get('excerpt', '').strip(),
+            'category': request.form.get('category', '').strip()
+        }
+        fields['slug'] = create_slug(fields['title'])
+        blog.update(fields)
         
-        if save_data(BLOG_FILE, blogs):
+        if update_blog_post(blog_id, fields):
+            index_blog_post(blog)
             flash("Maqola yangilandi!", "success")
             return redirect(url_for('admin_blog'))
         else:
@@ -1013,10 +2277,13 @@ def admin_blog_edit(blog_id):
 @app.route('/admin/blog/delete/<int:blog_id>')
 @admin_required
 def admin_blog_delete(blog_id):
-    blogs = load_data(BLOG_FILE)
-    blogs = [b for b in blogs if b.get('id') != blog_id]
+    with locked(BLOG_FILE):
+        blogs = load_data(BLOG_FILE)
+        blogs = [b for b in blogs if b.get('id') != blog_id]
+        saved = save_data(BLOG_FILE, blogs)
     
-    if save_data(BLOG_FILE, blogs):
+    if saved:
+        index_blog_post(removed_id=blog_id)
         flash("Maqola o'chirildi!", "success")
     else:
         flash("Xatolik yuz berdi!", "error")
@@ -1031,20 +2298,52 @@ def admin_blog_delete(blog_id):
 @admin_required
 def admin_messages():
     messages = load_data(MESSAGES_FILE)
+    requeue_stale_enrichment(messages)
     # Reverse order - yangi messages birinchi
-    messages = sorted(messages, key=lambda x: x.get('date', ''), reverse=True)
+    messages = sorted(messages, key=lambda x: x.get('date') or '', reverse=True)
     return render_template('admin/messages.html', messages=messages)
 
+@app.route('/api/admin/messages/status')
+@admin_required
+def api_admin_messages_status():
+    """Enrichment and Telegram status of the messages given as ?ids=1,2,3"""
+    ids = {int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()}
+    return jsonify({'messages': [{
+        'id': m['id'],
+        'enrichment': m.get('enrichment', 'done'),
+        'ai_recommendation': m.get('ai_recommendation'),
+        'telegram_sent': m.get('telegram_sent', False),
+        'telegram_status': m.get('telegram_status')
+    } for m in iter_data(MESSAGES_FILE) if m.get('id') in ids]})
+
+@app.route('/admin/telegram-outbox/replay', methods=['POST'])
+@admin_required
+def admin_telegram_outbox_replay():
+    """Retry every Telegram message that ran out of attempts"""
+    count = telegram_outbox.replay()
+    _outbox_wakeup.set()
+    flash(f"{count} ta Telegram xabari qayta yuborish navbatiga qo'yildi!", "success")
+    return redirect(url_for('admin_messages'))
+
+@app.route('/api/admin/telegram-outbox')
+@admin_required
+def api_admin_telegram_outbox():
+    """Telegram outbox entries by status and recent failures"""
+    return jsonify(telegram_outbox.stats())
+
 @app.route('/admin/messages/mark-read/<int:message_id>')
 @admin_required
 def admin_message_mark_read(message_id):
-    messages = load_data(MESSAGES_FILE)
-    for message in messages:
-        if message.get('id') == message_id:
-            message['status'] = 'ko\'rilgan'
-            break
-    
-    if save_data(MESSAGES_FILE, messages):
+    with locked(MESSAGES_FILE):
+        messages = load_data(MESSAGES_FILE)
+        for message in messages:
+            if message.get('id') == message_id:
+                message['status'] = 'ko\'rilgan'
+                break
+        saved = save_data(MESSAGES_FILE, messages)
+    
+    if saved:
+        publish_message_counts(messages)
         flash("Xabar o'qilgan deb belgilandi!", "success")
     else:
         flash("Xatolik yuz berdi!", "error")
@@ -1054,52 +2353,100 @@ def admin_message_mark_read(message_id):
 @app.route('/admin/messages/delete/<int:message_id>')
 @admin_required
 def admin_message_delete(message_id):
-    messages = load_data(MESSAGES_FILE)
-    messages = [m for m in messages if m.get('id') != message_id]
+    with locked(MESSAGES_FILE):
+        messages = load_data(MESSAGES_FILE)
+        messages = [m for m in messages if m.get('id') != message_id]
+        saved = save_data(MESSAGES_FILE, messages)
     
-    if save_data(MESSAGES_FILE, messages):
+    if saved:
+        publish_message_counts(messages)
         flash("Xabar o'chirildi!", "success")
     else:
         flash("Xatolik yuz berdi!", "error")
     
     return redirect(url_for('admin_messages'))
 
+def iter_messages(date_from=None, date_to=None, status=None, service=None):
+    """Stream messages matching the filters straight from storage"""
+    for msg in iter_data(MESSAGES_FILE):
+        # A stored null date counts as an empty one
+        day = (msg.get('date') or '')[:10]
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        if status and msg.get('status') != status:
+            continue
+        if service and msg.get('service') != service:
+            continue
+        yield msg
+
+EXPORT_FIELDS = ['id', 'name', 'email', 'phone', 'service', 'budget', 'message', 'date', 'status']
+EXPORT_HEADERS = ['ID', 'Ism', 'Email', 'Telefon', 'Xizmat', 'Byudjet', 'Xabar', 'Sana', 'Status']
+
 @app.route('/admin/messages/export-csv')
 @admin_required
 def export_messages_csv():
-    """Export messages to CSV"""
+    """Export messages to CSV or JSONL as a streamed download
+
+    Query parameters: format (csv/jsonl), gzip (1), from/to (YYYY-MM-DD),
+    status and service.
+    """
     import csv
+    import zlib
     from io import StringIO
-    from flask import make_response
-    
-    messages = load_data(MESSAGES_FILE)
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow(['ID', 'Ism', 'Email', 'Telefon', 'Xizmat', 'Byudjet', 'Xabar', 'Sana', 'Status'])
-    
-    # Data
-    for msg in messages:
-        writer.writerow([
-            msg.get('id', ''),
-            msg.get('name', ''),
-            msg.get('email', ''),
-            msg.get('phone', ''),
-            msg.get('service', ''),
-            msg.get('budget', ''),
-            msg.get('message', ''),
-            msg.get('date', ''),
-            msg.get('status', '')
-        ])
-    
-    output.seek(0)
-    
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = f'attachment; filename=messages_{datetime.now().strftime("%Y%m%d")}.csv'
-    
+    from flask import Response, stream_with_context
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        return jsonify({'error': 'Noto\'g\'ri format'}), 400
+    use_gzip = request.args.get('gzip') in ('1', 'true')
+
+    filters = {
+        'date_from': request.args.get('from') or None,
+        'date_to': request.args.get('to') or None,
+        'status': request.args.get('status') or None,
+        'service': request.args.get('service') or None,
+    }
+
+    def generate_rows():
+        if export_format == 'jsonl':
+            for msg in iter_messages(**filters):
+                yield json.dumps({k: msg.get(k, '') for k in EXPORT_FIELDS}, ensure_ascii=False) + '\n'
+            return
+
+        # One small reusable buffer per row keeps memory flat
+        line = StringIO()
+        writer = csv.writer(line)
+        writer.writerow(EXPORT_HEADERS)
+        yield line.getvalue()
+        for msg in iter_messages(**filters):
+            line.seek(0)
+            line.truncate()
+            writer.writerow([msg.get(k, '') for k in EXPORT_FIELDS])
+            yield line.getvalue()
+
+    def generate():
+        if not use_gzip:
+            for chunk in generate_rows():
+                yield chunk.encode('utf-8')
+            return
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in generate_rows():
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+
+    extension = 'csv' if export_format == 'csv' else 'jsonl'
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    if use_gzip:
+        extension += '.gz'
+        mimetype = 'application/gzip'
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=messages_{datetime.now().strftime("%Y%m%d")}.{extension}'
     return response
 
 @app.route('/api/unread-count')
@@ -1117,6 +2464,145 @@ def api_total_messages_count():
     messages = load_data(MESSAGES_FILE)
     return jsonify({'total': len(messages)})
 
+@app.route('/api/admin/stats')
+@admin_required
+def api_admin_stats():
+    """All dashboard numbers in one response, with ETag for cheap polling"""
+    stats, etag = get_admin_stats()
+    response = jsonify(stats)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'private, max-age={ADMIN_STATS_TTL}'
+    return response.make_conditional(request)
+
+@app.route('/api/admin/ai-cache')
+@admin_required
+def api_admin_ai_cache():
+    """AI response cache hit rate and savings for this worker"""
+    return jsonify(ai_cache.stats())
+
+@app.route('/api/admin/document-cache')
+@admin_required
+def api_admin_document_cache():
+    """Document analysis cache size and hit counters"""
+    return jsonify(document_cache.stats())
+
+@app.route('/api/admin/ai-limiter')
+@admin_required
+def api_admin_ai_limiter():
+    """Shared Gemini limiter state (in-flight calls and remaining budgets)"""
+    return jsonify(ai_limiter.status())
+
+@app.route('/api/admin/contact-classifier')
+@admin_required
+def api_admin_contact_classifier():
+    """Local contact classifier: routing share, agreement with Gemini, latency
+
+    With ?evaluate=1 also runs 5-fold cross-validation on the training data.
+    """
+    result = {'stats': contact_classifier.stats()}
+    if request.args.get('evaluate'):
+        result['evaluation'] = cross_validate(contact_training_examples(),
+                                              threshold=CONTACT_CLASSIFIER_THRESHOLD)
+    return jsonify(result)
+
+@app.route('/api/admin/breakers')
+@admin_required
+def api_admin_breakers():
+    """Circuit breaker state for outbound dependencies (Gemini, Telegram)"""
+    return jsonify({'breakers': breaker_status()})
+
+@app.route('/api/admin/faq-cache')
+@admin_required
+def api_admin_faq_cache():
+    """Chatbot FAQ cache hit rate and size (this worker only)"""
+    return jsonify(faq_cache.stats())
+
+def ai_usage_window():
+    """(label, seconds) of the ?window= argument, one of AI_METRICS_WINDOWS"""
+    label = request.args.get('window', '24h')
+    if label not in AI_METRICS_WINDOWS:
+        label = '24h'
+    return label, AI_METRICS_WINDOWS[label]
+
+@app.route('/api/admin/ai-usage')
+@admin_required
+def api_admin_ai_usage():
+    """AI calls, tokens, cost and latency histograms per feature (?window=1h|24h|7d)"""
+    label, seconds = ai_usage_window()
+    return jsonify({'window_label': label, 'model': AI_MODEL_NAME, **ai_metrics.summary(seconds)})
+
+_sse_streams = {'open': 0}
+_sse_streams_lock = threading.Lock()
+
+@app.route('/api/admin/events')
+@admin_required
+def api_admin_events():
+    """Server-Sent Events stream with unread/total message counts
+
+    Streams are closed after SSE_STREAM_LIFETIME seconds; the browser then
+    reconnects with Last-Event-ID, so no worker thread is held forever.
+    Beyond SSE_MAX_STREAMS open streams in this worker the response only
+    asks the browser to come back in SSE_BUSY_RETRY seconds.
+    """
+    from flask import Response
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId', '')
+    try:
+        last_version = int(last_event_id)
+    except ValueError:
+        last_version = -1
+
+    if not os.path.exists(ADMIN_EVENTS_FILE):
+        publish_message_counts(load_data(MESSAGES_FILE))
+
+    def generate():
+        # The slot is taken inside the generator: its finally only runs once it has started
+        with _sse_streams_lock:
+            busy = _sse_streams['open'] >= SSE_MAX_STREAMS
+            if not busy:
+                _sse_streams['open'] += 1
+        if busy:
+            yield f"retry: {SSE_BUSY_RETRY * 1000}\n\n"
+            return
+        try:
+            yield from stream_counts()
+        finally:
+            with _sse_streams_lock:
+                _sse_streams['open'] -= 1
+
+    def stream_counts():
+        version = last_version
+        last_mtime = None
+        last_heartbeat = time.monotonic()
+        deadline = last_heartbeat + SSE_STREAM_LIFETIME
+        yield f"retry: {SSE_POLL_INTERVAL * 1000}\n\n"
+
+        while time.monotonic() < deadline:
+            try:
+                mtime = os.stat(ADMIN_EVENTS_FILE).st_mtime_ns
+            except OSError:
+                mtime = None
+
+            if mtime != last_mtime:
+                last_mtime = mtime
+                state = read_admin_events_state()
+                if state and state.get('version', 0) != version:
+                    version = state['version']
+                    payload = json.dumps({'count': state['unread'], 'total': state['total']})
+                    yield f"id: {version}\nevent: counts\ndata: {payload}\n\n"
+                    last_heartbeat = time.monotonic()
+
+            if time.monotonic() - last_heartbeat >= SSE_HEARTBEAT_INTERVAL:
+                yield ": heartbeat\n\n"
+                last_heartbeat = time.monotonic()
+
+            time.sleep(SSE_POLL_INTERVAL)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # ========================
 # PORTFOLIO MANAGEMENT
 # ========================
@@ -1309,72 +2795,125 @@ def admin_ai_marketing():
     return render_template('admin/ai_marketing.html', 
                           last_run=last_run, 
                           today_posts=today_posts,
-                          marketing_stats=marketing_stats)
+                          marketing_stats=marketing_stats,
+                          breakers={b['name']: b for b in breaker_status()})
+
+@app.route('/admin/ai/usage')
+@admin_required
+def admin_ai_usage():
+    """AI chaqiruvlari: funksiya bo'yicha tokenlar, xarajat va kechikish"""
+    label, seconds = ai_usage_window()
+    return render_template('admin/ai_usage.html', usage=ai_metrics.summary(seconds),
+                           window=label, windows=list(AI_METRICS_WINDOWS), model=AI_MODEL_NAME)
 
 @app.route('/admin/ai/marketing/run', methods=['POST'])
 @admin_required
 def ai_daily_marketing():
-    """Kundalik AI marketing jarayoni"""
-    if not AI_MODEL:
+    """Kundalik AI marketing jarayoni (fon vazifasi; holati /ai/jobs/<id> da)"""
+    if not AI_PROVIDER:
         return jsonify({'success': False, 'error': 'AI xizmati mavjud emas'}), 503
     
-    try:
-        # 1. Trendlarni olish
-        trends = get_latest_trends()
+    return queue_ai_job('marketing', run_marketing_job)
+
+def run_marketing_job():
+    """Background job: generate trend posts in parallel, save them in one write, then publish"""
+    # 1. Trendlarni olish
+    trends = get_latest_trends()[:MARKETING_POSTS_PER_RUN]
+    progress = {'stage': 'generating', 'total': len(trends), 'generated': 0, 'failed': 0, 'published': 0}
+    ai_jobs.report_progress(progress)
+    
+    # 2. Blog postlarini parallel yaratish
+    contents = generate_marketing_posts(trends, progress)
+    
+    # 3. Barcha postlarni bitta yozuvda saqlash
+    progress['stage'] = 'saving'
+    ai_jobs.report_progress(progress)
+    posts = []
+    with locked(BLOG_FILE):
+        blogs = load_data(BLOG_FILE)
+        next_id = max([b.get('id', 0) for b in blogs], default=0) + 1
+        for trend in trends:
+            if trend not in contents:
+                continue
+            title = contents[trend]['title']
+            posts.append({
+                'id': next_id,
+                'title': title,
+                'content': contents[trend]['content'],
+                'excerpt': f"{trend} haqida batafsil ma'lumot va tahlil",
+                'category': 'AI Trend',
+                'date': datetime.now().strftime('%Y-%m-%d'),
+                'slug': create_slug(title),
+                'ai_generated': True,
+                'trend_topic': trend
+            })
+            next_id += 1
+        if posts and not save_data(BLOG_FILE, blogs + posts):
+            raise RuntimeError('Blog postlarini saqlab bo\'lmadi')
+    for post in posts:
+        index_blog_post(post)
+        app.logger.info(f"AI blog post created: {post['title']}")
+    
+    # 4. Saqlangandan keyin Telegram kanaliga yuborish
+    progress['stage'] = 'publishing'
+    ai_jobs.report_progress(progress)
+    for post in posts:
+        if send_to_telegram_channel(post):
+            progress['published'] += 1
+            ai_jobs.report_progress(progress)
+    
+    # 5. Marketing run ma'lumotlarini saqlash
+    save_marketing_run_data(len(posts))
+    progress['stage'] = 'done'
+    ai_jobs.report_progress(progress)
+    
+    return {
+        'success': True,
+        'posts': posts,
+        'count': len(posts),
+        'telegram_sent': progress['published'],
+        'message': f'{len(posts)} ta yangi blog posti yaratildi va Telegram kanaliga yuborish navbatiga qo\'yildi!'
+    }
+
+def generate_marketing_posts(trends, progress):
+    """{trend: {'title', 'content'}} for the trends that produced a usable post
+
+    Batched mode asks for several posts per call (as many as fit the output
+    limit) and re-asks only for posts that failed validation; otherwise
+    each trend gets its own call. Calls run on MARKETING_WORKERS threads.
+    """
+    with ThreadPoolExecutor(max_workers=MARKETING_WORKERS, thread_name_prefix='marketing') as pool:
+        if MARKETING_BATCH:
+            def on_progress(update):
+                progress.update(generated=update['generated'], failed=update['failed'])
+                ai_jobs.report_progress(progress)
+            
+            articles, stats = generate_articles(
+                lambda prompt, max_tokens: get_ai_response(prompt, max_tokens, use_case='marketing',
+                                                           json_schema=ARTICLE_SCHEMA),
+                # One instruction block for every topic in the batch, so the keyword is generic
+                trends, MARKETING_POST_INSTRUCTIONS.format(topic='maqola mavzusi'), MARKETING_TOKENS_PER_POST,
+                pool=pool, on_progress=on_progress
+            )
+            app.logger.info(f"Marketing batch generation: {stats}")
+            return articles
         
-        # 2. Blog postlari yaratish
-        posts = []
-        for i, trend in enumerate(trends[:5]):
+        contents = {}
+        futures = {pool.submit(create_trending_blog_post, trend): trend for trend in trends}
+        for future in as_completed(futures):
+            trend = futures[future]
             try:
-                # AI orqali blog post yaratish
-                post_content = create_trending_blog_post(trend)
-                
-                if post_content:
-                    # Sarlavhani chiqarish
-                    title = extract_title_from_content(post_content)
-                    
-                    # Blog ma'lumotlarini saqlash
-                    blogs = load_data(BLOG_FILE)
-                    new_id = max([b.get('id', 0) for b in blogs], default=0) + 1
-                    
-                    new_post = {
-                        'id': new_id,
-                        'title': title,
-                        'content': post_content,
-                        'excerpt': f"{trend} haqida batafsil ma'lumot va tahlil",
-                        'category': 'AI Trend',
-                        'date': datetime.now().strftime('%Y-%m-%d'),
-                        'slug': create_slug(title),
-                        'ai_generated': True,
-                        'trend_topic': trend
-                    }
-                    
-                    blogs.append(new_post)
-                    save_data(BLOG_FILE, blogs)
-                    posts.append(new_post)
-                    
-                    # Telegram kanaliga yuborish
-                    send_to_telegram_channel(new_post)
-                    
-                    app.logger.info(f"AI blog post created: {title}")
-                    
+                content = future.result()
             except Exception as e:
                 app.logger.error(f"Error creating blog post for trend '{trend}': {e}")
-                continue
-        
-        # 3. Marketing run ma'lumotlarini saqlash
-        save_marketing_run_data(len(posts))
-        
-        return jsonify({
-            'success': True,
-            'posts': posts,
-            'count': len(posts),
-            'message': f'{len(posts)} ta yangi blog posti yaratildi va Telegram kanaliga yuborildi!'
-        })
-        
-    except Exception as e:
-        app.logger.error(f"AI marketing error: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+                content = None
+            if content:
+                contents[trend] = {'title': extract_title_from_content(content), 'content': content}
+                progress['generated'] += 1
+            else:
+                progress['failed'] += 1
+            ai_jobs.report_progress(progress)
+        return contents
 
 def get_latest_trends():
     """So'nggi trendlarni olish"""
@@ -1396,20 +2935,14 @@ def get_latest_trends():
     import random
     return random.sample(base_trends, 5)
 
-def create_trending_blog_post(trend_topic):
-    """Trend mavzusi bo'yicha blog post yaratish"""
-    prompt = f"""
-    O'zbek tilida professional SEO optimallashtirilgan blog maqolasi yozing:
-    
-    Mavzu: {trend_topic}
-    
-    Talablar:
+# {topic}: the article's trend topic (create_trending_blog_post) or a generic phrase (batch mode)
+MARKETING_POST_INSTRUCTIONS = """
     1. Sarlavha: Jozibador va SEO uchun optimallashtirilgan (50-70 belgi)
     2. Kirish: 2-3 paragraf, muammoni aniqlash
     3. Asosiy qism: 4-5 ta bo'lim, har biri 150-250 so'z
     4. Misollar: Real hayot misollari va statistikalar
     5. Xulosa: Amaliy tavsiyalar va chaqiruv
-    6. Kalit so'zlar: {trend_topic}, SmartBot.uz, avtomatlashtirish, AI
+    6. Kalit so'zlar: {topic}, SmartBot.uz, avtomatlashtirish, AI
     
     Uslub:
     - Professional lekin tushunarli
@@ -1419,8 +2952,21 @@ def create_trending_blog_post(trend_topic):
     
     HTML formatda yozing, faqat <h2>, <h3>, <p>, <strong>, <ul>, <li> teglaridan foydalaning.
     """
+
+TRENDING_POST_PROMPT = PromptTemplate("""
+    O'zbek tilida professional SEO optimallashtirilgan blog maqolasi yozing:
+    
+    Mavzu: {topic}
     
-    return get_ai_response(prompt, 2500)
+    Talablar:
+    {instructions}
+    """, AI_INPUT_BUDGETS['marketing'], limits={'topic': 60})
+
+def create_trending_blog_post(trend_topic):
+    """Trend mavzusi bo'yicha blog post yaratish"""
+    instructions = MARKETING_POST_INSTRUCTIONS.format(topic=trend_topic).strip()
+    prompt = TRENDING_POST_PROMPT.render(topic=trend_topic, instructions=instructions)
+    return get_ai_response(prompt, MARKETING_TOKENS_PER_POST, use_case='marketing')
 
 def extract_title_from_content(content):
     """Kontent ichidan sarlavhani chiqarish"""
@@ -1448,9 +2994,9 @@ def extract_title_from_content(content):
         return "AI Blog Posti"
 
 def send_to_telegram_channel(post):
-    """Blog postini Telegram kanaliga yuborish"""
-    if not telegram_bot or not TELEGRAM_CHANNEL_ID:
-        app.logger.warning("Telegram bot yoki kanal ID mavjud emas")
+    """Blog postini Telegram kanaliga yuborish navbatiga qo'yish"""
+    if not TELEGRAM_CHANNEL_ID:
+        app.logger.warning("Telegram kanal ID mavjud emas")
         return False
         
     try:
@@ -1474,16 +3020,12 @@ def send_to_telegram_channel(post):
 
 #SmartBotUz #AI #Trend #Blog"""
         
-        # Telegram Bot API orqali yuborish
-        telegram_bot.send_message(
-            chat_id=TELEGRAM_CHANNEL_ID,
-            text=message,
-            parse_mode='HTML',
-            disable_web_page_preview=False
-        )
-        
-        app.logger.info(f"Blog post sent to Telegram: {post['title']}")
-        return True
+        # Telegram navbati orqali yuborish (har bir maqola bir marta)
+        queued = queue_telegram_message(f"blog:{post['id']}:{post['slug']}", TELEGRAM_CHANNEL_ID, message, 'blog', post['id'],
+                                        disable_web_page_preview=False)
+        if queued:
+            app.logger.info(f"Blog post queued for Telegram: {post['title']}")
+        return queued
         
     except Exception as e:
         app.logger.error(f"Telegram yuborishda xatolik: {e}")
@@ -1523,7 +3065,7 @@ def save_marketing_run_data(posts_count):
             'time': datetime.now().strftime('%H:%M:%S'),
             'posts_created': posts_count,
             'posts_scheduled': posts_count,
-            'ai_model_used': 'gemini-1.5-flash',
+            'ai_model_used': AI_MODEL_NAME,
             'status': 'completed'
         }
         
@@ -1548,7 +3090,7 @@ def get_marketing_statistics():
 def get_autonomous_system_status():
     """Autonomous system holatini tekshirish"""
     status = {
-        'ai_available': AI_MODEL is not None,
+        'ai_available': AI_PROVIDER is not None,
         'telegram_configured': bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID),
         'daily_job_file': os.path.exists('daily_job.py'),
         'data_directory': os.path.exists(DATA_DIR),
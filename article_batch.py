@@ -0,0 +1,160 @@
+"""
+SmartBot.uz - Maqolalarni bitta so'rovda yaratish
+
+Batched generation of several blog articles per model call. The shared
+instructions are sent once with a numbered topic list and the model
+answers with a JSON array (see ARTICLE_SCHEMA). Articles are split and
+validated locally; only the ones that are missing or invalid are asked
+for again.
+"""
+
+import re
+import json
+import time
+import logging
+from concurrent.futures import Executor
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+from prompt_budget import count_tokens
+
+ARTICLE_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'topic': {'type': 'string'},
+            'title': {'type': 'string'},
+            'content': {'type': 'string'}
+        },
+        'required': ['topic', 'title', 'content']
+    }
+}
+
+# Output ceiling of a single Gemini 1.5 Flash response
+MAX_OUTPUT_TOKENS = 8192
+
+TAG_RE = re.compile(r'</?\s*([a-zA-Z0-9]+)[^>]*>')
+FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$')
+
+def build_batch_prompt(topics: List[str], instructions: str) -> str:
+    """One prompt for several topics with the common instructions written once"""
+    numbered = '\n    '.join(f"Mavzu {i}: {topic}" for i, topic in enumerate(topics, 1))
+    return f"""
+    Quyidagi {len(topics)} ta mavzuning har biri uchun alohida blog maqolasi yozing.
+
+    Mavzular:
+    {numbered}
+
+    Har bir maqola uchun talablar:
+    {instructions.strip()}
+
+    Javobni faqat JSON massiv ko'rinishida qaytaring, har bir mavzu uchun bitta obyekt:
+    [{{"topic": "<mavzu ro'yxatdagidek>", "title": "<sarlavha>", "content": "<maqola HTML>"}}]
+    """
+
+def decode_articles(text: str) -> List[Dict[str, Any]]:
+    """Objects of a JSON array; a truncated answer still yields its complete objects"""
+    text = FENCE_RE.sub('', text or '')
+    start = text.find('[')
+    if start < 0:
+        return []
+    decoder = json.JSONDecoder()
+    articles = []
+    pos = start + 1
+    while pos < len(text):
+        while pos < len(text) and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(text) or text[pos] == ']':
+            break
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except ValueError:
+            break
+        if isinstance(item, dict):
+            articles.append(item)
+    return articles
+
+def validate_article(article: Dict[str, Any], min_words: int, allowed_tags: Tuple[str, ...]) -> Optional[str]:
+    """Reason the article is unusable, or None if it is fine"""
+    title = str(article.get('title') or '').strip()
+    content = str(article.get('content') or '').strip()
+    if not 10 <= len(title) <= 150 or '<' in title:
+        return 'sarlavha noto\'g\'ri'
+    tags = {tag.lower() for tag in TAG_RE.findall(content)}
+    if 'p' not in tags:
+        return 'HTML paragraflar yo\'q'
+    if tags - set(allowed_tags):
+        return f"ruxsat etilmagan teglar: {', '.join(sorted(tags - set(allowed_tags)))}"
+    if len(TAG_RE.sub(' ', content).split()) < min_words:
+        return 'maqola juda qisqa'
+    return None
+
+def _match_topic(article: Dict[str, Any], position: int, topics: List[str]) -> Optional[str]:
+    topic = str(article.get('topic') or '').strip().lower()
+    for candidate in topics:
+        if candidate.lower() == topic:
+            return candidate
+    # Models sometimes rephrase the topic; fall back to the list order
+    return topics[position] if position < len(topics) else None
+
+def generate_articles(generate: Callable[[str, int], Optional[str]], topics: List[str], instructions: str,
+                      tokens_per_article: int, min_words: int = 300,
+                      allowed_tags: Tuple[str, ...] = ('h2', 'h3', 'p', 'strong', 'ul', 'li'),
+                      retries: int = 1, pool: Optional[Executor] = None,
+                      on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+                      ) -> Tuple[Dict[str, Dict[str, str]], Dict[str, Any]]:
+    """Generate one article per topic in as few calls as the output limit allows
+
+    generate(prompt, max_tokens) returns the raw model text. Batches run on
+    pool when given. Returns ({topic: {'title', 'content'}}, stats).
+    """
+    per_call = max(1, MAX_OUTPUT_TOKENS // tokens_per_article)
+    articles: Dict[str, Dict[str, str]] = {}
+    errors: Dict[str, str] = {}
+    stats = {'calls': 0, 'prompt_tokens': 0, 'retried': 0, 'seconds': 0.0}
+    started = time.monotonic()
+
+    def run_batch(batch: List[str]) -> List[Dict[str, Any]]:
+        prompt = build_batch_prompt(batch, instructions)
+        try:
+            return decode_articles(generate(prompt, min(MAX_OUTPUT_TOKENS, tokens_per_article * len(batch))))
+        except Exception as e:
+            logging.error(f"Article batch failed: {e}")
+            return []
+
+    pending = list(topics)
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt:
+            stats['retried'] += len(pending)
+        batches = [pending[i:i + per_call] for i in range(0, len(pending), per_call)]
+        stats['calls'] += len(batches)
+        stats['prompt_tokens'] += sum(count_tokens(build_batch_prompt(batch, instructions)) for batch in batches)
+        if pool is not None:
+            results = list(pool.map(run_batch, batches))
+        else:
+            results = [run_batch(batch) for batch in batches]
+
+        for batch, batch_articles in zip(batches, results):
+            for position, article in enumerate(batch_articles):
+                topic = _match_topic(article, position, batch)
+                if topic is None or topic in articles:
+                    continue
+                error = validate_article(article, min_words, allowed_tags)
+                if error:
+                    errors[topic] = error
+                    continue
+                errors.pop(topic, None)
+                articles[topic] = {'title': article['title'].strip(), 'content': article['content'].strip()}
+        pending = [topic for topic in topics if topic not in articles]
+        for topic in pending:
+            errors.setdefault(topic, 'javobda yo\'q')
+        if on_progress:
+            on_progress({'generated': len(articles), 'failed': len(pending), 'attempt': attempt + 1})
+
+    for topic in pending:
+        logging.warning(f"Article for '{topic}' rejected: {errors.get(topic)}")
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    stats['failed'] = {topic: errors.get(topic) for topic in pending}
+    return articles, stats
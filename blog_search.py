@@ -0,0 +1,377 @@
+"""
+SmartBot.uz - Blog qidiruv indeksi
+
+In-memory inverted index over blog posts with BM25 ranking, plus
+precomputed related-post neighbours for the detail page.
+Uzbek text is normalized so that Latin and Cyrillic spellings
+(and the various o'/g' apostrophes) match each other.
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import hashlib
+import logging
+import threading
+from html import unescape
+from typing import List, Dict, Any, Iterable, Optional, Callable
+
+from json_store import locked
+
+# Uzbek Cyrillic -> Latin transliteration
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': 'o', 'қ': 'q',
+    'ғ': 'g', 'ҳ': 'h'
+}
+TRANSLIT_TABLE = str.maketrans(CYRILLIC_TO_LATIN)
+
+# o', g' and friends are written with many different apostrophes; drop them all
+APOSTROPHES = "'`ʻʼ‘’ʹ′"
+APOSTROPHE_TABLE = str.maketrans('', '', APOSTROPHES)
+
+TAG_RE = re.compile(r'<[^>]+>')
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Field weights: a match in the title counts more than one in the content
+FIELD_WEIGHTS = {'title': 3, 'excerpt': 2, 'content': 1}
+
+def strip_html(text: str) -> str:
+    """Remove HTML tags and entities"""
+    return unescape(TAG_RE.sub(' ', text or ''))
+
+def normalize_text(text: str) -> str:
+    """Lowercase, transliterate Cyrillic to Latin and drop apostrophes"""
+    return (text or '').lower().translate(TRANSLIT_TABLE).translate(APOSTROPHE_TABLE)
+
+def tokenize(text: str) -> List[str]:
+    """Split normalized text into search tokens"""
+    return TOKEN_RE.findall(normalize_text(text))
+
+def post_fingerprint(post: Dict[str, Any]) -> str:
+    """Hash of the indexed fields, used to skip unchanged posts"""
+    raw = '\x00'.join(str(post.get(field, '')) for field in FIELD_WEIGHTS)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+class BlogSearchIndex:
+    """Inverted index with incremental upsert/remove and BM25 scoring"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[Any, int]] = {}
+        self.doc_lengths: Dict[Any, int] = {}
+        self.doc_terms: Dict[Any, List[str]] = {}
+        self.fingerprints: Dict[Any, str] = {}
+        self.documents: Dict[Any, Dict[str, Any]] = {}
+        self.total_length = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def _term_frequencies(self, post: Dict[str, Any]) -> Dict[str, int]:
+        frequencies: Dict[str, int] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            text = post.get(field, '')
+            if field == 'content':
+                text = strip_html(text)
+            for token in tokenize(text):
+                frequencies[token] = frequencies.get(token, 0) + weight
+        return frequencies
+
+    def upsert(self, post: Dict[str, Any]) -> bool:
+        """Add or replace one post; returns False if it was already up to date"""
+        doc_id = post.get('id')
+        if doc_id is None:
+            return False
+
+        fingerprint = post_fingerprint(post)
+        with self.lock:
+            if self.fingerprints.get(doc_id) == fingerprint:
+                self.documents[doc_id] = self._summary(post)
+                return False
+            self.remove(doc_id)
+
+            frequencies = self._term_frequencies(post)
+            for term, tf in frequencies.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            length = sum(frequencies.values())
+            self.doc_lengths[doc_id] = length
+            self.doc_terms[doc_id] = list(frequencies)
+            self.fingerprints[doc_id] = fingerprint
+            self.documents[doc_id] = self._summary(post)
+            self.total_length += length
+            return True
+
+    def remove(self, doc_id) -> None:
+        """Remove a post from the index if present"""
+        with self.lock:
+            if doc_id not in self.doc_lengths:
+                return
+            for term in self.doc_terms.pop(doc_id, []):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(doc_id)
+            self.fingerprints.pop(doc_id, None)
+            self.documents.pop(doc_id, None)
+
+    def sync(self, posts: Iterable[Dict[str, Any]]) -> int:
+        """Bring the index in line with the full post list; returns number of changes"""
+        changes = 0
+        with self.lock:
+            seen = set()
+            for post in posts:
+                if post.get('id') is None:
+                    continue
+                seen.add(post['id'])
+                if self.upsert(post):
+                    changes += 1
+            for doc_id in [d for d in self.doc_lengths if d not in seen]:
+                self.remove(doc_id)
+                changes += 1
+        return changes
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return the best matching posts for query, highest BM25 score first"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self.lock:
+            doc_count = len(self.doc_lengths)
+            if not doc_count:
+                return []
+            avg_length = self.total_length / doc_count
+
+            scores: Dict[Any, float] = {}
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [dict(self.documents[doc_id], score=round(score, 4)) for doc_id, score in best]
+
+    @staticmethod
+    def _summary(post: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': post.get('id'),
+            'title': post.get('title', ''),
+            'slug': post.get('slug') or str(post.get('id')),
+            'excerpt': post.get('excerpt', ''),
+            'category': post.get('category', ''),
+            'date': post.get('date', '')
+        }
+
+class RelatedPostsIndex:
+    """Precomputed top-k TF-IDF neighbours per post, persisted to a JSON file
+
+    Neighbours are computed when posts are added (not per request), so a
+    detail page only needs a dictionary lookup. The file also keeps the
+    document frequencies and every post's vector: adding or editing one
+    post computes only its own vector and updates the neighbour lists it
+    enters or leaves. Vectors keep the IDF weights of the time they were
+    made; a full rebuild refreshes them for the whole archive. Writers
+    (web workers, daily_job.py) hold locked(path) for each update.
+    """
+
+    def __init__(self, path: str, k: int = 4, load_posts: Optional[Callable[[], List[Dict[str, Any]]]] = None):
+        self.path = path
+        self.k = k
+        # Full post list, needed only to build the table the first time
+        self.load_posts = load_posts
+        self.related: Dict[str, List[List[Any]]] = {}
+        # str(id) -> {'id', 'fingerprint', 'vector'}; None until a file with vectors is loaded
+        self.docs: Optional[Dict[str, Dict[str, Any]]] = None
+        self.df: Dict[str, int] = {}
+        self.mtime = None
+        self.lock = threading.RLock()
+
+    # Storage
+
+    def load(self) -> None:
+        """Reload neighbour table if the file changed on disk"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            with self.lock:
+                self.related, self.docs, self.df, self.mtime = {}, None, {}, None
+            return
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.related = data.get('related', {})
+                # Files written before vectors were stored have neither key
+                self.docs = data.get('docs')
+                self.df = data.get('df', {})
+                self.mtime = mtime
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to load related posts: {e}")
+
+    def save(self) -> bool:
+        with self.lock:
+            temp_file = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump({'k': self.k, 'related': self.related, 'docs': self.docs, 'df': self.df}, f)
+                os.replace(temp_file, self.path)
+                self.mtime = os.stat(self.path).st_mtime_ns
+                return True
+            except OSError as e:
+                logging.error(f"Failed to save related posts: {e}")
+                return False
+
+    # Similarity
+
+    @staticmethod
+    def _term_counts(post: Dict[str, Any]) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            text = post.get(field, '')
+            if field == 'content':
+                text = strip_html(text)
+            for token in tokenize(text):
+                if len(token) > 2:
+                    counts[token] = counts.get(token, 0) + weight
+        return counts
+
+    def _vector(self, counts: Dict[str, int]) -> Dict[str, float]:
+        """L2-normalized TF-IDF vector against the current document frequencies"""
+        total = len(self.docs)
+        vector = {t: (1 + math.log(c)) * (math.log((1 + total) / (1 + self.df[t])) + 1) for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        # Every term is kept (even if rounded to 0): the keys are what _forget subtracts
+        return {t: round(w / norm, 6) for t, w in vector.items()}
+
+    def _similarities(self, key: str) -> Dict[str, float]:
+        vector = self.docs[key]['vector']
+        scores: Dict[str, float] = {}
+        for other_key, other in self.docs.items():
+            if other_key == key:
+                continue
+            other_vector = other['vector']
+            small, large = (vector, other_vector) if len(vector) <= len(other_vector) else (other_vector, vector)
+            score = sum(w * large[t] for t, w in small.items() if t in large)
+            if score > 0:
+                scores[other_key] = score
+        return scores
+
+    def _top_k(self, scores: Dict[str, float]) -> List[List[Any]]:
+        best = heapq.nlargest(self.k, scores.items(), key=lambda item: item[1])
+        return [[self.docs[key]['id'], round(score, 4)] for key, score in best if score > 0]
+
+    def _insert(self, post: Dict[str, Any]) -> str:
+        key = str(post['id'])
+        counts = self._term_counts(post)
+        for term in counts:
+            self.df[term] = self.df.get(term, 0) + 1
+        self.docs[key] = {'id': post['id'], 'fingerprint': post_fingerprint(post), 'vector': {}}
+        self.docs[key]['vector'] = self._vector(counts)
+        return key
+
+    def _forget(self, key: str) -> None:
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for term in doc['vector']:
+            if self.df.get(term, 0) > 1:
+                self.df[term] -= 1
+            else:
+                self.df.pop(term, None)
+
+    def _pointing_at(self, key: str) -> List[str]:
+        return [other_key for other_key, neighbours in self.related.items()
+                if other_key != key and any(str(n[0]) == key for n in neighbours)]
+
+    def _rebuild(self, posts: List[Dict[str, Any]]) -> None:
+        self.docs, self.df = {}, {}
+        posts = [p for p in posts if p.get('id') is not None]
+        # Document frequencies first, so every vector gets the final IDF weights
+        counts = {str(p['id']): self._term_counts(p) for p in posts}
+        for terms in counts.values():
+            for term in terms:
+                self.df[term] = self.df.get(term, 0) + 1
+        for post in posts:
+            key = str(post['id'])
+            self.docs[key] = {'id': post['id'], 'fingerprint': post_fingerprint(post), 'vector': {}}
+        for key, terms in counts.items():
+            self.docs[key]['vector'] = self._vector(terms)
+        self.related = {key: self._top_k(self._similarities(key)) for key in self.docs}
+        self.save()
+
+    def rebuild(self, posts: List[Dict[str, Any]]) -> None:
+        """Recompute vectors and the neighbour table for the whole archive"""
+        with locked(self.path), self.lock:
+            self._rebuild(posts)
+
+    def add(self, post: Dict[str, Any]) -> None:
+        """Insert a new post or refresh an edited one"""
+        if post.get('id') is None:
+            return
+        with locked(self.path), self.lock:
+            self.load()
+            if self.docs is None:
+                self._rebuild(self.load_posts() if self.load_posts else [post])
+                return
+            key = str(post['id'])
+            edited = key in self.docs
+            if edited and self.docs[key]['fingerprint'] == post_fingerprint(post):
+                return
+            self._forget(key)
+            self._insert(post)
+            scores = self._similarities(key)
+            self.related[key] = self._top_k(scores)
+
+            # Lists holding the post's old score are recomputed: it may have dropped out
+            stale = set(self._pointing_at(key)) if edited else set()
+            for other_key in stale:
+                self.related[other_key] = self._top_k(self._similarities(other_key))
+
+            # Similarity is symmetric: offer the post to the other neighbours' lists
+            for other_key, score in scores.items():
+                if other_key in stale:
+                    continue
+                neighbours = self.related.get(other_key, [])
+                if len(neighbours) < self.k or score > neighbours[-1][1]:
+                    neighbours = neighbours + [[post['id'], round(score, 4)]]
+                    neighbours.sort(key=lambda n: n[1], reverse=True)
+                self.related[other_key] = neighbours[:self.k]
+            self.save()
+
+    def remove(self, doc_id) -> None:
+        """Drop a post and recompute the lists that pointed at it"""
+        with locked(self.path), self.lock:
+            self.load()
+            if self.docs is None:
+                if self.load_posts:
+                    self._rebuild([p for p in self.load_posts() if p.get('id') != doc_id])
+                return
+            key = str(doc_id)
+            self.related.pop(key, None)
+            self._forget(key)
+            for other_key in self._pointing_at(key):
+                self.related[other_key] = (self._top_k(self._similarities(other_key))
+                                           if other_key in self.docs else [])
+            self.save()
+
+    def neighbours(self, doc_id) -> List[Any]:
+        """Ids of the precomputed related posts, best first"""
+        self.load()
+        return [n[0] for n in self.related.get(str(doc_id), [])]
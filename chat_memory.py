@@ -0,0 +1,126 @@
+"""
+SmartBot.uz - Chat suhbati xotirasi
+
+Per-session conversation state for the website chatbot. Recent turns are
+kept verbatim within a token budget; older turns are folded into a short
+running summary, so prompts stay bounded however long the chat gets.
+Sessions are evicted least-recently-used. With a db_path the state lives
+in SQLite and is shared by all gunicorn workers.
+"""
+
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+from prompt_budget import count_tokens
+
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+def first_sentence(text: str, limit: int = 160) -> str:
+    text = ' '.join((text or '').split())
+    sentence = SENTENCE_RE.split(text, 1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit].rsplit(' ', 1)[0] + '...'
+
+class ChatMemoryStore:
+    """LRU store of {summary, turns} per chat session with a rolling token budget"""
+
+    def __init__(self, max_sessions: int = 2000, turn_budget: int = 600, summary_budget: int = 200,
+                 idle_ttl: int = 24 * 3600, db_path: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.turn_budget = turn_budget
+        self.summary_budget = summary_budget
+        self.idle_ttl = idle_ttl
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS chat_sessions ('
+                'id TEXT PRIMARY KEY, summary TEXT, turns TEXT, updated REAL)'
+            )
+            self.db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Chat memory database unavailable: {e}")
+            self.db = None
+
+    def _load(self, session_id: str) -> Dict[str, Any]:
+        now = time.time()
+        if self.db is not None:
+            try:
+                row = self.db.execute(
+                    'SELECT summary, turns FROM chat_sessions WHERE id = ? AND updated > ?',
+                    (session_id, now - self.idle_ttl)
+                ).fetchone()
+                if row:
+                    return {'summary': row[0] or '', 'turns': json.loads(row[1] or '[]')}
+            except (sqlite3.Error, ValueError) as e:
+                logging.error(f"Chat memory read error: {e}")
+            return {'summary': '', 'turns': []}
+
+        state = self.sessions.get(session_id)
+        if state and state['updated'] > now - self.idle_ttl:
+            self.sessions.move_to_end(session_id)
+            return {'summary': state['summary'], 'turns': list(state['turns'])}
+        return {'summary': '', 'turns': []}
+
+    def _save(self, session_id: str, state: Dict[str, Any]) -> None:
+        now = time.time()
+        if self.db is not None:
+            try:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO chat_sessions (id, summary, turns, updated) VALUES (?, ?, ?, ?)',
+                    (session_id, state['summary'], json.dumps(state['turns'], ensure_ascii=False), now)
+                )
+                self.db.execute(
+                    'DELETE FROM chat_sessions WHERE updated < ? OR id NOT IN '
+                    '(SELECT id FROM chat_sessions ORDER BY updated DESC LIMIT ?)',
+                    (now - self.idle_ttl, self.max_sessions)
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Chat memory write error: {e}")
+            return
+
+        self.sessions[session_id] = {'summary': state['summary'], 'turns': state['turns'], 'updated': now}
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def context(self, session_id: str) -> Tuple[str, List[Dict[str, str]]]:
+        """(running summary, recent turns) to put into the next prompt"""
+        with self.lock:
+            state = self._load(session_id)
+        return state['summary'], state['turns']
+
+    def append(self, session_id: str, user_message: str, answer: str) -> None:
+        """Record a finished exchange and compress what no longer fits the budget"""
+        with self.lock:
+            state = self._load(session_id)
+            # A single oversized turn may take at most half of the budget each way
+            limit = self.turn_budget * 2
+            state['turns'].append({'user': user_message[:limit], 'assistant': answer[:limit]})
+
+            # Oldest turns beyond the budget become one summary line each
+            while len(state['turns']) > 1 and sum(
+                    count_tokens(t['user']) + count_tokens(t['assistant']) for t in state['turns']
+            ) > self.turn_budget:
+                turn = state['turns'].pop(0)
+                line = f"Mijoz: {first_sentence(turn['user'])} / Javob: {first_sentence(turn['assistant'])}"
+                state['summary'] = f"{state['summary']}\n{line}".strip()
+
+            lines = state['summary'].split('\n') if state['summary'] else []
+            while len(lines) > 1 and count_tokens('\n'.join(lines)) > self.summary_budget:
+                lines.pop(0)
+            state['summary'] = '\n'.join(lines)
+            self._save(session_id, state)
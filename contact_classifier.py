@@ -0,0 +1,234 @@
+"""
+SmartBot.uz - Murojaatlarni xizmat bo'yicha tasniflash
+
+Local fast path for routing contact messages to one of the five service
+labels: keyword rules first, then multinomial naive Bayes over character
+n-grams trained on seed examples and on stored messages that Gemini has
+already labelled. Callers fall back to Gemini when confidence is low.
+"""
+
+import math
+import time
+import random
+import threading
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+from blog_search import TOKEN_RE, normalize_text
+
+LABELS = ('telegram_bot', 'chatbot', 'automation', 'web_development', 'ai_integration')
+
+# Word stems (normalized Latin) that on their own point at one service
+KEYWORD_RULES = {
+    'telegram_bot': ('telegram', 'telegramm', 'tg'),
+    'chatbot': ('chatbot', 'chat bot', 'chat-bot', 'operator', 'onlayn yordamchi', 'savol-javob'),
+    'automation': ('avtomat', 'automat', 'crm', 'excel', 'hisobot', 'jarayon', '1c', 'buxgalter'),
+    'web_development': ('sayt', 'site', 'website', 'landing', 'internet magazin', 'internet-magazin', 'domen'),
+    'ai_integration': ('suniy intellekt', 'intellekt', 'gpt', 'neyron', 'neural', 'machine learning',
+                       'computer vision', 'tanib olish')
+}
+
+# Bootstrap examples so the model is usable before any message was labelled
+SEED_EXAMPLES = [
+    ('Telegram bot kerak, buyurtmalarni qabul qilsin', 'telegram_bot'),
+    ("Do'konim uchun telegram orqali savdo qiladigan bot yasab bering", 'telegram_bot'),
+    ('Kanalimga post joylaydigan va obunachilarni hisoblaydigan bot', 'telegram_bot'),
+    ('Нужен телеграм бот для записи клиентов', 'telegram_bot'),
+    ('Телеграм бот для доставки еды', 'telegram_bot'),
+    ('I need a Telegram bot for my shop orders', 'telegram_bot'),
+    ("Saytimga mijozlar savollariga javob beradigan chatbot qo'shmoqchiman", 'chatbot'),
+    ("Instagram va saytda 24/7 javob beradigan chat bot kerak", 'chatbot'),
+    ('Operator o\'rniga mijozlar bilan yozishadigan aqlli yordamchi', 'chatbot'),
+    ('Чат-бот для сайта, чтобы отвечал на вопросы клиентов', 'chatbot'),
+    ('Chatbot for customer support on our website and Instagram', 'chatbot'),
+    ('Mijozlar murojaatlariga avtomatik javob qaytaradigan chatbot', 'chatbot'),
+    ('Buxgalteriya va ombor hisobini avtomatlashtirish kerak', 'automation'),
+    ('Excel hisobotlarni avtomatik tayyorlash tizimi', 'automation'),
+    ("CRM tizimi va buyurtmalar jarayonini avtomatlashtirmoqchimiz", 'automation'),
+    ('Автоматизация бизнес процессов и интеграция с 1С', 'automation'),
+    ('Automate our invoicing and reporting workflow', 'automation'),
+    ("Xodimlar ish vaqtini hisoblash jarayonini avtomatlashtirish", 'automation'),
+    ('Kompaniyamiz uchun zamonaviy web sayt yaratib bering', 'web_development'),
+    ("Internet magazin sayt kerak, to'lov tizimi bilan", 'web_development'),
+    ('Landing sahifa va domen sozlash', 'web_development'),
+    ('Нужен сайт-визитка для компании', 'web_development'),
+    ('Build a website with online payments for our store', 'web_development'),
+    ("Restoran uchun menyu va bron qilish sahifasi bo'lgan sayt", 'web_development'),
+    ("Sun'iy intellekt yordamida sotuvlarni bashorat qilish", 'ai_integration'),
+    ('GPT modelini biznesimizga integratsiya qilish', 'ai_integration'),
+    ('Rasmlardan mahsulotlarni tanib olish uchun AI kerak', 'ai_integration'),
+    ('Внедрение искусственного интеллекта и нейросетей в компанию', 'ai_integration'),
+    ('Integrate machine learning models into our analytics', 'ai_integration'),
+    ("Hujjatlarni sun'iy intellekt bilan tahlil qiladigan tizim", 'ai_integration')
+]
+
+class ContactClassifier:
+    """Keyword rules + character n-gram naive Bayes with agreement/latency stats"""
+
+    def __init__(self, threshold: float = 0.7, ngram_range: Tuple[int, int] = (3, 5),
+                 alpha: float = 0.5, sharpness: float = 4.0):
+        self.threshold = threshold
+        self.ngram_range = ngram_range
+        self.alpha = alpha
+        # Naive Bayes is wildly overconfident on many correlated n-grams; the
+        # per-feature average log-likelihood times this factor is softmaxed instead
+        self.sharpness = sharpness
+        self.lock = threading.Lock()
+        self._reset()
+        self.stats_data = {
+            'local': 0, 'rules': 0, 'fallback': 0, 'fallback_agreed': 0,
+            'audited': 0, 'audit_agreed': 0, 'local_seconds': 0.0, 'llm_seconds': 0.0
+        }
+
+    def _reset(self) -> None:
+        self.feature_counts: Dict[str, Dict[str, int]] = {label: {} for label in LABELS}
+        self.feature_totals: Dict[str, int] = {label: 0 for label in LABELS}
+        self.doc_counts: Dict[str, int] = {label: 0 for label in LABELS}
+        self.vocabulary: set = set()
+
+    def features(self, text: str) -> List[str]:
+        tokens = TOKEN_RE.findall(normalize_text(text))
+        features = []
+        low, high = self.ngram_range
+        for token in tokens:
+            features.append('w:' + token)
+            padded = f' {token} '
+            for n in range(low, high + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def train(self, examples: Iterable[Tuple[str, str]]) -> None:
+        """Rebuild the model from (text, label) pairs"""
+        with self.lock:
+            self._reset()
+            for text, label in examples:
+                self._learn(text, label)
+
+    def learn(self, text: str, label: str) -> None:
+        """Add one labelled example (e.g. a Gemini answer) to the model"""
+        with self.lock:
+            self._learn(text, label)
+
+    def _learn(self, text: str, label: str) -> None:
+        if label not in self.feature_counts:
+            return
+        counts = self.feature_counts[label]
+        for feature in self.features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+            self.feature_totals[label] += 1
+            self.vocabulary.add(feature)
+        self.doc_counts[label] += 1
+
+    def rule_label(self, text: str) -> Optional[str]:
+        """The only label whose keywords occur in the text, if exactly one does"""
+        normalized = normalize_text(text)
+        tokens = TOKEN_RE.findall(normalized)
+        matched = set()
+        for label, stems in KEYWORD_RULES.items():
+            for stem in stems:
+                hit = stem in normalized if ' ' in stem or '-' in stem else \
+                    any(token.startswith(stem) if len(stem) > 3 else token == stem for token in tokens)
+                if hit:
+                    matched.add(label)
+                    break
+        return matched.pop() if len(matched) == 1 else None
+
+    def scores(self, text: str) -> Tuple[Dict[str, float], float]:
+        """Posterior-like probability per label and the share of n-grams seen in training"""
+        with self.lock:
+            features = self.features(text)
+            known = [f for f in features if f in self.vocabulary]
+            total_docs = sum(self.doc_counts.values())
+            if not known or not total_docs:
+                return {}, 0.0
+            vocabulary_size = len(self.vocabulary)
+            logits = {}
+            for label in LABELS:
+                counts = self.feature_counts[label]
+                denominator = self.feature_totals[label] + self.alpha * vocabulary_size
+                log_likelihood = sum(math.log((counts.get(f, 0) + self.alpha) / denominator) for f in known)
+                prior = math.log((self.doc_counts[label] + 1) / (total_docs + len(LABELS)))
+                logits[label] = prior + self.sharpness * log_likelihood / len(known)
+        top = max(logits.values())
+        exps = {label: math.exp(logit - top) for label, logit in logits.items()}
+        norm = sum(exps.values())
+        return {label: value / norm for label, value in exps.items()}, len(known) / len(features)
+
+    def predict(self, text: str) -> Tuple[Optional[str], float, str]:
+        """(best label, confidence, source); compare confidence with self.threshold"""
+        label = self.rule_label(text)
+        if label:
+            return label, 1.0, 'rules'
+        scores, known_share = self.scores(text)
+        if not scores:
+            return None, 0.0, 'model'
+        label = max(scores, key=scores.get)
+        # Mostly unseen text (typos, gibberish, new topics) is left to Gemini
+        return label, scores[label] * known_share, 'model'
+
+    def record_local(self, source: str, seconds: float) -> None:
+        with self.lock:
+            self.stats_data['local'] += 1
+            self.stats_data['rules'] += source == 'rules'
+            self.stats_data['local_seconds'] += seconds
+
+    def record_llm(self, local_label: Optional[str], llm_label: str, seconds: float, audit: bool) -> None:
+        """Count a Gemini answer and whether the local guess agreed with it"""
+        with self.lock:
+            prefix = 'audit' if audit else 'fallback'
+            self.stats_data['audited' if audit else 'fallback'] += 1
+            self.stats_data[f'{prefix}_agreed'] += local_label == llm_label
+            self.stats_data['llm_seconds'] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        """Routing share, agreement with Gemini and mean latency (this worker only)"""
+        with self.lock:
+            data = dict(self.stats_data)
+            examples = sum(self.doc_counts.values())
+        answered = data['local'] + data['fallback']
+        llm_calls = data['fallback'] + data['audited']
+        return {
+            'examples': examples,
+            'threshold': self.threshold,
+            'local': data['local'],
+            'rules': data['rules'],
+            'fallback': data['fallback'],
+            'local_share': round(data['local'] / answered, 4) if answered else 0.0,
+            'audited': data['audited'],
+            # Agreement on audited confident answers estimates local accuracy;
+            # agreement on fallbacks shows how often the threshold was too cautious
+            'audit_agreement': round(data['audit_agreed'] / data['audited'], 4) if data['audited'] else None,
+            'fallback_agreement': round(data['fallback_agreed'] / data['fallback'], 4) if data['fallback'] else None,
+            'local_latency_us': round(data['local_seconds'] / data['local'] * 1e6, 1) if data['local'] else None,
+            'llm_latency_ms': round(data['llm_seconds'] / llm_calls * 1e3, 1) if llm_calls else None
+        }
+
+def cross_validate(examples: List[Tuple[str, str]], folds: int = 5, threshold: float = 0.7,
+                   seed: int = 0) -> Dict[str, Any]:
+    """k-fold accuracy, coverage above the threshold and per-message latency"""
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+    correct = covered = covered_correct = 0
+    latencies = []
+    for fold in range(folds):
+        test = shuffled[fold::folds]
+        train = [example for i, example in enumerate(shuffled) if i % folds != fold]
+        classifier = ContactClassifier(threshold=threshold)
+        classifier.train(train)
+        for text, label in test:
+            started = time.perf_counter()
+            predicted, confidence, _ = classifier.predict(text)
+            latencies.append(time.perf_counter() - started)
+            correct += predicted == label
+            if confidence >= threshold:
+                covered += 1
+                covered_correct += predicted == label
+    latencies.sort()
+    total = len(shuffled)
+    return {
+        'examples': total,
+        'accuracy': round(correct / total, 4) if total else None,
+        'coverage': round(covered / total, 4) if total else None,
+        'accuracy_when_confident': round(covered_correct / covered, 4) if covered else None,
+        'p50_latency_us': round(latencies[len(latencies) // 2] * 1e6, 1) if latencies else None,
+        'p99_latency_us': round(latencies[int(len(latencies) * 0.99)] * 1e6, 1) if latencies else None
+    }
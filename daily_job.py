@@ -18,17 +18,18 @@ import time
 import schedule
 import threading
 import logging
-import requests
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
 import random
 import re
 
-# Try importing AI library
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+from ai_metrics import AIMetrics, error_outcome
+from ai_provider import provider_from_env
+from article_batch import ARTICLE_SCHEMA, generate_articles
+from blog_search import RelatedPostsIndex
+from resilience import Deadline, get_breaker, call_with_retry
+from telegram_outbox import TelegramOutbox, bot_api_sender
+from json_store import locked, write_json, update_record
 
 # Configure logging
 logging.basicConfig(
@@ -52,10 +53,33 @@ class AIMarketingAvtomat:
         self.data_dir = "data"
         self.blog_posts_file = os.path.join(self.data_dir, "blog.json")
         self.marketing_stats_file = os.path.join(self.data_dir, "marketing_stats.json")
+        self.blog_related_file = os.path.join(self.data_dir, "blog_related.json")
+        self.messages_file = os.path.join(self.data_dir, "messages.json")
+        
+        # Breakers are shared with the web app, so an outage seen there is respected here too
+        self.resilience_db = os.path.join(self.data_dir, "resilience.sqlite3")
+        self.call_deadline = 180
+        
+        # Daily posts are requested several per call as a JSON array
+        self.batch_generation = os.environ.get("MARKETING_BATCH", "1") == "1"
+        self.tokens_per_post = 1600
         
         # Create data directory if not exists
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
+        
+        # Usage is recorded next to the web app's calls under the 'marketing' feature
+        self.ai_metrics = AIMetrics(os.path.join(self.data_dir, "ai_metrics.sqlite3"))
+        self.usage = {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'seconds': 0.0}
+        
+        self.gemini_breaker = get_breaker('gemini', failure_threshold=5, reset_timeout=30,
+                                          db_path=self.resilience_db)
+        self.telegram_breaker = get_breaker('telegram', failure_threshold=5, reset_timeout=60,
+                                            db_path=self.resilience_db)
+        
+        # Same outbox as the web app: posts queued here are delivered (and
+        # retried) by whichever process gets to them first
+        self.telegram_outbox = TelegramOutbox(os.path.join(self.data_dir, "telegram_outbox.sqlite3"))
             
         # Optimal posting times (when subscribers are most active)
         self.posting_times = [
@@ -67,19 +91,10 @@ class AIMarketingAvtomat:
         ]
         
     def setup_ai(self):
-        """Setup AI configuration"""
-        self.gemini_api_key = os.environ.get("GEMINI_API_KEY")
-        if self.gemini_api_key and genai:
-            try:
-                genai.configure(api_key=self.gemini_api_key)
-                self.ai_model = genai.GenerativeModel('gemini-1.5-flash')
-                logging.info("AI model initialized successfully")
-            except Exception as e:
-                logging.error(f"AI initialization failed: {e}")
-                self.ai_model = None
-        else:
-            logging.warning("GEMINI_API_KEY not found or genai not available")
-            self.ai_model = None
+        """Setup AI configuration (AI_PROVIDER=gemini or fake, see ai_provider.py)"""
+        self.ai_provider = provider_from_env()
+        if self.ai_provider:
+            logging.info(f"AI provider initialized: {self.ai_provider.name} ({self.ai_provider.model_name})")
             
     def setup_telegram(self):
         """Setup Telegram configuration"""
@@ -88,6 +103,8 @@ class AIMarketingAvtomat:
         
         if not self.telegram_bot_token or not self.telegram_channel_id:
             logging.warning("Telegram credentials not configured properly")
+        self.telegram_send = (bot_api_sender(self.telegram_bot_token, self.telegram_breaker, self.call_deadline)
+                              if self.telegram_bot_token else None)
             
     def get_current_trends(self) -> List[str]:
         """Get current trends in IT, AI, Telegram bots, automation"""
@@ -119,9 +136,66 @@ class AIMarketingAvtomat:
         logging.info(f"Selected trends for today: {selected_trends}")
         return selected_trends
         
+    POST_INSTRUCTIONS = """
+            - 600-700 so'z 
+            - 5-6 paragraf
+            - Jozibador va SEO-optimallashtirilgan sarlavha
+            - Kalit so'zlar: AI, bot, avtomatlashtirish, SmartBot.uz
+            - Paragraflar qisqa va tushunarli
+            - Professional uslubda
+            - Oxirida majburiy: "SmartBot.uz — aqlli yechimlar, zamonaviy biznes uchun"
+            
+            Maqolani HTML formatida qaytaring, faqat <h2>, <p>, <ul>, <li> teglaridan foydalaning.
+            """
+    
+    def generate_text(self, prompt: str, max_tokens: int = None, json_schema: Dict[str, Any] = None) -> str:
+        """One AI call with retries and the shared breaker, recorded in ai_metrics"""
+        started = time.monotonic()
+        try:
+            result = call_with_retry(
+                lambda timeout: self.ai_provider.generate(prompt, max_tokens, json_schema=json_schema,
+                                                          timeout=timeout),
+                self.gemini_breaker, Deadline(self.call_deadline), timeout=60
+            )
+        except Exception as e:
+            self.ai_metrics.record('marketing', time.monotonic() - started, outcome=error_outcome(e),
+                                   model=self.ai_provider.model_name)
+            raise
+        seconds = time.monotonic() - started
+        self.ai_metrics.record('marketing', seconds, result.prompt_tokens, result.output_tokens,
+                               model=self.ai_provider.model_name)
+        self.usage['calls'] += 1
+        self.usage['prompt_tokens'] += result.prompt_tokens
+        self.usage['output_tokens'] += result.output_tokens
+        self.usage['seconds'] += seconds
+        return result.text
+    
+    def create_blog_posts(self, trends: List[str]) -> List[Dict[str, Any]]:
+        """Create posts for all trends in as few AI calls as possible
+
+        Invalid or missing articles are requested again on their own;
+        with MARKETING_BATCH=0 every trend gets a separate call instead.
+        """
+        if not self.ai_provider:
+            logging.error("AI model not available for blog creation")
+            return []
+        
+        if not self.batch_generation:
+            return [post for post in (self.create_blog_post(trend) for trend in trends) if post]
+        
+        articles, stats = generate_articles(
+            lambda prompt, max_tokens: self.generate_text(prompt, max_tokens, ARTICLE_SCHEMA),
+            trends, self.POST_INSTRUCTIONS, self.tokens_per_post, allowed_tags=('h2', 'p', 'ul', 'li')
+        )
+        logging.info(f"Batch generation: {stats}")
+        
+        base_id = int(datetime.now().timestamp())
+        return [self.build_blog_post(trend, articles[trend]['title'], articles[trend]['content'], base_id + i)
+                for i, trend in enumerate(trends) if trend in articles]
+    
     def create_blog_post(self, trend: str) -> Dict[str, Any]:
         """Create SEO optimized blog post for a trend"""
-        if not self.ai_model:
+        if not self.ai_provider:
             logging.error("AI model not available for blog creation")
             return None
             
@@ -130,19 +204,10 @@ class AIMarketingAvtomat:
             "{trend}" mavzusida o'zbek tilida professional SEO blog maqolasi yozing.
 
             Talablar:
-            - 600-700 so'z 
-            - 5-6 paragraf
-            - Jozibador va SEO-optimallashtirilgan sarlavha
-            - Kalit so'zlar: AI, bot, avtomatlashtirish, SmartBot.uz
-            - Paragraflar qisqa va tushunarli
-            - Professional uslubda
-            - Oxirida majburiy: "SmartBot.uz — aqlli yechimlar, zamonaviy biznes uchun"
-            
-            Maqolani HTML formatida qaytaring, faqat <h2>, <p>, <ul>, <li> teglaridan foydalaning.
+            {self.POST_INSTRUCTIONS.strip()}
             """
             
-            response = self.ai_model.generate_content(prompt)
-            content = response.text
+            content = self.generate_text(prompt)
             
             # Extract title from content (first h2 tag or first line)
             title_match = re.search(r'<h2>(.*?)</h2>', content)
@@ -154,35 +219,35 @@ class AIMarketingAvtomat:
                 title = lines[0].strip()
                 if title.startswith('#'):
                     title = title.strip('# ')
-                    
-            # Create excerpt (first 200 characters without HTML tags)
-            clean_content = re.sub(r'<[^>]+>', '', content)
-            excerpt = clean_content[:200] + "..." if len(clean_content) > 200 else clean_content
-            
-            # Create slug from title
-            slug = self.create_slug(title)
-            
-            blog_post = {
-                "id": int(datetime.now().timestamp()),
-                "title": title,
-                "content": content,
-                "excerpt": excerpt,
-                "slug": slug,
-                "date": datetime.now().strftime("%Y-%m-%d"),
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "trend": trend,
-                "category": "AI Generated",
-                "ai_generated": True,
-                "posted_to_telegram": False,
-                "telegram_scheduled_time": None
-            }
             
+            blog_post = self.build_blog_post(trend, title, content)
             logging.info(f"Blog post created: {title}")
             return blog_post
             
         except Exception as e:
             logging.error(f"Error creating blog post for trend '{trend}': {e}")
             return None
+    
+    def build_blog_post(self, trend: str, title: str, content: str, post_id: int = None) -> Dict[str, Any]:
+        """Blog post record in the blog.json format"""
+        # Create excerpt (first 200 characters without HTML tags)
+        clean_content = re.sub(r'<[^>]+>', '', content)
+        excerpt = clean_content[:200] + "..." if len(clean_content) > 200 else clean_content
+        
+        return {
+            "id": post_id or int(datetime.now().timestamp()),
+            "title": title,
+            "content": content,
+            "excerpt": excerpt,
+            "slug": self.create_slug(title),
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "trend": trend,
+            "category": "AI Generated",
+            "ai_generated": True,
+            "posted_to_telegram": False,
+            "telegram_scheduled_time": None
+        }
             
     def create_slug(self, text: str) -> str:
         """Create URL-friendly slug from text"""
@@ -194,23 +259,29 @@ class AIMarketingAvtomat:
     def save_blog_posts(self, blog_posts: List[Dict[str, Any]]) -> bool:
         """Save blog posts to JSON file (existing blog.json format)"""
         try:
-            # Load existing posts
-            existing_posts = self.load_blog_posts()
-            
-            # Add new posts
-            all_posts = existing_posts + blog_posts
-            
-            # Save to file
-            with open(self.blog_posts_file, 'w', encoding='utf-8') as f:
-                json.dump(all_posts, f, ensure_ascii=False, indent=2)
+            # The web workers write blog.json too: hold the shared file lock
+            with locked(self.blog_posts_file):
+                existing_posts = self.load_blog_posts()
+                all_posts = existing_posts + blog_posts
+                write_json(self.blog_posts_file, all_posts)
                 
             logging.info(f"Saved {len(blog_posts)} new blog posts to {self.blog_posts_file}")
+            self.update_related_posts(blog_posts, all_posts)
             return True
             
         except Exception as e:
             logging.error(f"Error saving blog posts: {e}")
             return False
             
+    def update_related_posts(self, new_posts: List[Dict[str, Any]], all_posts: List[Dict[str, Any]]):
+        """Add new posts to the precomputed related-posts table"""
+        try:
+            related_index = RelatedPostsIndex(self.blog_related_file, load_posts=lambda: all_posts)
+            for post in new_posts:
+                related_index.add(post)
+        except Exception as e:
+            logging.error(f"Error updating related posts: {e}")
+            
     def load_blog_posts(self) -> List[Dict[str, Any]]:
         """Load existing blog posts"""
         try:
@@ -241,8 +312,8 @@ class AIMarketingAvtomat:
                 logging.info(f"Scheduled '{post['title']}' for {scheduled_time}")
                 
     def post_to_telegram(self, blog_post: Dict[str, Any]):
-        """Post blog to Telegram channel"""
-        if not self.telegram_bot_token or not self.telegram_channel_id:
+        """Post blog to Telegram channel through the outbox (once per post)"""
+        if not self.telegram_channel_id:
             logging.error("Telegram credentials not configured")
             return False
             
@@ -256,49 +327,34 @@ class AIMarketingAvtomat:
 
 #AI #IT #SmartBotUz #Bot #Avtomatlashtirish"""
 
-            # Send to Telegram
-            url = f"https://api.telegram.org/bot{self.telegram_bot_token}/sendMessage"
+            # Queue and deliver; a failed send stays in the outbox and is retried
             data = {
                 'chat_id': self.telegram_channel_id,
                 'text': message,
                 'parse_mode': 'HTML',
                 'disable_web_page_preview': False
             }
-            
-            response = requests.post(url, data=data, timeout=10)
-            
-            if response.status_code == 200:
-                # Mark as posted
-                blog_post['posted_to_telegram'] = True
-                blog_post['telegram_posted_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Update the saved posts
-                self.update_blog_post_status(blog_post)
-                
-                logging.info(f"Successfully posted '{blog_post['title']}' to Telegram")
-                return True
-            else:
-                logging.error(f"Telegram post failed: {response.text}")
-                return False
+            if not self.telegram_outbox.enqueue(f"blog:{blog_post['id']}:{blog_post['slug']}", 'sendMessage', data,
+                                                'blog', blog_post['id']):
+                logging.info(f"'{blog_post['title']}' is already in the Telegram outbox")
+            self.dispatch_outbox()
+            return True
                 
         except Exception as e:
             logging.error(f"Error posting to Telegram: {e}")
             return False
             
-    def update_blog_post_status(self, updated_post: Dict[str, Any]):
-        """Update blog post status in the file"""
-        try:
-            posts = self.load_blog_posts()
-            for i, post in enumerate(posts):
-                if post['id'] == updated_post['id']:
-                    posts[i] = updated_post
-                    break
-                    
-            with open(self.blog_posts_file, 'w', encoding='utf-8') as f:
-                json.dump(posts, f, ensure_ascii=False, indent=2)
-                
-        except Exception as e:
-            logging.error(f"Error updating post status: {e}")
+    def dispatch_outbox(self):
+        """Deliver due Telegram outbox entries and mark their posts/leads"""
+        if not self.telegram_send:
+            return
+        files = {'blog': self.blog_posts_file, 'lead': self.messages_file}
+        counts = self.telegram_outbox.dispatch(
+            self.telegram_send,
+            lambda kind, source_id, fields: update_record(files[kind], source_id, fields)
+        )
+        if any(counts.values()):
+            logging.info(f"Telegram outbox: {counts}")
             
     def update_marketing_stats(self, posts_created: int, posts_scheduled: int):
         """Update marketing statistics"""
@@ -308,7 +364,11 @@ class AIMarketingAvtomat:
                 "time": datetime.now().strftime("%H:%M:%S"), 
                 "posts_created": posts_created,
                 "posts_scheduled": posts_scheduled,
-                "ai_model_used": "gemini-1.5-flash",
+                "ai_model_used": self.ai_provider.model_name if self.ai_provider else None,
+                "ai_calls": self.usage['calls'],
+                "prompt_tokens": self.usage['prompt_tokens'],
+                "output_tokens": self.usage['output_tokens'],
+                "ai_seconds": round(self.usage['seconds'], 2),
                 "status": "completed"
             }
             
@@ -334,18 +394,14 @@ class AIMarketingAvtomat:
     def daily_content_generation(self):
         """Main function that runs daily at 9:00 AM"""
         logging.info("🚀 Starting daily AI Marketing Avtomat...")
+        self.usage = {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'seconds': 0.0}
         
         try:
             # 1. Get current trends
             trends = self.get_current_trends()
             
-            # 2. Create blog posts for each trend
-            blog_posts = []
-            for trend in trends:
-                post = self.create_blog_post(trend)
-                if post:
-                    blog_posts.append(post)
-                time.sleep(2)  # Small delay between AI calls
+            # 2. Create blog posts for the trends (batched, see create_blog_posts)
+            blog_posts = self.create_blog_posts(trends)
                 
             # 3. Save blog posts
             if blog_posts:
@@ -375,6 +431,9 @@ class AIMarketingAvtomat:
         # Schedule daily content generation at 9:00 AM
         schedule.every().day.at("09:00").do(self.daily_content_generation)
         
+        # Retry Telegram messages that could not be delivered yet
+        schedule.every(5).minutes.do(self.dispatch_outbox)
+        
         # For immediate testing - uncomment next line
         # self.daily_content_generation()
         
@@ -405,7 +464,9 @@ def main():
     """Main entry point"""
     try:
         # Check for required environment variables
-        required_env = ["GEMINI_API_KEY", "TELEGRAM_BOT_TOKEN", "TELEGRAM_CHAT_ID"]
+        required_env = ["TELEGRAM_BOT_TOKEN", "TELEGRAM_CHAT_ID"]
+        if os.environ.get("AI_PROVIDER", "gemini") == "gemini":
+            required_env.insert(0, "GEMINI_API_KEY")
         missing_env = [env for env in required_env if not os.environ.get(env)]
         
         if missing_env:
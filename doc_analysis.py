@@ -0,0 +1,167 @@
+"""
+SmartBot.uz - Katta hujjatlarni qismlab tahlil qilish
+
+Map-reduce analysis of long documents. Pages are packed into chunks of
+at most chunk_tokens (a page that is larger on its own is split at
+paragraph boundaries), every chunk is summarised on a bounded thread pool
+and the partial summaries are reduced, in as many rounds as the reduce
+budget needs, into the final answer. Progress is reported as events so
+callers can stream partial results while the rest is still running.
+"""
+
+import math
+import logging
+from concurrent.futures import Executor, TimeoutError as FuturesTimeout, as_completed
+from typing import List, Dict, Any, Optional, Callable, Iterator
+
+from prompt_budget import SENTENCE_RE, count_tokens
+
+def _split_page(text: str, chunk_tokens: int) -> List[str]:
+    """Parts of an oversized page, cut between paragraphs or sentences"""
+    pieces = [p.strip() for p in text.split('\n\n') if p.strip()]
+    if any(count_tokens(p) > chunk_tokens for p in pieces):
+        pieces = [s.strip() for s in SENTENCE_RE.split(text) if s.strip()]
+    parts, current, used = [], [], 0
+    for piece in pieces:
+        cost = count_tokens(piece)
+        if current and used + cost > chunk_tokens:
+            parts.append('\n'.join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += cost
+    if current:
+        parts.append('\n'.join(current))
+    return parts
+
+def split_pages(pages: List[str], chunk_tokens: int = 3000, max_chunks: int = 24) -> List[Dict[str, Any]]:
+    """Consecutive pages packed into chunks: [{'index', 'first_page', 'last_page', 'text', 'tokens'}]
+
+    Documents that would need more than max_chunks are divided into
+    max_chunks groups of similar size instead; callers trim each group to
+    its prompt budget.
+    """
+    units = []
+    for number, page in enumerate(pages, 1):
+        page = (page or '').strip()
+        if not page:
+            continue
+        tokens = count_tokens(page)
+        if tokens <= chunk_tokens:
+            units.append((number, page, tokens))
+        else:
+            units.extend((number, part, count_tokens(part)) for part in _split_page(page, chunk_tokens))
+    if not units:
+        return []
+
+    total = sum(tokens for _, _, tokens in units)
+    groups: List[List[tuple]] = []
+    if math.ceil(total / chunk_tokens) <= max_chunks:
+        used = 0
+        for unit in units:
+            if groups and used + unit[2] <= chunk_tokens:
+                groups[-1].append(unit)
+                used += unit[2]
+            else:
+                groups.append([unit])
+                used = unit[2]
+    if not groups or len(groups) > max_chunks:
+        # Balanced split by cumulative token position
+        groups = [[] for _ in range(max_chunks)]
+        position = 0
+        for unit in units:
+            groups[min(max_chunks - 1, int(position * max_chunks / total))].append(unit)
+            position += unit[2]
+        groups = [group for group in groups if group]
+
+    return [{
+        'index': i,
+        'first_page': group[0][0],
+        'last_page': group[-1][0],
+        'text': '\n\n'.join(text for _, text, _ in group),
+        'tokens': sum(tokens for _, _, tokens in group)
+    } for i, group in enumerate(groups)]
+
+def _pack(summaries: List[str], max_tokens: int) -> List[List[str]]:
+    groups: List[List[str]] = []
+    used = 0
+    for summary in summaries:
+        cost = count_tokens(summary)
+        if groups and used + cost <= max_tokens:
+            groups[-1].append(summary)
+            used += cost
+        else:
+            groups.append([summary])
+            used = cost
+    return groups
+
+def reduce_summaries(summaries: List[str], reduce: Callable[[List[str], bool], Optional[str]],
+                     max_tokens: int, pool: Optional[Executor] = None, max_rounds: int = 3) -> Optional[str]:
+    """Fold partial summaries into one answer; reduce(group, final) is called per group
+
+    Intermediate rounds (final=False) merge groups that fit max_tokens and
+    may run on pool; the last round gets everything that is left.
+    """
+    summaries = [s for s in summaries if s]
+    for _ in range(max_rounds):
+        groups = _pack(summaries, max_tokens)
+        if len(groups) <= 1:
+            break
+        merge = lambda group: reduce(group, False)
+        merged = list(pool.map(merge, groups)) if pool is not None else [merge(group) for group in groups]
+        # A failed merge keeps its inputs rather than losing those pages
+        summaries = [item for group, result in zip(groups, merged) for item in ([result] if result else group)]
+    return reduce(summaries, True) if summaries else None
+
+def map_reduce(chunks: List[Dict[str, Any]], summarize: Callable[[Dict[str, Any]], Optional[str]],
+               reduce: Callable[[List[str], bool], Optional[str]], pool: Executor, reduce_tokens: int,
+               timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """Summarise chunks concurrently and reduce them, yielding events as work completes
+
+    Events: {'type': 'partial', 'index', 'pages', 'summary', 'done', 'total'}
+    for every finished chunk (summary is None when it failed), then one
+    {'type': 'result', 'analysis', 'analyzed', 'total', 'timed_out'}.
+    Chunks still running after timeout seconds are skipped.
+    """
+    futures = {pool.submit(summarize, chunk): chunk for chunk in chunks}
+    partials: Dict[int, str] = {}
+    done = 0
+    timed_out = False
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            chunk = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                logging.error(f"Chunk {chunk['index']} analysis failed: {e}")
+                summary = None
+            done += 1
+            if summary:
+                partials[chunk['index']] = summary
+            yield {
+                'type': 'partial',
+                'index': chunk['index'],
+                'pages': [chunk['first_page'], chunk['last_page']],
+                'summary': summary,
+                'done': done,
+                'total': len(chunks)
+            }
+    except FuturesTimeout:
+        timed_out = True
+        for future in futures:
+            future.cancel()
+        logging.warning(f"Document analysis timed out after {done}/{len(chunks)} chunks")
+
+    labelled = [f"{pages_label(chunk)}:\n{partials[chunk['index']]}" for chunk in chunks if chunk['index'] in partials]
+    analysis = reduce_summaries(labelled, reduce, reduce_tokens, pool) if labelled else None
+    yield {
+        'type': 'result',
+        'analysis': analysis,
+        'analyzed': len(partials),
+        'total': len(chunks),
+        'timed_out': timed_out
+    }
+
+def pages_label(chunk: Dict[str, Any]) -> str:
+    if chunk['first_page'] == chunk['last_page']:
+        return f"{chunk['first_page']}-sahifa"
+    return f"{chunk['first_page']}-{chunk['last_page']}-sahifalar"
@@ -0,0 +1,140 @@
+"""
+SmartBot.uz - Hujjat tahlillari keshi
+
+Results of /ai/document keyed by the SHA-256 of the uploaded bytes: the
+extracted page texts and, once a complete analysis exists, the analysis
+itself. Entries live in SQLite (shared by all gunicorn workers, kept
+across restarts) and the least recently used ones are evicted when the
+total stored size exceeds max_bytes.
+"""
+
+import time
+import json
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+class DocumentCache:
+    """Size-bounded LRU of {'pages', 'analysis', 'model'} by upload hash"""
+
+    def __init__(self, db_path: Optional[str] = None, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.stats_data = {'hits': 0, 'analysis_hits': 0, 'misses': 0, 'evictions': 0}
+        self.db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS document_cache (digest TEXT PRIMARY KEY, pages TEXT, '
+                'analysis TEXT, model TEXT, size INTEGER, created REAL, used REAL)'
+            )
+            self.db.execute('CREATE INDEX IF NOT EXISTS document_cache_used ON document_cache (used)')
+            self.db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Document cache database unavailable: {e}")
+            self.db = None
+
+    def get(self, digest: str, model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Cached entry; its 'analysis' is None unless it was made with model (when given)"""
+        now = time.time()
+        with self.lock:
+            entry = None
+            if self.db is None:
+                entry = self.entries.get(digest)
+                if entry:
+                    self.entries.move_to_end(digest)
+                    entry = dict(entry)
+            else:
+                try:
+                    row = self.db.execute(
+                        'SELECT pages, analysis, model FROM document_cache WHERE digest = ?', (digest,)
+                    ).fetchone()
+                    if row:
+                        self.db.execute('UPDATE document_cache SET used = ? WHERE digest = ?', (now, digest))
+                        self.db.commit()
+                        entry = {'pages': json.loads(row[0]),
+                                 'analysis': json.loads(row[1]) if row[1] else None, 'model': row[2]}
+                except sqlite3.Error as e:
+                    logging.error(f"Document cache read error: {e}")
+
+            if entry is None:
+                self.stats_data['misses'] += 1
+                return None
+            if model is not None and entry['model'] != model:
+                entry['analysis'] = None
+            self.stats_data['hits'] += 1
+            if entry['analysis']:
+                self.stats_data['analysis_hits'] += 1
+            return entry
+
+    def set(self, digest: str, pages: List[str], analysis: Optional[Dict[str, Any]] = None,
+            model: Optional[str] = None) -> None:
+        """Store the extracted pages and, when given, the finished analysis"""
+        pages_json = json.dumps(pages, ensure_ascii=False)
+        analysis_json = json.dumps(analysis, ensure_ascii=False) if analysis else None
+        size = len(pages_json.encode('utf-8')) + len((analysis_json or '').encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            if self.db is None:
+                self.entries[digest] = {'pages': pages, 'analysis': analysis, 'model': model, 'size': size}
+                self.entries.move_to_end(digest)
+                while sum(e['size'] for e in self.entries.values()) > self.max_bytes:
+                    self.entries.popitem(last=False)
+                    self.stats_data['evictions'] += 1
+                return
+            try:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO document_cache (digest, pages, analysis, model, size, created, used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (digest, pages_json, analysis_json, model, size, now, now)
+                )
+                self._evict()
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Document cache write error: {e}")
+
+    def _evict(self) -> None:
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM document_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for digest, size in self.db.execute('SELECT digest, size FROM document_cache ORDER BY used'):
+            if total <= self.max_bytes:
+                break
+            stale.append((digest,))
+            total -= size
+        self.db.executemany('DELETE FROM document_cache WHERE digest = ?', stale)
+        self.stats_data['evictions'] += len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        """Entries, stored size and hit counters (counters are per worker)"""
+        with self.lock:
+            if self.db is None:
+                entries, size = len(self.entries), sum(e['size'] for e in self.entries.values())
+            else:
+                try:
+                    entries, size = self.db.execute(
+                        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM document_cache'
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logging.error(f"Document cache read error: {e}")
+                    entries, size = 0, 0
+            lookups = self.stats_data['hits'] + self.stats_data['misses']
+            return {
+                'entries': entries,
+                'size_bytes': size,
+                'max_bytes': self.max_bytes,
+                **self.stats_data,
+                'hit_rate': round(self.stats_data['hits'] / lookups, 4) if lookups else 0.0,
+                'disk_tier': self.db is not None
+            }
@@ -0,0 +1,173 @@
+"""
+SmartBot.uz - Chatbot uchun tez-tez so'raladigan savollar keshi
+
+Near-duplicate matching of chat questions. Messages are normalized (case,
+Uzbek apostrophes, Cyrillic -> Latin), split into character 3-grams and
+indexed with MinHash + LSH banding; candidates are then confirmed with the
+exact Jaccard similarity. Admin-curated canned answers are matched first,
+then answers previously generated for similar questions.
+"""
+
+import zlib
+import random
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple
+
+from blog_search import TOKEN_RE, normalize_text
+
+MERSENNE_PRIME = (1 << 61) - 1
+NUM_PERM = 64
+BANDS = 32  # 2 rows per band: similar pairs (J >= 0.4) almost always share a bucket
+
+_rng = random.Random(20240917)
+PERMUTATIONS = [(_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+def normalize_question(text: str) -> str:
+    """Lowercase, transliterate, drop apostrophes and punctuation"""
+    return ' '.join(TOKEN_RE.findall(normalize_text(text)))
+
+def shingles(text: str, n: int = 3) -> Set[str]:
+    normalized = f" {normalize_question(text)} "
+    if len(normalized) <= n:
+        return {normalized} if normalized.strip() else set()
+    return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+def minhash(grams: Set[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(gram.encode('utf-8')) for gram in grams]
+    return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS)
+
+def jaccard(first: Set[str], second: Set[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+class FAQCache:
+    """Canned answers plus a bounded LRU of learned answers, matched by n-gram similarity"""
+
+    def __init__(self, canned_threshold: float = 0.5, learned_threshold: float = 0.7,
+                 max_learned: int = 500):
+        self.thresholds = {'canned': canned_threshold, 'learned': learned_threshold}
+        self.max_learned = max_learned
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.learned: "OrderedDict[str, None]" = OrderedDict()
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+        self.stats_data = {'canned_hits': 0, 'learned_hits': 0, 'misses': 0}
+
+    def _bands(self, signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        rows = NUM_PERM // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows]) for band in range(BANDS)]
+
+    def _insert(self, key: str, question: str, answer: str, source: str, ref: Any = None) -> None:
+        grams = shingles(question)
+        if not grams:
+            return
+        signature = minhash(grams)
+        self._remove(key)
+        self.entries[key] = {'question': question, 'answer': answer, 'source': source, 'ref': ref,
+                             'grams': grams, 'signature': signature}
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, set()).add(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if not entry:
+            return
+        for band in self._bands(entry['signature']):
+            bucket = self.buckets.get(band)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band]
+
+    def set_canned(self, items: Iterable[Dict[str, Any]]) -> None:
+        """Replace all canned answers; each item has 'id', 'questions' and 'answer'"""
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if e['source'] == 'canned']:
+                self._remove(key)
+            for item in items:
+                for i, question in enumerate(item.get('questions') or []):
+                    if question.strip() and item.get('answer'):
+                        self._insert(f"canned:{item.get('id')}:{i}", question, item['answer'], 'canned', item.get('id'))
+
+    def add_learned(self, question: str, answer: str) -> None:
+        """Remember a generated answer for similar questions (least recently used is dropped)"""
+        key = 'learned:' + normalize_question(question)
+        with self.lock:
+            self._insert(key, question, answer, 'learned')
+            self.learned[key] = None
+            self.learned.move_to_end(key)
+            while len(self.learned) > self.max_learned:
+                old_key, _ = self.learned.popitem(last=False)
+                self._remove(old_key)
+
+    def lookup(self, message: str) -> Optional[Dict[str, Any]]:
+        """Best match above its source's threshold: {'answer', 'source', 'score', 'question', 'ref'}"""
+        grams = shingles(message)
+        if not grams:
+            return None
+        signature = minhash(grams)
+        with self.lock:
+            candidates = set()
+            for band in self._bands(signature):
+                candidates |= self.buckets.get(band, set())
+
+            best = None
+            for key in candidates:
+                entry = self.entries[key]
+                score = jaccard(grams, entry['grams'])
+                if score < self.thresholds[entry['source']]:
+                    continue
+                # Curated answers win over learned ones of similar quality
+                rank = (entry['source'] == 'canned', score)
+                if best is None or rank > best[0]:
+                    best = (rank, key, score)
+
+            if best is None:
+                self.stats_data['misses'] += 1
+                return None
+            _, key, score = best
+            entry = self.entries[key]
+            self.stats_data[f"{entry['source']}_hits"] += 1
+            if entry['source'] == 'learned':
+                self.learned.move_to_end(key)
+            return {'answer': entry['answer'], 'source': entry['source'], 'score': round(score, 3),
+                    'question': entry['question'], 'ref': entry['ref']}
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit counts and sizes (this worker only)"""
+        with self.lock:
+            lookups = sum(self.stats_data.values())
+            hits = self.stats_data['canned_hits'] + self.stats_data['learned_hits']
+            return {
+                **self.stats_data,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'canned_questions': sum(1 for e in self.entries.values() if e['source'] == 'canned'),
+                'learned': len(self.learned)
+            }
+
+def build_price_faq(services: List[Dict[str, Any]], start_id: int = 1) -> List[Dict[str, Any]]:
+    """Canned price answers generated from services.json"""
+    items = []
+    overview = '\n'.join(f"• {s['title']}: {s['price']}" for s in services if s.get('title') and s.get('price'))
+    if overview:
+        items.append({
+            'id': start_id,
+            'intent': 'narxlar',
+            'questions': ['Narxlar qancha?', 'Xizmatlaringiz narxi qancha?', 'Narxlaringiz qanday?',
+                          'Qancha turadi?', 'Price list', 'Сколько стоит?'],
+            'answer': f"SmartBot.uz xizmatlari narxlari:\n{overview}\n\nBatafsil: /services, buyurtma uchun: /contact"
+        })
+    for offset, service in enumerate(s for s in services if s.get('title') and s.get('price')):
+        title = service['title']
+        duration = f" Muddati: {service['duration']}." if service.get('duration') else ''
+        items.append({
+            'id': start_id + offset + 1,
+            'intent': f"narx:{title}",
+            'questions': [f"{title} narxi qancha?", f"{title} qancha turadi?", f"{title} necha pul?",
+                          f"{title} narxi"],
+            'answer': f"{title}: {service['price']}.{duration} "
+                      f"Batafsil ma'lumot /services sahifasida, buyurtma uchun /contact sahifasiga yozing."
+        })
+    return items
@@ -0,0 +1,69 @@
+"""
+SmartBot.uz - JSON fayllarni xavfsiz yozish
+
+Cross-process locking and atomic writes for the JSON files under data/.
+Every web worker, daily_job.py and the command line tools take
+locked(path) around a read-modify-write of the same file (an flock on
+path + ".lock", so threads and processes are serialised alike), and
+write_json replaces the file in one step, so readers never see a
+truncated file.
+"""
+
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: locks only cover this process
+    fcntl = None
+
+_fallback_locks: Dict[str, threading.Lock] = {}
+_fallback_guard = threading.Lock()
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Exclusive lock on path for a read-modify-write; not re-entrant"""
+    if fcntl is None:
+        with _fallback_guard:
+            lock = _fallback_locks.setdefault(os.path.abspath(path), threading.Lock())
+        with lock:
+            yield
+        return
+    # A separate open file per acquisition, so threads of one process exclude each other too
+    with open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_json(path: str, data: Any) -> None:
+    """Write data to path atomically (temp file in the same directory + os.replace)"""
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, path)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def update_record(path: str, record_id: Any, fields: Dict[str, Any]) -> bool:
+    """Set fields on the record with this id in a JSON array file, under locked(path)"""
+    try:
+        with locked(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            record = next((r for r in records if str(r.get('id')) == str(record_id)), None)
+            if record is None:
+                return False
+            record.update(fields)
+            write_json(path, records)
+            return True
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to update {path} record {record_id}: {e}")
+        return False
@@ -0,0 +1,130 @@
+"""
+SmartBot.uz - PDF matnini alohida jarayonda ajratish
+
+Sandboxed PDF text extraction. Parsing runs in a small pool of child
+processes under per-job CPU-time and memory rlimits, with a wall-clock
+timeout on the caller side; a parser killed by its limit is replaced by
+the pool without affecting other uploads. Pages are collected into a list
+and reading stops at the page limit or once the token budget is
+reached, so huge documents cost only what the analysis can use.
+"""
+
+import io
+import os
+import logging
+import threading
+import multiprocessing
+from multiprocessing import TimeoutError as PoolTimeout
+from typing import List, Dict, Any, Optional
+
+from prompt_budget import count_tokens
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+class PDFExtractionError(Exception):
+    """The PDF could not be read"""
+
+class PDFExtractionTimeout(PDFExtractionError):
+    """Extraction exceeded its time or CPU limit"""
+
+def _soft_limit(name: int, value: int) -> None:
+    # Only the soft limit moves: a lowered hard limit could not be raised
+    # again for the next job in the same child
+    _, hard = resource.getrlimit(name)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(name, (value, hard))
+
+def _limit_resources(cpu_seconds: int, memory_mb: int) -> None:
+    if resource is None:
+        return
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    _soft_limit(resource.RLIMIT_CPU, int(used.ru_utime + used.ru_stime) + cpu_seconds)
+    if memory_mb:
+        _soft_limit(resource.RLIMIT_AS, memory_mb * 1024 * 1024)
+
+def extract_pages(data: bytes, max_pages: int = 300, max_tokens: int = 0) -> Dict[str, Any]:
+    """{'pages': [page texts], 'page_count', 'truncated'} for PDF bytes
+
+    Reading stops after max_pages pages or once max_tokens (if set) have
+    been collected; truncated tells whether the rest was skipped.
+    """
+    import PyPDF2
+
+    try:
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        page_count = len(reader.pages)
+        pages: List[str] = []
+        tokens = 0
+        for page in reader.pages:
+            if len(pages) >= max_pages or (max_tokens and tokens >= max_tokens):
+                break
+            text = page.extract_text() or ''
+            pages.append(text)
+            tokens += count_tokens(text)
+    except Exception as e:
+        raise PDFExtractionError(f"{type(e).__name__}: {e}") from None
+    return {'pages': pages, 'page_count': page_count, 'truncated': len(pages) < page_count}
+
+def _sandboxed_extract(data: bytes, max_pages: int, max_tokens: int, cpu_seconds: int,
+                       memory_mb: int) -> Dict[str, Any]:
+    try:
+        _limit_resources(cpu_seconds, memory_mb)
+    except (ValueError, OSError) as e:
+        raise PDFExtractionError(f"Cannot set resource limits: {e}") from None
+    try:
+        return extract_pages(data, max_pages, max_tokens)
+    except MemoryError:
+        raise PDFExtractionError('Memory limit exceeded') from None
+
+class PDFExtractor:
+    """Process pool for extract_pages with per-job time, CPU, memory and page limits
+
+    The pool is created lazily in the process that uses it (gunicorn
+    workers fork after import). Limits are set at the start of every job,
+    the CPU limit relative to what the child has already used.
+    """
+
+    def __init__(self, processes: int = 2, timeout: float = 20.0, max_pages: int = 300,
+                 max_tokens: int = 0, memory_mb: int = 512):
+        self.processes = processes
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.max_tokens = max_tokens
+        self.memory_mb = memory_mb
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pid = None
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                # forkserver: children are not forked from a multi-threaded server process
+                context = multiprocessing.get_context(
+                    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                )
+                self.pool = context.Pool(self.processes)
+                self.pid = os.getpid()
+            return self.pool
+
+    def extract(self, data: bytes, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Run extract_pages in the pool; raises PDFExtractionError / PDFExtractionTimeout"""
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        job = self._get_pool().apply_async(
+            _sandboxed_extract, (data, self.max_pages, budget, max(1, int(self.timeout)), self.memory_mb)
+        )
+        try:
+            return job.get(self.timeout)
+        except PoolTimeout:
+            # A child killed by its CPU limit never reports back; the pool replaces it
+            logging.warning(f"PDF extraction exceeded {self.timeout}s ({len(data)} bytes)")
+            raise PDFExtractionTimeout(f"Extraction exceeded {self.timeout}s") from None
+
+    def close(self) -> None:
+        with self.lock:
+            if self.pool is not None and self.pid == os.getpid():
+                self.pool.terminate()
+            self.pool = None
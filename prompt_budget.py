@@ -0,0 +1,150 @@
+"""
+SmartBot.uz - Prompt hajmini nazorat qilish
+
+Local token counting and deterministic trimming of prompt inputs.
+PromptTemplate parses a str.format template once, knows the token cost
+of its fixed text and fits the variable parts into a per-feature input
+budget: long inputs keep their beginning and end, and the middle is
+reduced to its most representative sentences (extractive, no model call),
+so the same input always gives the same prompt.
+"""
+
+import re
+import math
+import string
+import textwrap
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+|\n+')
+TRUNCATION_MARKER = "…"
+
+def count_tokens(text: str) -> int:
+    """Token estimate close to Gemini's: about 4 Latin or 3 Cyrillic characters per token"""
+    tokens = 0
+    for word in WORD_RE.findall(text or ''):
+        size = 3 if not word.isascii() else 4
+        tokens += max(1, math.ceil(len(word) / size))
+    return tokens
+
+def _cut_words(text: str, max_tokens: int) -> str:
+    """Longest prefix of whole words within max_tokens"""
+    result, used = [], 0
+    for word in text.split():
+        cost = count_tokens(word)
+        if used + cost > max_tokens:
+            break
+        result.append(word)
+        used += cost
+    return ' '.join(result)
+
+def fit_text(text: str, max_tokens: int, head_share: float = 0.6, tail_share: float = 0.15) -> str:
+    """text unchanged if it fits, otherwise head + most informative middle sentences + tail
+
+    Middle sentences are ranked by how common their words are in the whole
+    text (ties by position) and kept in their original order.
+    """
+    text = text or ''
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+    text = text.strip()
+
+    sentences = [s.strip() for s in SENTENCE_RE.split(text) if s.strip()]
+    costs = [count_tokens(s) for s in sentences]
+    marker = count_tokens(TRUNCATION_MARKER)
+    budget = max_tokens - marker * 2
+    if len(sentences) < 3 or budget <= 0:
+        return _cut_words(text, max(max_tokens - 1, 1)) + ' ' + TRUNCATION_MARKER
+
+    keep = set()
+    used = 0
+    # Beginning of the text (title, purpose) and its end (conclusion, contacts)
+    for i, cost in enumerate(costs):
+        if used + cost > budget * head_share:
+            break
+        keep.add(i)
+        used += cost
+    tail_used = 0
+    for i in range(len(sentences) - 1, -1, -1):
+        if i in keep or tail_used + costs[i] > budget * tail_share:
+            break
+        keep.add(i)
+        tail_used += costs[i]
+    used += tail_used
+
+    frequencies = Counter(word.lower() for word in WORD_RE.findall(text) if len(word) > 3)
+    def score(i: int) -> float:
+        words = [w.lower() for w in WORD_RE.findall(sentences[i]) if len(w) > 3]
+        return sum(frequencies[w] for w in words) / (len(words) + 1) if words else 0.0
+
+    # Each middle sentence may open a gap, so it is charged one marker as well
+    for i in sorted((i for i in range(len(sentences)) if i not in keep), key=lambda i: (-score(i), i)):
+        if used + costs[i] + marker <= budget:
+            keep.add(i)
+            used += costs[i] + marker
+
+    if not keep:
+        return _cut_words(text, max(max_tokens - 1, 1)) + ' ' + TRUNCATION_MARKER
+    parts: List[str] = []
+    previous = -1
+    for i in sorted(keep):
+        if i != previous + 1:
+            parts.append(TRUNCATION_MARKER)
+        parts.append(sentences[i])
+        previous = i
+    if previous != len(sentences) - 1:
+        parts.append(TRUNCATION_MARKER)
+    return '\n'.join(parts)
+
+class PromptTemplate:
+    """str.format template compiled once, rendered within an input token budget
+
+    limits caps single fields (e.g. a user message); the elastic field gets
+    whatever the budget leaves after the fixed text and the other fields.
+    """
+
+    def __init__(self, template: str, budget: Optional[int] = None, limits: Optional[Dict[str, int]] = None,
+                 elastic: Optional[str] = None):
+        self.template = textwrap.dedent(template).strip('\n')
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in string.Formatter().parse(self.template):
+            if spec or conversion or (field is not None and not field.isidentifier()):
+                raise ValueError(f"Unsupported template field: {field!r}")
+            self.parts.append((literal, field))
+        self.fields = {field for _, field in self.parts if field}
+        self.fixed_tokens = count_tokens(''.join(literal for literal, _ in self.parts))
+        self.budget = budget
+        self.limits = dict(limits or {})
+        self.elastic = elastic
+        unknown = (set(self.limits) | ({elastic} if elastic else set())) - self.fields
+        if unknown:
+            raise ValueError(f"Unknown template fields: {', '.join(sorted(unknown))}")
+
+    def fit(self, **values) -> Tuple[str, List[str]]:
+        """(prompt, names of the fields that were shortened)"""
+        missing = self.fields - set(values)
+        if missing:
+            raise KeyError(', '.join(sorted(missing)))
+        values = {name: str(values[name]) for name in self.fields}
+        truncated = []
+        for name, limit in self.limits.items():
+            fitted = fit_text(values[name], limit)
+            if fitted != values[name]:
+                truncated.append(name)
+            values[name] = fitted
+
+        if self.budget and self.elastic:
+            others = sum(count_tokens(value) for name, value in values.items() if name != self.elastic)
+            room = max(0, self.budget - self.fixed_tokens - others)
+            fitted = fit_text(values[self.elastic], room)
+            if fitted != values[self.elastic] and self.elastic not in truncated:
+                truncated.append(self.elastic)
+            values[self.elastic] = fitted
+
+        return ''.join(literal + (values[field] if field else '') for literal, field in self.parts), truncated
+
+    def render(self, **values) -> str:
+        return self.fit(**values)[0]
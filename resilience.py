@@ -0,0 +1,232 @@
+"""
+SmartBot.uz - Tashqi xizmatlar barqarorligi
+
+Retry with jittered exponential backoff, per-dependency circuit breakers
+and request deadlines for outbound Gemini and Telegram calls. Breaker
+state can be kept in SQLite so all gunicorn workers and daily_job.py
+stop calling a dependency together while it is down.
+"""
+
+import time
+import random
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any, Callable, List
+
+# Exception class names (anywhere in the MRO) that are worth retrying:
+# network errors from requests and the retryable google.api_core errors
+TRANSIENT_ERROR_NAMES = {
+    'ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout', 'TimeoutError',
+    'ServiceUnavailable', 'ResourceExhausted', 'DeadlineExceeded', 'InternalServerError',
+    'TooManyRequests', 'BadGateway', 'GatewayTimeout'
+}
+
+class TransientError(Exception):
+    """Raise from a call to mark a failure as retryable (e.g. HTTP 429/5xx)"""
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit open, retry after {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+class DeadlineExceeded(Exception):
+    """Raised when the caller's time budget is used up"""
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed call may succeed if repeated"""
+    if isinstance(error, TransientError):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+class Deadline:
+    """Absolute time budget passed down through nested calls"""
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires - time.monotonic()
+
+    def timeout(self, cap: float) -> float:
+        """Per-attempt timeout: cap, shortened to what is left of the budget"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('Request deadline exceeded')
+        return min(cap, remaining)
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open single probe -> closed"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 db_path: Optional[str] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.memory = self._fresh_state()
+        self.db = None
+        if db_path:
+            self._open_db(db_path)
+
+    @staticmethod
+    def _fresh_state() -> Dict[str, Any]:
+        return {'state': 'closed', 'failures': 0, 'opened_at': 0.0, 'probe_until': 0.0,
+                'last_error': '', 'opens': 0}
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS breakers ('
+                'name TEXT PRIMARY KEY, state TEXT, failures INTEGER, opened_at REAL, '
+                'probe_until REAL, last_error TEXT, opens INTEGER)'
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Circuit breaker database unavailable: {e}")
+            self.db = None
+
+    def _transaction(self, update: Callable[[Dict[str, Any], float], Any]) -> Any:
+        """Run update(state, now) atomically; update returns (result, changed)"""
+        now = time.time()
+        with self.lock:
+            if self.db is None:
+                return update(self.memory, now)[0]
+            try:
+                self.db.execute('BEGIN IMMEDIATE')
+                row = self.db.execute(
+                    'SELECT state, failures, opened_at, probe_until, last_error, opens '
+                    'FROM breakers WHERE name = ?', (self.name,)
+                ).fetchone()
+                state = self._fresh_state()
+                if row:
+                    state.update(zip(('state', 'failures', 'opened_at', 'probe_until', 'last_error', 'opens'), row))
+                result, changed = update(state, now)
+                if changed:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO breakers '
+                        '(name, state, failures, opened_at, probe_until, last_error, opens) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (self.name, state['state'], state['failures'], state['opened_at'],
+                         state['probe_until'], state['last_error'], state['opens'])
+                    )
+                self.db.execute('COMMIT')
+                self.memory = state
+                return result
+            except sqlite3.Error as e:
+                # Never let the breaker store itself block outbound calls
+                logging.error(f"Circuit breaker store error: {e}")
+                try:
+                    self.db.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                return update(self.memory, now)[0]
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state only one probe is let through"""
+        def update(state, now):
+            if state['state'] == 'closed':
+                return True, False
+            if now < state['opened_at'] + self.reset_timeout or now < state['probe_until']:
+                return False, False
+            state['state'] = 'half_open'
+            state['probe_until'] = now + self.reset_timeout
+            return True, True
+        return self._transaction(update)
+
+    def is_open(self) -> bool:
+        """Read-only check used to skip work before a call that would be refused"""
+        state = self.memory if self.db is None else self.status()
+        return state['state'] != 'closed' and time.time() < max(
+            state['opened_at'] + self.reset_timeout, state['probe_until'])
+
+    def retry_after(self) -> float:
+        state = self.status()
+        return max(0.0, max(state['opened_at'] + self.reset_timeout, state['probe_until']) - time.time())
+
+    def record_success(self) -> None:
+        def update(state, now):
+            if state['state'] == 'closed' and not state['failures']:
+                return None, False
+            state.update(state='closed', failures=0, probe_until=0.0)
+            return None, True
+        self._transaction(update)
+
+    def record_failure(self, error: Exception) -> None:
+        def update(state, now):
+            state['failures'] += 1
+            state['last_error'] = str(error)[:200]
+            if state['state'] == 'half_open' or state['failures'] >= self.failure_threshold:
+                if state['state'] != 'open':
+                    state['opens'] += 1
+                    logging.warning(f"Circuit '{self.name}' opened after {state['failures']} failures: {error}")
+                state.update(state='open', opened_at=now, probe_until=0.0)
+            return None, True
+        self._transaction(update)
+
+    def status(self) -> Dict[str, Any]:
+        """Current breaker state (shared view when backed by SQLite)"""
+        state = self._transaction(lambda state, now: (dict(state), False))
+        state['name'] = self.name
+        return state
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Process-wide breaker per dependency name"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+def breaker_status() -> List[Dict[str, Any]]:
+    """Status of every breaker registered in this process"""
+    now = time.time()
+    result = []
+    for breaker in list(_breakers.values()):
+        state = breaker.status()
+        reopen_at = max(state['opened_at'] + breaker.reset_timeout, state['probe_until'])
+        result.append({
+            'name': state['name'],
+            'state': state['state'],
+            'failures': state['failures'],
+            'opens': state['opens'],
+            'last_error': state['last_error'],
+            'retry_after': round(max(0.0, reopen_at - now), 1) if state['state'] != 'closed' else 0
+        })
+    return result
+
+def call_with_retry(func: Callable[[float], Any], breaker: CircuitBreaker, deadline: Optional[Deadline] = None,
+                    attempts: int = 3, timeout: float = 10.0, base_delay: float = 0.5,
+                    max_delay: float = 8.0) -> Any:
+    """Call func(timeout) through the breaker, retrying transient errors with full-jitter backoff
+
+    Non-transient errors (bad request, blocked prompt) are raised at once and
+    do not count against the breaker: the dependency did answer.
+    """
+    for attempt in range(attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(breaker.name, breaker.retry_after())
+        call_timeout = deadline.timeout(timeout) if deadline else timeout
+        try:
+            result = func(call_timeout)
+        except Exception as e:
+            if not is_transient(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure(e)
+            if attempt == attempts - 1 or breaker.is_open():
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if deadline and delay >= deadline.remaining():
+                raise
+            logging.warning(f"{breaker.name} call failed ({e}), retry {attempt + 1} in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
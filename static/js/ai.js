@@ -1,8 +1,7 @@
 // AI Functions for SmartBot.uz
 // Handles all AI-related frontend interactions
 
-// Global variables
-let chatHistory = [];
+// Suhbat tarixi serverda saqlanadi (sessiya cookie orqali)
 
 // Initialize AI interface
 document.addEventListener('DOMContentLoaded', function() {
@@ -44,9 +43,15 @@ async function sendChatMessage() {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ message: message })
+            body: JSON.stringify({ message: message, stream: true })
         });
         
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.startsWith('text/event-stream') && response.body) {
+            await readChatStream(response);
+            return;
+        }
+        
         const data = await response.json();
         
         // Remove typing indicator
@@ -55,7 +60,7 @@ async function sendChatMessage() {
         if (data.success) {
             addMessageToChat(data.response, 'bot');
         } else {
-            addMessageToChat(data.response || 'Xatolik yuz berdi', 'bot');
+            addMessageToChat(data.response || data.error || 'Xatolik yuz berdi', 'bot');
         }
         
     } catch (error) {
@@ -65,6 +70,53 @@ async function sendChatMessage() {
     }
 }
 
+// Server-Sent Events oqimini o'qish: har bir hodisa uchun onEvent(event, data)
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            onEvent(event, data ? JSON.parse(data) : {});
+        }
+    }
+}
+
+// Javob bo'laklarini kelishi bilan ko'rsatish
+async function readChatStream(response) {
+    const chatContainer = document.getElementById('chatContainer');
+    let bubble = null;
+    
+    await readEventStream(response, (event, data) => {
+        if (event === 'delta' || event === 'error') {
+            if (!bubble) {
+                removeTypingIndicator();
+                addMessageToChat('', 'bot');
+                bubble = chatContainer.lastElementChild.querySelector('div');
+            }
+            bubble.textContent += data.text;
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        }
+    });
+    
+    removeTypingIndicator();
+}
+
 function addMessageToChat(message, sender) {
     const chatContainer = document.getElementById('chatContainer');
     const messageDiv = document.createElement('div');
@@ -111,6 +163,30 @@ function removeTypingIndicator() {
     }
 }
 
+// ========================
+// BACKGROUND JOB HELPERS
+// ========================
+
+// Uzoq AI vazifalari 202 + job_id qaytaradi; natija tayyor bo'lguncha holatini so'raymiz
+async function waitForJob(response, intervalMs = 2000) {
+    const data = await response.json();
+    if (response.status !== 202 || !data.job_id) {
+        return data;
+    }
+
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+        const job = await (await fetch(data.status_url)).json();
+
+        if (job.status === 'done') {
+            return job.result;
+        }
+        if (job.status === 'failed' || job.error) {
+            return { success: false, message: job.error || 'Xatolik yuz berdi' };
+        }
+    }
+}
+
 // ========================
 // BLOG GENERATION FUNCTIONS
 // ========================
@@ -135,7 +211,7 @@ async function generateBlog() {
             body: JSON.stringify({ topic: topic })
         });
         
-        const data = await response.json();
+        const data = await waitForJob(response);
         hideLoading();
         
         const resultDiv = document.getElementById('blogResult');
@@ -272,7 +348,7 @@ async function generateCaseStudy() {
             body: JSON.stringify({ project_info: projectInfo })
         });
         
-        const data = await response.json();
+        const data = await waitForJob(response);
         hideLoading();
         
         const resultDiv = document.getElementById('caseStudyResult');
@@ -340,6 +416,7 @@ async function analyzeDocument() {
     
     const formData = new FormData();
     formData.append('file', file);
+    formData.append('stream', '1');
     
     try {
         const response = await fetch('/ai/document', {
@@ -347,6 +424,13 @@ async function analyzeDocument() {
             body: formData
         });
         
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.includes('text/event-stream')) {
+            hideLoading();
+            await readDocumentStream(response);
+            return;
+        }
+        
         const data = await response.json();
         hideLoading();
         
@@ -399,6 +483,80 @@ async function analyzeDocument() {
     }
 }
 
+// Katta PDF: qismlar xulosasi tayyor bo'lishi bilan ko'rsatiladi, oxirida umumiy tahlil
+async function readDocumentStream(response) {
+    const resultDiv = document.getElementById('documentResult');
+    resultDiv.innerHTML = `
+        <div class="alert alert-info">
+            <h6><i class="fas fa-file me-2"></i>Hujjat tahlil qilinmoqda
+                <span id="documentProgress" class="float-end"></span></h6>
+        </div>
+        <div class="card">
+            <div class="card-body">
+                <h6>Fayl turi: PDF <small id="documentPages" class="text-muted"></small></h6>
+                <div id="documentText"></div>
+                <h6>AI tahlili:</h6>
+                <div id="documentAnalysis" class="bg-primary bg-opacity-10 p-3 rounded">
+                    <i class="fas fa-spinner fa-spin me-2"></i>Umumiy xulosa tayyorlanmoqda...
+                </div>
+                <div id="documentParts" class="mt-3"></div>
+            </div>
+        </div>
+    `;
+    resultDiv.style.display = 'block';
+    
+    let failed = false;
+    await readEventStream(response, (event, data) => {
+        if (event === 'start') {
+            document.getElementById('documentPages').textContent = `(${data.pages} sahifa)`;
+            if (data.extracted_text) {
+                const text = document.createElement('div');
+                text.className = 'bg-light p-2 rounded mb-3';
+                text.style.maxHeight = '150px';
+                text.style.overflowY = 'auto';
+                text.innerHTML = '<small></small>';
+                text.firstChild.textContent = data.extracted_text;
+                document.getElementById('documentText').appendChild(text);
+            }
+        } else if (event === 'partial') {
+            document.getElementById('documentProgress').textContent = `${data.done}/${data.total} qism`;
+            if (data.summary) {
+                const part = document.createElement('details');
+                part.className = 'small mb-2';
+                part.innerHTML = '<summary></summary><div class="bg-light p-2 rounded mt-1"></div>';
+                const pages = data.pages[0] === data.pages[1] ? `${data.pages[0]}-sahifa` : `${data.pages[0]}-${data.pages[1]}-sahifalar`;
+                part.querySelector('summary').textContent = pages;
+                part.querySelector('div').textContent = data.summary;
+                document.getElementById('documentParts').appendChild(part);
+            }
+        } else if (event === 'result') {
+            const analysis = document.getElementById('documentAnalysis');
+            if (data.analysis) {
+                analysis.textContent = data.analysis;
+                if (data.analyzed < data.total) {
+                    const note = document.createElement('div');
+                    note.className = 'small text-muted mt-2';
+                    note.textContent = `Tahlil ${data.total} qismdan ${data.analyzed} tasi asosida tayyorlandi.`;
+                    analysis.appendChild(note);
+                }
+            } else {
+                failed = true;
+                analysis.textContent = 'AI xizmati hozir mavjud emas. Iltimos, keyinroq urinib ko\'ring.';
+            }
+        } else if (event === 'error') {
+            failed = true;
+            document.getElementById('documentAnalysis').textContent = data.error;
+        }
+    });
+    
+    const header = resultDiv.querySelector('.alert');
+    header.classList.replace('alert-info', failed ? 'alert-warning' : 'alert-success');
+    header.querySelector('h6').firstChild.nextSibling.textContent = 'Hujjat tahlili';
+    if (!failed) {
+        showNotification('Hujjat muvaffaqiyatli tahlil qilindi!', 'success');
+    }
+}
+
 // ========================
 // UTILITY FUNCTIONS
 // ========================
@@ -0,0 +1,247 @@
+"""
+SmartBot.uz - Telegram xabarlari navbati
+
+Durable outbox for Telegram Bot API calls (lead notifications, blog
+announcements). Senders only enqueue a message under an idempotency key;
+dispatchers (the web workers and daily_job.py) claim due entries with a
+lease, deliver them, retry transient failures with exponential backoff and
+write the outcome back to the record the message is about. Everything
+lives in SQLite, so nothing is lost when Telegram or a worker is down.
+
+    python telegram_outbox.py status
+    python telegram_outbox.py replay [--kind lead|blog] [--dispatch]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Callable
+
+from json_store import update_record
+
+STATUSES = ('pending', 'sending', 'sent', 'failed')
+
+# Fields set on the source record per kind: (delivered flag, delivery time)
+SOURCE_FIELDS = {
+    'lead': ('telegram_sent', 'telegram_sent_at'),
+    'blog': ('posted_to_telegram', 'telegram_posted_time')
+}
+
+def source_updates(kind: str, sent: bool, error: Optional[str] = None) -> Dict[str, Any]:
+    """Fields to write on the source record once an entry is sent or has failed for good"""
+    if sent:
+        flag, stamp = SOURCE_FIELDS.get(kind, ('telegram_sent', 'telegram_sent_at'))
+        return {flag: True, stamp: datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'telegram_status': 'sent'}
+    return {'telegram_status': 'failed', 'telegram_error': (error or '')[:200]}
+
+class TelegramOutbox:
+    """SQLite-backed queue of Bot API calls with retry state and idempotency keys
+
+    send(method, payload) used by dispatch returns True when Telegram
+    accepted the call, False when it was rejected (not retried), and
+    raises for failures worth retrying (network, 429/5xx, open breaker).
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 8, base_delay: float = 30.0,
+                 max_delay: float = 3600.0, lease: float = 120.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS telegram_outbox ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE, method TEXT, payload TEXT, '
+            'kind TEXT, source_id TEXT, status TEXT, attempts INTEGER DEFAULT 0, next_attempt REAL, '
+            'lease_until REAL, last_error TEXT, created REAL, updated REAL, sent_at REAL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS telegram_outbox_due ON telegram_outbox (status, next_attempt)')
+
+    def enqueue(self, key: str, method: str, payload: Dict[str, Any], kind: str = '',
+                source_id: Any = None) -> bool:
+        """Queue a call; False when an entry with this key already exists (nothing is queued)"""
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO telegram_outbox (key, method, payload, kind, source_id, status, '
+                'next_attempt, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, method, json.dumps(payload, ensure_ascii=False), kind,
+                 None if source_id is None else str(source_id), 'pending', now, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Due entries, leased to the caller so other dispatchers skip them"""
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.db.execute(
+                    "SELECT id, key, method, payload, kind, source_id, attempts FROM telegram_outbox "
+                    "WHERE (status = 'pending' AND next_attempt <= ?) OR (status = 'sending' AND lease_until < ?) "
+                    "ORDER BY next_attempt LIMIT ?", (now, now, limit)
+                ).fetchall()
+                self.db.executemany(
+                    "UPDATE telegram_outbox SET status = 'sending', lease_until = ?, updated = ? WHERE id = ?",
+                    [(now + self.lease, now, row[0]) for row in rows]
+                )
+                self.db.execute('COMMIT')
+            except sqlite3.Error:
+                self.db.execute('ROLLBACK')
+                raise
+        return [{'id': row[0], 'key': row[1], 'method': row[2], 'payload': json.loads(row[3]),
+                 'kind': row[4], 'source_id': row[5], 'attempts': row[6]} for row in rows]
+
+    def _finish(self, entry: Dict[str, Any], sent: bool, error: Optional[str], retry: bool) -> str:
+        now = time.time()
+        attempts = entry['attempts'] + 1
+        if sent:
+            status, next_attempt = 'sent', None
+        elif retry and attempts < self.max_attempts:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            status, next_attempt = 'pending', now + random.uniform(delay / 2, delay)
+        else:
+            status, next_attempt = 'failed', None
+        with self.lock:
+            self.db.execute(
+                'UPDATE telegram_outbox SET status = ?, attempts = ?, next_attempt = ?, lease_until = NULL, '
+                'last_error = ?, updated = ?, sent_at = ? WHERE id = ?',
+                (status, attempts, next_attempt, error, now, now if sent else None, entry['id'])
+            )
+        return status
+
+    def dispatch(self, send: Callable[[str, Dict[str, Any]], bool],
+                 update_source: Optional[Callable[[str, str, Dict[str, Any]], Any]] = None,
+                 limit: int = 20) -> Dict[str, int]:
+        """Deliver due entries; returns how many were sent, rescheduled and given up"""
+        counts = {'sent': 0, 'retrying': 0, 'failed': 0}
+        for entry in self.claim(limit):
+            error, retry = None, True
+            try:
+                sent = bool(send(entry['method'], entry['payload']))
+                if not sent:
+                    error, retry = 'Rejected by Telegram', False
+            except Exception as e:
+                sent, error = False, f"{type(e).__name__}: {e}"
+            status = self._finish(entry, sent, error, retry)
+            counts['retrying' if status == 'pending' else status] += 1
+            if status == 'pending':
+                logging.warning(f"Telegram outbox {entry['key']} attempt {entry['attempts'] + 1} failed: {error}")
+                continue
+            if status == 'failed':
+                logging.error(f"Telegram outbox {entry['key']} failed: {error}")
+            if update_source and entry['source_id'] is not None:
+                try:
+                    update_source(entry['kind'], entry['source_id'], source_updates(entry['kind'], sent, error))
+                except Exception as e:
+                    logging.error(f"Telegram outbox source update failed for {entry['key']}: {e}")
+        return counts
+
+    def replay(self, kind: Optional[str] = None, include_pending: bool = False) -> int:
+        """Make failed entries (and, with include_pending, waiting ones) due now with fresh attempts"""
+        statuses = ('failed', 'pending') if include_pending else ('failed',)
+        now = time.time()
+        sql = (f"UPDATE telegram_outbox SET status = 'pending', attempts = 0, next_attempt = ?, updated = ? "
+               f"WHERE status IN ({', '.join('?' * len(statuses))})")
+        params: List[Any] = [now, now, *statuses]
+        if kind:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        with self.lock:
+            return self.db.execute(sql, params).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry counts per status and kind, plus the most recent failures"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT kind, status, COUNT(*) FROM telegram_outbox GROUP BY kind, status'
+            ).fetchall()
+            failures = self.db.execute(
+                "SELECT key, kind, attempts, last_error, updated FROM telegram_outbox "
+                "WHERE status = 'failed' OR (status = 'pending' AND attempts > 0) ORDER BY updated DESC LIMIT 20"
+            ).fetchall()
+        by_status = dict.fromkeys(STATUSES, 0)
+        by_kind: Dict[str, Dict[str, int]] = {}
+        for kind, status, count in rows:
+            by_status[status] = by_status.get(status, 0) + count
+            by_kind.setdefault(kind, dict.fromkeys(STATUSES, 0))[status] = count
+        return {
+            'statuses': by_status,
+            'kinds': by_kind,
+            'recent_failures': [{'key': r[0], 'kind': r[1], 'attempts': r[2], 'error': r[3],
+                                 'updated': datetime.fromtimestamp(r[4]).strftime('%Y-%m-%d %H:%M:%S')}
+                                for r in failures]
+        }
+
+def bot_api_sender(token: str, breaker=None, deadline: float = 60.0,
+                   timeout: float = 10.0) -> Callable[[str, Dict[str, Any]], bool]:
+    """send(method, payload) for dispatch, through the shared breaker when given"""
+    import requests
+    from resilience import Deadline, TransientError, call_with_retry, get_breaker
+
+    breaker = breaker or get_breaker('telegram', failure_threshold=5, reset_timeout=60)
+
+    def send(method: str, payload: Dict[str, Any]) -> bool:
+        url = f"https://api.telegram.org/bot{token}/{method}"
+
+        def post(call_timeout):
+            response = requests.post(url, data=payload, timeout=call_timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise TransientError(f"Telegram {method} HTTP {response.status_code}")
+            return response
+
+        response = call_with_retry(post, breaker, Deadline(deadline), timeout=timeout)
+        if response.status_code != 200:
+            logging.error(f"Telegram {method} failed: {response.text}")
+            return False
+        return True
+
+    return send
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Inspect the outbox or replay its backlog from the command line"""
+    parser = argparse.ArgumentParser(description="SmartBot.uz Telegram outbox")
+    parser.add_argument('command', choices=['status', 'replay', 'dispatch'])
+    parser.add_argument('--db', default=os.path.join('data', 'telegram_outbox.sqlite3'))
+    parser.add_argument('--kind', choices=sorted(SOURCE_FIELDS), help="only this kind of message")
+    parser.add_argument('--pending', action='store_true', help="replay: also retry waiting entries now")
+    parser.add_argument('--dispatch', action='store_true', help="replay: deliver right away")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    outbox = TelegramOutbox(args.db)
+    if args.command == 'replay':
+        print(f"Requeued: {outbox.replay(args.kind, args.pending)}")
+    if args.command == 'dispatch' or args.dispatch:
+        token = os.environ.get("TELEGRAM_BOT_TOKEN")
+        if not token:
+            print("TELEGRAM_BOT_TOKEN is not set", file=sys.stderr)
+            return 1
+        from resilience import get_breaker
+        breaker = get_breaker('telegram', failure_threshold=5, reset_timeout=60,
+                              db_path=os.path.join('data', 'resilience.sqlite3'))
+        files = {'lead': os.path.join('data', 'messages.json'), 'blog': os.path.join('data', 'blog.json')}
+        update = lambda kind, source_id, fields: update_record(files[kind], source_id, fields)
+        send = bot_api_sender(token, breaker)
+        totals = {'sent': 0, 'retrying': 0, 'failed': 0}
+        while True:
+            counts = outbox.dispatch(send, update)
+            for name, count in counts.items():
+                totals[name] += count
+            if not any(counts.values()):
+                break
+        print(f"Dispatched: {totals}")
+    print(json.dumps(outbox.stats(), ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""Shared fixtures: the Flask app on a scratch data directory with the fake AI backend"""
+
+import os
+import shutil
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported with AI_PROVIDER=fake, its data/ copied to a temporary directory"""
+    workdir = tmp_path_factory.mktemp('site')
+    shutil.copytree(os.path.join(ROOT, 'data'), workdir / 'data',
+                    ignore=shutil.ignore_patterns('*.sqlite3*', '*.lock', '*.tmp', 'admin_events.json'))
+    # WhiteNoise serves static/ relative to the working directory as well
+    os.symlink(os.path.join(ROOT, 'static'), workdir / 'static')
+    os.environ['AI_PROVIDER'] = 'fake'
+    for name in ('GEMINI_API_KEY', 'TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_ID', 'TELEGRAM_CHANNEL_ID'):
+        os.environ.pop(name, None)
+    # Storage paths in app.py are relative to the working directory
+    os.chdir(workdir)
+    import app
+    app.app.config['TESTING'] = True
+    return app
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
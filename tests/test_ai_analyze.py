@@ -0,0 +1,32 @@
+from ai_limiter import AIRateLimitExceeded
+
+def test_analyze_returns_label_and_recommendation(client, app_module):
+    response = client.post('/ai/analyze', json={'message': "Menga telegram bot kerak, buyurtmalarni qabul qilsin"})
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['success'] is True
+    assert data['analysis'] == 'telegram_bot'
+    assert data['recommendation'] == {
+        'service': 'Telegram Bot Yaratish',
+        'description': 'Telegram bot orqali mijozlar bilan avtomatik aloqa',
+        'url': '/services#telegram-bot'
+    }
+
+def test_analyze_requires_message(client):
+    response = client.post('/ai/analyze', json={'message': '  '})
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_analyze_maps_rate_limit_to_429(client, app_module, monkeypatch):
+    def exhausted(priority, estimated_tokens):
+        raise AIRateLimitExceeded(7)
+    monkeypatch.setattr(app_module.ai_limiter, 'acquire', exhausted)
+
+    # Nothing the local classifier recognises, so only Gemini could decide
+    response = client.post('/ai/analyze', json={'message': 'qwrt zxcv plmk'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '7'
+    assert response.get_json()['retry_after'] == 7
@@ -0,0 +1,54 @@
+import pytest
+
+import ai_limiter
+from ai_limiter import AIRateLimiter, AIRateLimitExceeded
+
+@pytest.fixture
+def no_wait(monkeypatch):
+    """Priorities without a wait budget, so a refused call raises at once"""
+    for priority, (slots, reserve, _) in list(ai_limiter.PRIORITY_RULES.items()):
+        monkeypatch.setitem(ai_limiter.PRIORITY_RULES, priority, (slots, reserve, 0))
+
+def test_bulk_gets_only_its_share_of_slots(tmp_path, no_wait):
+    limiter = AIRateLimiter(str(tmp_path / 'limiter.sqlite3'), max_in_flight=4)
+
+    bulk = [limiter.acquire('bulk', 10) for _ in range(2)]
+    with pytest.raises(AIRateLimitExceeded):
+        limiter.acquire('bulk', 10)
+
+    # Interactive calls may still use every slot
+    interactive = [limiter.acquire('interactive', 10) for _ in range(2)]
+    assert all(bulk + interactive)
+    assert limiter.status()['in_flight'] == 4
+    with pytest.raises(AIRateLimitExceeded):
+        limiter.acquire('interactive', 10)
+
+def test_release_frees_the_slot(tmp_path, no_wait):
+    limiter = AIRateLimiter(str(tmp_path / 'limiter.sqlite3'), max_in_flight=2)
+    lease = limiter.acquire('bulk', 10)
+    with pytest.raises(AIRateLimitExceeded):
+        limiter.acquire('bulk', 10)
+
+    limiter.release(lease)
+
+    assert limiter.acquire('bulk', 10)
+
+def test_token_reserve_is_kept_for_interactive(tmp_path, no_wait):
+    limiter = AIRateLimiter(str(tmp_path / 'limiter.sqlite3'), max_in_flight=10, tokens_per_minute=1000)
+
+    # Bulk must leave 25% of the token bucket untouched
+    with pytest.raises(AIRateLimitExceeded) as refused:
+        limiter.acquire('bulk', 800)
+    assert refused.value.retry_after >= 1
+
+    assert limiter.acquire('interactive', 800)
+
+def test_limiter_state_is_shared_between_instances(tmp_path, no_wait):
+    path = str(tmp_path / 'limiter.sqlite3')
+    first, second = AIRateLimiter(path, max_in_flight=2), AIRateLimiter(path, max_in_flight=2)
+
+    first.acquire('interactive', 10)
+    second.acquire('interactive', 10)
+
+    with pytest.raises(AIRateLimitExceeded):
+        first.acquire('interactive', 10)
@@ -0,0 +1,50 @@
+from blog_search import BlogSearchIndex, normalize_text, tokenize
+
+POSTS = [
+    {'id': 1, 'title': 'Telegram bot yaratish', 'excerpt': "Botlar haqida qo'llanma",
+     'content': '<p>Telegram bot mijozlar bilan ishlaydi. Bot buyurtma qabul qiladi.</p>'},
+    {'id': 2, 'title': 'Web sayt dizayni', 'excerpt': 'Zamonaviy sayt',
+     'content': '<p>Sayt dizayni va SEO. Telegram havolasi pastda.</p>'},
+    {'id': 3, 'title': "Sun'iy intellekt biznesda", 'excerpt': 'AI yechimlar',
+     'content': '<p>Chatbot va AI integratsiya.</p>'},
+]
+
+def make_index():
+    index = BlogSearchIndex()
+    index.sync(POSTS)
+    return index
+
+def test_title_match_ranks_first():
+    results = make_index().search('telegram')
+
+    assert [r['id'] for r in results] == [1, 2]
+    assert results[0]['score'] > results[1]['score']
+
+def test_cyrillic_and_apostrophes_match_latin():
+    assert normalize_text("Сунъий интеллект") == normalize_text("Sun'iy intellekt")
+    assert tokenize("qo‘llanma") == tokenize("qo'llanma")
+
+    assert [r['id'] for r in make_index().search('интеллект')] == [3]
+
+def test_upsert_replaces_and_remove_drops_a_post():
+    index = make_index()
+
+    assert not index.upsert(dict(POSTS[1]))
+    assert index.upsert(dict(POSTS[1], content='<p>Faqat dizayn.</p>'))
+    assert [r['id'] for r in index.search('telegram')] == [1]
+
+    index.remove(1)
+    assert index.search('telegram') == []
+    assert len(index) == 2
+
+def test_sync_drops_posts_missing_from_storage():
+    index = make_index()
+
+    assert index.sync(POSTS[:2]) == 1
+    assert index.search('chatbot') == []
+
+def test_no_results_for_unknown_or_empty_queries():
+    index = make_index()
+
+    assert index.search('') == []
+    assert index.search('blokcheyn') == []
@@ -0,0 +1,84 @@
+import json
+
+from blog_search import RelatedPostsIndex
+
+TOPICS = {
+    'bot': 'telegram bot xabar guruh buyurtma',
+    'web': 'sayt dizayn frontend sahifa hosting',
+    'ai': 'gemini model neyron matn tahlil',
+}
+
+def post(post_id, topic, extra=''):
+    words = TOPICS[topic]
+    return {'id': post_id, 'title': f'{words} {post_id}', 'excerpt': words,
+            'content': f'<p>{words} {words} {extra}</p>'}
+
+POSTS = [post(1, 'bot'), post(2, 'bot'), post(3, 'web'), post(4, 'web'), post(5, 'ai'), post(6, 'ai')]
+
+def make_index(tmp_path, posts=POSTS, k=2):
+    index = RelatedPostsIndex(str(tmp_path / 'related.json'), k=k)
+    index.rebuild(posts)
+    return index
+
+def test_neighbours_share_the_topic(tmp_path):
+    index = make_index(tmp_path)
+
+    assert index.neighbours(1)[0] == 2
+    assert index.neighbours(3)[0] == 4
+    assert index.neighbours(5)[0] == 6
+    assert 1 not in index.neighbours(1)
+
+def test_add_updates_only_the_new_post_and_its_neighbours(tmp_path):
+    index = make_index(tmp_path)
+
+    index.add(post(7, 'web', 'sayt sayt'))
+
+    assert index.neighbours(7)[0] in (3, 4)
+    # Similarity is symmetric: the new post enters the lists of its topic
+    assert 7 in index.neighbours(3)
+    assert 7 not in index.neighbours(1)
+
+def test_incremental_adds_match_a_full_rebuild(tmp_path):
+    incremental = RelatedPostsIndex(str(tmp_path / 'incremental.json'), k=2)
+    incremental.rebuild(POSTS[:1])
+    for p in POSTS[1:]:
+        incremental.add(p)
+    full = make_index(tmp_path)
+
+    for p in POSTS:
+        assert incremental.neighbours(p['id'])[0] == full.neighbours(p['id'])[0]
+
+def test_edited_post_leaves_stale_lists(tmp_path):
+    index = make_index(tmp_path)
+    assert 2 in index.neighbours(1)
+
+    index.add(post(2, 'ai'))
+
+    assert 2 not in index.neighbours(1)
+    assert index.neighbours(2)[0] in (5, 6)
+    assert 2 in index.neighbours(5)
+
+def test_remove_recomputes_lists_that_pointed_at_the_post(tmp_path):
+    index = make_index(tmp_path)
+
+    index.remove(2)
+
+    assert 2 not in index.neighbours(1)
+    assert index.neighbours(2) == []
+    assert all(2 not in index.neighbours(p['id']) for p in POSTS)
+
+def test_table_is_shared_through_the_file(tmp_path):
+    make_index(tmp_path).add(post(7, 'bot'))
+
+    other = RelatedPostsIndex(str(tmp_path / 'related.json'), k=2)
+    assert other.neighbours(7)[0] in (1, 2)
+    stored = json.loads((tmp_path / 'related.json').read_text(encoding='utf-8'))
+    assert set(stored['docs']) == {str(p['id']) for p in POSTS} | {'7'}
+
+def test_first_add_builds_the_table_from_storage(tmp_path):
+    index = RelatedPostsIndex(str(tmp_path / 'related.json'), k=2, load_posts=lambda: POSTS)
+
+    index.add(POSTS[0])
+
+    assert index.neighbours(1)[0] == 2
+    assert index.neighbours(6)[0] == 5
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from json_store import update_record
+from resilience import TransientError
+from telegram_outbox import TelegramOutbox
+
+PAYLOAD = {'chat_id': '1', 'text': 'Yangi murojaat'}
+
+@pytest.fixture
+def outbox(tmp_path):
+    return TelegramOutbox(str(tmp_path / 'outbox.sqlite3'), max_attempts=3, base_delay=0)
+
+def entry_row(outbox, key):
+    return outbox.db.execute('SELECT status, attempts, last_error FROM telegram_outbox WHERE key = ?',
+                             (key,)).fetchone()
+
+def test_enqueue_is_idempotent(outbox):
+    assert outbox.enqueue('lead:1:2025-01-01', 'sendMessage', PAYLOAD, 'lead', 1)
+    assert not outbox.enqueue('lead:1:2025-01-01', 'sendMessage', PAYLOAD, 'lead', 1)
+
+    sent = []
+    outbox.dispatch(lambda method, payload: sent.append(payload) or True)
+    # A key that was already sent is not queued again either
+    assert not outbox.enqueue('lead:1:2025-01-01', 'sendMessage', PAYLOAD, 'lead', 1)
+    outbox.dispatch(lambda method, payload: sent.append(payload) or True)
+
+    assert sent == [PAYLOAD]
+
+def test_transient_failure_is_retried_then_sent(outbox):
+    outbox.enqueue('lead:2:x', 'sendMessage', PAYLOAD, 'lead', 2)
+    updates = []
+
+    def flaky(method, payload):
+        raise TransientError('Telegram sendMessage HTTP 502')
+
+    assert outbox.dispatch(flaky, lambda *args: updates.append(args)) == {'sent': 0, 'retrying': 1, 'failed': 0}
+    assert entry_row(outbox, 'lead:2:x')[:2] == ('pending', 1)
+    # The source record is only written once the outcome is final
+    assert updates == []
+
+    assert outbox.dispatch(lambda method, payload: True, lambda *args: updates.append(args))['sent'] == 1
+    assert entry_row(outbox, 'lead:2:x')[:2] == ('sent', 2)
+    kind, source_id, fields = updates[0]
+    assert (kind, source_id) == ('lead', '2')
+    assert fields['telegram_sent'] is True and fields['telegram_status'] == 'sent'
+
+def test_gives_up_after_max_attempts(outbox):
+    outbox.enqueue('blog:3:slug', 'sendMessage', PAYLOAD, 'blog', 3)
+    updates = []
+
+    def down(method, payload):
+        raise TransientError('timeout')
+
+    for _ in range(3):
+        outbox.dispatch(down, lambda *args: updates.append(args))
+
+    status, attempts, error = entry_row(outbox, 'blog:3:slug')
+    assert (status, attempts) == ('failed', 3)
+    assert 'timeout' in error
+    assert updates[0][2]['telegram_status'] == 'failed'
+    # Nothing is due any more
+    assert outbox.dispatch(down) == {'sent': 0, 'retrying': 0, 'failed': 0}
+
+def test_rejected_message_is_not_retried(outbox):
+    outbox.enqueue('lead:4:x', 'sendMessage', PAYLOAD, 'lead', 4)
+
+    assert outbox.dispatch(lambda method, payload: False)['failed'] == 1
+    assert entry_row(outbox, 'lead:4:x')[:2] == ('failed', 1)
+
+def test_replay_makes_failed_entries_due(outbox):
+    outbox.enqueue('lead:5:x', 'sendMessage', PAYLOAD, 'lead', 5)
+    outbox.dispatch(lambda method, payload: False)
+
+    assert outbox.replay(kind='lead') == 1
+    assert outbox.dispatch(lambda method, payload: True)['sent'] == 1
+
+def test_backoff_delays_the_next_attempt(tmp_path):
+    outbox = TelegramOutbox(str(tmp_path / 'outbox.sqlite3'), base_delay=60)
+    outbox.enqueue('lead:6:x', 'sendMessage', PAYLOAD, 'lead', 6)
+
+    def flaky(method, payload):
+        raise TransientError('HTTP 429')
+
+    outbox.dispatch(flaky)
+
+    # Not due again before the backoff delay has passed
+    assert outbox.dispatch(lambda method, payload: True) == {'sent': 0, 'retrying': 0, 'failed': 0}
+
+def test_delivery_result_updates_the_json_record(tmp_path, outbox):
+    messages = tmp_path / 'messages.json'
+    messages.write_text(json.dumps([{'id': 7, 'telegram_sent': False}]), encoding='utf-8')
+    outbox.enqueue('lead:7:x', 'sendMessage', PAYLOAD, 'lead', 7)
+
+    outbox.dispatch(lambda method, payload: True,
+                    lambda kind, source_id, fields: update_record(str(messages), source_id, fields))
+
+    record = json.loads(messages.read_text(encoding='utf-8'))[0]
+    assert record['telegram_sent'] is True
+    assert record['telegram_status'] == 'sent'